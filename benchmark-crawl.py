@@ -0,0 +1,102 @@
+"""Benchmark crawl throughput offline, against the local fixture server.
+
+Starts fixtureserver.py in a separate process (serving the already-scraped
+posts zipfile), then fetches the same recent-entries pages with the
+one-at-a-time fetcher and with the concurrent fetcher at each of the
+requested connection limits. Reports pages/sec and p50/p99 request latency.
+Both fetchers use the usual retry/backoff policy, so injected errors
+show up as retries.
+
+Nothing gets written to the data directory, results are just printed.
+
+IMPORTS
+=======
+    - raw posts, source/dreamviews-posts.zip
+"""
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+import crawl
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--n-pages", type=int, default=200, help="How many recent-entries pages to fetch per run.")
+parser.add_argument("--max-connections", type=int, nargs="+", default=[4, 8, 16], help="Connection limits to try in concurrent mode.")
+parser.add_argument("--min-interval", type=float, default=0, help="Politeness spacing for concurrent mode (0 to measure raw throughput).")
+parser.add_argument("--latency", type=float, default=.05, help="Server-side delay per response.")
+parser.add_argument("--jitter", type=float, default=.02, help="Random extra server-side delay per response.")
+parser.add_argument("--error-rate", type=float, default=0, help="Proportion of injected server errors.")
+parser.add_argument("--port", type=int, default=8765)
+args = parser.parse_args()
+
+
+BASE_URL = f"http://127.0.0.1:{args.port}"
+urls = [ f"{BASE_URL}/blogs/recent-entries/index{i}.html" for i in range(1, args.n_pages+1) ]
+
+
+def wait_for_server(port, timeout=10):
+    t_end = time.time() + timeout
+    while time.time() < t_end:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(.1)
+    raise RuntimeError(f"fixture server didn't start on port {port}")
+
+
+def summarize(mode, results, wall_time, policy):
+    latencies = np.array([ r.elapsed for r in results ])
+    return {
+        "mode"        : mode,
+        "pages"       : len(results),
+        "retries"     : policy.metrics.retries,
+        "errors"      : sum( not crawl.result_ok(r) for r in results ),
+        "wall_sec"    : wall_time,
+        "pages/sec"   : len(results) / wall_time,
+        "p50_latency" : np.percentile(latencies, 50),
+        "p99_latency" : np.percentile(latencies, 99),
+        "MB"          : sum( len(r.content) for r in results ) / 1e6,
+    }
+
+
+def run_sync():
+    policy = crawl.FetchPolicy()
+    t0 = time.perf_counter()
+    with crawl.RequestsFetcher(policy) as fetcher:
+        results = [ fetcher.fetch(u) for u in urls ]
+    return results, time.perf_counter() - t0, policy
+
+
+async def run_concurrent(max_connections):
+    policy = crawl.FetchPolicy(min_interval=args.min_interval)
+    t0 = time.perf_counter()
+    async with crawl.AiohttpFetcher(max_connections, policy=policy) as fetcher:
+        results = await asyncio.gather(*[ fetcher.fetch(u) for u in urls ])
+    return results, time.perf_counter() - t0, policy
+
+
+server = subprocess.Popen([sys.executable, "fixtureserver.py",
+    "--port", str(args.port), "--seed", "0",
+    "--latency", str(args.latency), "--jitter", str(args.jitter),
+    "--error-rate", str(args.error_rate)])
+
+try:
+    wait_for_server(args.port)
+    rows = [ summarize("sync", *run_sync()) ]
+    for n in args.max_connections:
+        rows.append(summarize(f"concurrent-{n}", *asyncio.run(run_concurrent(n))))
+finally:
+    server.terminate()
+    server.wait()
+
+
+summary = pd.DataFrame(rows).set_index("mode")
+print(summary.round(4).to_string())
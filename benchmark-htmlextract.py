@@ -0,0 +1,121 @@
+"""Check and time the htmlextract backends against each other.
+
+clean-posts.py and clean-users.py can parse the raw html with either
+BeautifulSoup ("bs4", always used before) or lxml (see htmlextract).
+They're supposed to pull out exactly the same text. This runs every
+backend over a sample of raw pages from the posts archive (and the
+users archive, if it's there), stops with an error if any page comes
+out different from bs4, and then prints pages/sec for each backend.
+A few small hand-made pages (TEST_PAGES) get checked first, for
+cases the archives might not have, like a <dt> without a <dd>.
+
+Nothing gets written to the data directory, results are just printed.
+
+IMPORTS
+=======
+    - raw posts, source/dreamviews-posts.zip
+    - raw users, source/dreamviews-users.zip
+"""
+import os
+import sys
+import time
+import zipfile
+import argparse
+
+import pandas as pd
+
+import config as c
+import htmlextract
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--posts-archive", default=os.path.join(c.DATA_DIR, "source", "dreamviews-posts.zip"), help="Zipfile of raw listing pages.")
+parser.add_argument("--users-archive", default=os.path.join(c.DATA_DIR, "source", "dreamviews-users.zip"), help="Zipfile of raw profile pages.")
+parser.add_argument("--n-pages", type=int, default=200, help="How many pages to take from the start of each archive.")
+parser.add_argument("--repeats", type=int, default=3, help="Time each backend over all the pages this many times (takes the best).")
+args = parser.parse_args()
+
+
+EXTRACTORS = {
+    "posts" : (args.posts_archive, htmlextract.posts_page),
+    "users" : (args.users_archive, htmlextract.profile_page),
+}
+
+
+# hand-made pages and what every backend has to pull out of them
+TEST_PAGES = {
+    "users" : [
+        # trailing <dt> with no <dd> after it, the response is None (clean-users.py skips it)
+        (b"<html><body><dl><dt>Location:</dt><dd>Canada</dd><dt>Gender:</dt></dl></body></html>",
+            [("Location:", "Canada"), ("Gender:", None)]),
+    ],
+}
+
+
+def load_sample_pages(archive_fname, n_pages):
+    with zipfile.ZipFile(archive_fname, mode="r") as zf:
+        return [ zf.read(fn) for fn in zf.namelist()[:n_pages] ]
+
+
+def pages_per_sec(extract, pages, backend, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for page in pages:
+            extract(page, backend=backend)
+        best = min(best, time.perf_counter() - t0)
+    return len(pages) / best
+
+
+rows = []
+n_different = 0
+
+for kind, test_pages in TEST_PAGES.items():
+    _, extract = EXTRACTORS[kind]
+    for i, (page, expected) in enumerate(test_pages):
+        for backend in htmlextract.BACKENDS:
+            result = extract(page, backend=backend)
+            if result != expected:
+                n_different += 1
+                print(f"MISMATCH {kind} test page {i} ({backend})\n  expected: {expected!r}\n  {backend}: {result!r}")
+print(f"{sum(map(len, TEST_PAGES.values()))} test pages checked")
+for kind, (archive_fname, extract) in EXTRACTORS.items():
+
+    if not os.path.isfile(archive_fname):
+        print(f"no {archive_fname}, skipping {kind} pages")
+        continue
+    pages = load_sample_pages(archive_fname, args.n_pages)
+    print(f"{len(pages)} {kind} pages")
+
+    # equivalence check, every page has to come out exactly the same as with bs4
+    for i, page in enumerate(pages):
+        expected = extract(page, backend="bs4")
+        for backend in htmlextract.BACKENDS[1:]:
+            result = extract(page, backend=backend)
+            if result != expected:
+                n_different += 1
+                if n_different <= 5:
+                    # show the first field that's different
+                    for x, y in zip(expected, result):
+                        if x != y:
+                            break
+                    else:
+                        x, y = f"{len(expected)} items", f"{len(result)} items"
+                    print(f"MISMATCH {kind} page {i} ({backend})\n  bs4:     {str(x)[:300]!r}\n  {backend}: {str(y)[:300]!r}")
+
+    for backend in htmlextract.BACKENDS:
+        rows.append({
+            "pages"     : kind,
+            "backend"   : backend,
+            "pages/sec" : pages_per_sec(extract, pages, backend, args.repeats),
+        })
+
+if n_different:
+    sys.exit(f"{n_different} pages came out different")
+print("all backends extracted the same")
+
+summary = pd.DataFrame(rows).set_index(["pages", "backend"])["pages/sec"]
+print(summary.round(1).to_string())
+for kind in summary.index.unique("pages"):
+    speedup = summary[kind].max() / summary[(kind, "bs4")]
+    print(f"{kind} speedup: {speedup:.2f}x ({summary[kind].idxmax()})")
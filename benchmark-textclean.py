@@ -0,0 +1,138 @@
+"""Check and time textclean.clean_post_text against the old cleaning code.
+
+clean-posts.py used to clean the post text with one re.sub after another
+(copied below as legacy_clean_post_text). textclean.clean_post_text is
+supposed to give exactly the same text, just faster. This runs both over
+every post in a sample of raw html pages, stops with an error if any
+post comes out different, and then prints chars/sec for each.
+
+Nothing gets written to the data directory, results are just printed.
+
+IMPORTS
+=======
+    - raw posts, source/dreamviews-posts.zip
+"""
+import os
+import re
+import sys
+import time
+import zipfile
+import argparse
+
+import contractions
+import pandas as pd
+
+from bs4 import BeautifulSoup
+
+import config as c
+import textclean
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--archive", default=os.path.join(c.DATA_DIR, "source", "dreamviews-posts.zip"), help="Zipfile of raw html pages.")
+parser.add_argument("--n-pages", type=int, default=500, help="How many pages to take posts from (from the start of the archive).")
+parser.add_argument("--repeats", type=int, default=3, help="Time each version over all the posts this many times (takes the best).")
+args = parser.parse_args()
+
+
+def legacy_clean_post_text(post_txt):
+    """The cleaning steps of clean-posts.py before textclean, verbatim."""
+
+    # Replace the few stupid apostrophe representations.
+    post_txt = post_txt.replace("&#39;", "'")
+
+    ## Minor text corrections to make later life easier.
+    # replace ampersands
+    post_txt = post_txt.replace("&", "and")
+    # replace contractions with full words
+    post_txt = contractions.fix(post_txt, slang=True)
+    # replace any sequence of 4+ characters with 1 of that character
+    # gets rid of stuff like whoaaaaaaaaaaaa and --------------------
+    # will lead to some errors because it replaces with 1 letter but sometimes will need 2
+    post_txt = re.sub(r"(.)\1{3,}", r"\1", post_txt, flags=re.IGNORECASE)
+
+
+    ## DreamViews posts have some commons text patterns that can be removed.
+    ## These are all regexes that are specific to the needs of cleaning DreamViews text.
+
+    # There are some leftover block formatting tags.
+    post_txt = re.sub(r"\[(/?INDENT|/?RIGHT|/?CENTER|/?B)\]", "", post_txt, flags=re.IGNORECASE)
+    # These ones never have a = preceding them.
+    post_txt = re.sub(r"\[/?(INDENT|RIGHT|CENTER|B|I|U|HR|IMG|LINK_TO_ANCHOR|SARCASM|DREAM LOGIC)\]", "", post_txt, flags=re.IGNORECASE)
+    # These need some leway as to what comes after because sometimes there's stuff there.
+    post_txt = re.sub(r"\[/?COLOR.*?\]", "", post_txt, flags=re.IGNORECASE)
+    post_txt = re.sub(r"\[/?SIZE.*?\]", "", post_txt, flags=re.IGNORECASE)
+    post_txt = re.sub(r"\[/?FONT.*?\]", "", post_txt, flags=re.IGNORECASE)
+    post_txt = re.sub(r"\[/?QUOTE.*?\]", "", post_txt, flags=re.IGNORECASE)
+    post_txt = re.sub(r"\[/?SPOILER.*?\]", "", post_txt, flags=re.IGNORECASE)
+    post_txt = re.sub(r"\[/?URL.*?\]", "", post_txt, flags=re.IGNORECASE)
+    post_txt = re.sub(r"\[ATTACH=CONFIG\][0-9]*\[/ATTACH\]", "", post_txt, flags=re.IGNORECASE)
+
+    # Posts can be updated and have this stereotyped amendment
+    # at the end if they were (about 20% of posts have this).
+    # Example: Updated 12-08-2021 at 10:28 PM by 34880
+    # Example: Updated 08-05-2017 at 01:09 PM by 93119 (Added Categories)
+    # Example: Updated 04-20-2014 at 12:36 PM by 68865 (remembered another fragment)
+    updated_re = r" Updated [0-9]{2}-[0-9]{2}-[0-9]{4} at [0-9]{2}:[0-9]{2} [AP]M by [0-9]{1,5}( \(.*?\))?"
+    post_txt = re.sub(updated_re, "", post_txt)
+
+
+    ## Redactions.
+    # redact emails
+    # The text already has some "@[email\xa0protected]" parts, basically anything after an @. Kinda dumb.
+    # They aren't always emails so just replace with nothing.
+    post_txt = re.sub(r"@\[email protected\]", "", post_txt) # first
+    post_txt = re.sub(r"\S*@\S*\s?", "[[URL]]", post_txt) # just in case there are still any
+
+    # redact URLs
+    post_txt = re.sub(r"https?://\S+", "[[URL]]", post_txt, flags=re.IGNORECASE)
+    post_txt = re.sub(r"www\.\S+", "[[URL]]", post_txt, flags=re.IGNORECASE)
+
+    return post_txt
+
+
+def load_sample_posts(archive_fname, n_pages):
+    """ASCII post text (minus tags and categories) of all the posts on the first n_pages."""
+    posts = []
+    with zipfile.ZipFile(archive_fname, mode="r") as zf:
+        for fn in zf.namelist()[:n_pages]:
+            soup = BeautifulSoup(zf.read(fn), "html.parser", from_encoding="windows-1252")
+            for post in soup.find_all("div", class_="blogbody"):
+                post_txt = re.split(r"Tags:|Categories", post.text)[0]
+                posts.append(textclean.convert2ascii(post_txt))
+    return posts
+
+
+def chars_per_sec(func, posts, repeats):
+    n_chars = sum( len(p) for p in posts )
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for p in posts:
+            func(p)
+        best = min(best, time.perf_counter() - t0)
+    return n_chars / best
+
+
+posts = load_sample_posts(args.archive, args.n_pages)
+print(f"{len(posts)} posts, {sum( len(p) for p in posts )} chars")
+
+# golden check, every post has to come out exactly the same
+n_different = 0
+for post_txt in posts:
+    expected = legacy_clean_post_text(post_txt)
+    result = textclean.clean_post_text(post_txt)
+    if result != expected:
+        n_different += 1
+        if n_different <= 5:
+            print(f"MISMATCH\n  input:    {post_txt[:200]!r}\n  legacy:   {expected[:200]!r}\n  textclean: {result[:200]!r}")
+if n_different:
+    sys.exit(f"{n_different} of {len(posts)} posts cleaned differently")
+print("all posts cleaned the same")
+
+summary = pd.Series({
+    "legacy"    : chars_per_sec(legacy_clean_post_text, posts, args.repeats),
+    "textclean" : chars_per_sec(textclean.clean_post_text, posts, args.repeats),
+}, name="chars/sec")
+print(summary.round(0).to_string())
+print(f"speedup: {summary['textclean'] / summary['legacy']:.2f}x")
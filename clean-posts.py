@@ -37,16 +37,42 @@ Some notes about what I'm NOT removing
 This is in NO WAY optimized for speed. It takes too long,
 lots of text gets analyzed that is later tossed out. W/e.
 Not a huge concern it's really only running once.
+The parsing/cleaning of pages can at least be spread over
+multiple processes with --jobs, which doesn't change any IDs.
+And posts with a word count way outside the limits get dropped
+before language detection and spaCy (see --prefilter-margin).
+How many posts each restriction drops gets printed at the end.
+
+The slow results (html parsing, cleaned text, language, spaCy entities
+and lemmas) get cached by the raw content they came from (see postcache),
+so a rerun after changing a restriction only redoes what actually changed.
+Use --no-cache to do everything from scratch.
+
+With --partition the typed posts also get written as a directory of
+parquet files split up by year and lucidity, so loading one year or
+one lucidity label only reads those files (see config.load_dreamviews_posts).
+
+IMPORTS
+=======
+    - raw html pages, source/dreamviews-posts.zip
+EXPORTS
+=======
+    - cleaned posts,             derivatives/dreamviews-posts.tsv
+    - same but typed (faster),   derivatives/dreamviews-posts.parquet
+    - username to userid legend, derivatives/dreamviews-users_key.json
 """
 import os
 import re
 import json
+import shutil
 import tqdm
 import zipfile
+import argparse
 import datetime
+import itertools
+import importlib.metadata
+import multiprocessing
 
-import unidecode
-import contractions
 import langdetect
 import spacy
 
@@ -55,11 +81,43 @@ import random
 
 import pandas as pd
 
-from bs4 import BeautifulSoup
-
-# from collections import Counter
+from collections import Counter
 
 import config as c
+import htmlextract
+import postcache
+import stageprofile
+import textclean
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes for parsing/cleaning pages.")
+parser.add_argument("--prefilter-margin", type=float, default=.5,
+    help="How far (proportionally) outside the word count limits a rough word count has to be to skip langdetect and spaCy.")
+parser.add_argument("--no-prefilter", action="store_true", help="Send every post through langdetect and spaCy.")
+parser.add_argument("--spacy-batch-size", type=int, default=128, help="Number of posts spaCy gets at once.")
+parser.add_argument("--spacy-processes", type=int, default=1, help="Number of processes for spaCy.")
+parser.add_argument("--spacy-pipeline", choices=["full", "minimal"], default="full",
+    help="Run the whole spaCy model, or only the components needed for redaction (and lemmas).")
+parser.add_argument("--no-lemmas", action="store_true", help="Skip lemmatizing (post_lemmas is left empty).")
+parser.add_argument("--no-cache", action="store_true", help="Don't read or write the cache of parsed/cleaned/analyzed posts.")
+parser.add_argument("--html-backend", choices=htmlextract.BACKENDS, default="bs4",
+    help="How to parse the html pages (lxml is faster, see benchmark-htmlextract.py).")
+parser.add_argument("--profile", action="store_true", help="Time each stage of parsing/cleaning and write a report at the end.")
+parser.add_argument("--partition", action="store_true", help="Also write the posts split up by year and lucidity (faster to load parts of).")
+args = parser.parse_args()
+
+N_JOBS = args.jobs
+PREFILTER = not args.no_prefilter
+PREFILTER_MARGIN = args.prefilter_margin
+SPACY_BATCH_SIZE = args.spacy_batch_size
+SPACY_N_PROCESS = args.spacy_processes
+SPACY_PIPELINE = args.spacy_pipeline
+LEMMAS = not args.no_lemmas
+CACHE = not args.no_cache
+PROFILE = args.profile
+HTML_BACKEND = args.html_backend
+PARTITION = args.partition
 
 
 ############ Make sure NLTK and spaCy tools are downloaded.
@@ -67,21 +125,41 @@ import config as c
 # don't use the small model -- bad at entity recognition. large and trf are good
 SPACY_MODEL = "en_core_web_lg" # en_core_web_lg, en_core_web_trf (en_core_web_sm for testing only)
 
-# check spaCy model
-if not spacy.util.is_package(SPACY_MODEL):
-    resp = input(f"{SPACY_MODEL} not found -- download now?? (Y/n)")
-    if resp.lower() in ["", "y"]:
-        spacy.cli.download(SPACY_MODEL)
-
 ####### Load spaCy model
 
-# Only redacting here, which is just named entity recognition.
-# For the lg model you can disable most other thing and this
-# will speed up the spaCy/nlp stuff. You can't get lemmas but okay.
-SPACY_PIPE_DISABLES = ["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer"]
-# nlp = spacy.load(SPACY_MODEL, disable=SPACY_PIPE_DISABLES)
-nlp = spacy.load(SPACY_MODEL)
-nlp.add_pipe("merge_entities") # so "john paul" gets treated as a single entity
+# Only some of the pipeline components are needed for what comes out of here.
+# Redacting is just named entity recognition (plus merging multi-word entities).
+# Lemmas need the tagger for parts-of-speech, which the lemmatizer uses.
+# The parser is never needed. For the lg model the ner has its own tok2vec
+# so with --no-lemmas almost everything else can go, which speeds up the
+# spaCy/nlp stuff a lot. (Word counts only need the tokenizer.)
+SPACY_REDACT_PIPES = ["ner"]
+SPACY_LEMMA_PIPES = ["tagger", "attribute_ruler", "lemmatizer"]
+
+def spacy_pipe_disables(nlp, lemmas=True):
+    """Names of the components in nlp that aren't needed for redacting
+    (and lemmatizing, if lemmas). Shared embedding layers (tok2vec, or
+    transformer for trf) are kept if anything still needed listens to them.
+    """
+    needed = set(SPACY_REDACT_PIPES)
+    if lemmas:
+        needed.update(SPACY_LEMMA_PIPES)
+    for name, pipe in nlp.pipeline:
+        if needed & set(getattr(pipe, "listening_components", [])):
+            needed.add(name)
+    return [ name for name in nlp.pipe_names if name not in needed ]
+
+def load_spacy(pipeline="full", lemmas=True):
+    # check spaCy model
+    if not spacy.util.is_package(SPACY_MODEL):
+        resp = input(f"{SPACY_MODEL} not found -- download now?? (Y/n)")
+        if resp.lower() in ["", "y"]:
+            spacy.cli.download(SPACY_MODEL)
+    nlp = spacy.load(SPACY_MODEL)
+    if pipeline == "minimal":
+        nlp.select_pipes(disable=spacy_pipe_disables(nlp, lemmas=lemmas))
+    nlp.add_pipe("merge_entities") # so "john paul" gets treated as a single entity
+    return nlp
 
 
 # # restrict uber-short posts, token limit later will catch most
@@ -89,27 +167,14 @@ nlp.add_pipe("merge_entities") # so "john paul" gets treated as a single entity
 # MINIMUM_ALPHA_CHARS = 10
 
 
-def convert2ascii(txt, retain_whitespace_count=False):
-    # Replace annoying unicode surrogates (??) that cause warnings in unidecode.
-    ascii_txt = re.sub(surrogate_re, " ", txt)
-    # Unidecode does the heavy-lifting on conversion to ASCII.
-    ascii_txt = unidecode.unidecode(ascii_txt, errors="ignore", replace_str="")
-    # Replace some non-printable whitespace characters that are technically ASCII but not printable.
-    ascii_txt = re.sub(extra_ascii_chars, " ", ascii_txt)
-    # Reduce to single whitespaces. (*after* ASCII conversion)
-    whitespace_re = r"\s" if retain_whitespace_count else r"\s+"
-    ascii_txt = re.sub(whitespace_re, " ", ascii_txt)
-    # Final strip to be sure there aren't leading/trailing whitespaces after all the processing.
-    if not retain_whitespace_count:
-        ascii_txt = ascii_txt.strip()
-    assert ascii_txt.isascii() and ascii_txt.isprintable()
-    return ascii_txt
-
-
 # initialize a separate random object so the seed is different from other one
 rd4lemma = random.Random()
 rd4lemma.seed(6)
-def lemmatize(doc, shuffle=False, pos_remove_list=["PROPN", "SMY"]):
+# Part of the "spacy" cache key (see STAGE_VERSIONS), bump it whenever
+# lemmatize's filtering rules (or anything else analyze_doc keeps) change,
+# otherwise reruns keep using lemmas from the old rules.
+LEMMATIZE_VERSION = "1"
+def lemmatize(doc, pos_remove_list=["PROPN", "SMY"]):
     """takes a spaCy doc.
     Not stressing too hard on this because it's likely
     that one will want to tokenize/lemmatize their own way.
@@ -126,6 +191,10 @@ def lemmatize(doc, shuffle=False, pos_remove_list=["PROPN", "SMY"]):
             ) and (not token.is_oov
             ) and (not token.pos_ in pos_remove_list):
             token_list.append( token.lemma_.lower() ) # *almost* always lowercase by default
+    return token_list
+
+def join_lemmas(token_list, shuffle=False):
+    """lemmatize output to a single string (None if there aren't any)"""
     if shuffle:
         token_list = random.sample(token_list, len(token_list))
     return " ".join(token_list) if token_list else None
@@ -144,19 +213,115 @@ def generate_id(n_chars):
         id_string = _gen_str(n_chars)
     return id_string.upper()
 
+# generate_id hex strings that start with a letter (a-f)
+generate_id_space = lambda n_chars: 6 * 16**(n_chars-1)
+
+
+class IDAllocator:
+    """Hands out random IDs that haven't been handed out before.
+
+    IDs come from generate(n_chars) (generate_id by default, so they
+    depend on the state of rd) and get redrawn until one is new, same as
+    a while loop over all the old IDs but with a set so it doesn't slow
+    down as IDs pile up. Keeps count of how often a redraw was needed.
+    Give space_size (how many different IDs generate can make)
+    to also see how full the ID space is getting.
+    """
+    def __init__(self, n_chars, generate=generate_id, space_size=None):
+        self.n_chars = n_chars
+        self.generate = generate
+        self.space_size = generate_id_space(n_chars) if space_size is None and generate is generate_id else space_size
+        self.used = set()
+        self.n_collisions = 0
+
+    def __contains__(self, id_string):
+        return id_string in self.used
+
+    def __len__(self):
+        return len(self.used)
+
+    def new_id(self):
+        id_string = self.generate(self.n_chars)
+        while id_string in self.used:
+            self.n_collisions += 1
+            id_string = self.generate(self.n_chars)
+        self.used.add(id_string)
+        return id_string
+
+    def stats(self):
+        stats = {"n_ids": len(self.used), "n_collisions": self.n_collisions}
+        if self.space_size is not None:
+            stats["space_size"] = self.space_size
+            stats["space_used"] = len(self.used) / self.space_size
+        return stats
+
 
 import_fname = os.path.join(c.DATA_DIR, "source", "dreamviews-posts.zip")
 
 export_fname_posts   = os.path.join(c.DATA_DIR, "derivatives", "dreamviews-posts.tsv")
+export_fname_posts_parquet = os.path.join(c.DATA_DIR, "derivatives", "dreamviews-posts.parquet")
+export_dirname_posts_partitioned = os.path.join(c.DATA_DIR, "derivatives", "dreamviews-posts_partitioned")
 export_fname_userkey = os.path.join(c.DATA_DIR, "derivatives", "dreamviews-users_key.json")
+cache_fname = os.path.join(c.DATA_DIR, "derivatives", "clean-posts_cache.sqlite")
+profile_fname_json = os.path.join(c.DATA_DIR, "derivatives", "clean-posts_profile.json")
+profile_fname_tsv  = os.path.join(c.DATA_DIR, "derivatives", "clean-posts_profile.tsv")
 
 # create datetime objects for comparison later
 start_datetime = datetime.datetime.strptime(c.START_DATE, "%Y-%m-%d")
 end_datetime = datetime.datetime.strptime(c.END_DATE, "%Y-%m-%d")
 
-# read in all the html files at once
-with zipfile.ZipFile(import_fname, mode="r") as zf:
-    html_files = [ zf.read(fn) for fn in zf.namelist() ]
+# Slow results get cached by the (hash of the) raw content they came from
+# (see postcache). "page" is the raw entries extracted from an html page,
+# the rest are per post. Bump a version whenever its stage would give
+# something different, so old results don't get reused.
+PAGE_VERSION = "1" # for parse_html_page's extraction
+LANGDETECT_VERSION = importlib.metadata.version("langdetect")
+SPACY_MODEL_VERSION = spacy.util.get_package_version(SPACY_MODEL)
+STAGE_VERSIONS = {
+    "page"     : f"{PAGE_VERSION}/{HTML_BACKEND}",
+    "text"     : textclean.VERSION,
+    "language" : f"{textclean.VERSION}/langdetect-{LANGDETECT_VERSION}",
+    "spacy"    : f"{textclean.VERSION}/spacy-{spacy.__version__}/{SPACY_MODEL}-{SPACY_MODEL_VERSION}-{SPACY_PIPELINE}"
+                 f"/lemmatize-{LEMMATIZE_VERSION}" + ("" if LEMMAS else "-nolemmas"),
+}
+
+# With --profile, time each stage of the cleaning (see stageprofile).
+# Functions from other packages get timed by patching them, and the
+# rest get a `with profiler.stage(...)` around them. Does nothing otherwise.
+profiler = stageprofile.StageProfiler(enabled=PROFILE)
+profiler.patch(textclean.unidecode, "unidecode", "unidecode")
+profiler.patch(textclean.contractions, "fix", "contractions.fix")
+profiler.patch(langdetect, "detect", "langdetect")
+
+
+post_cache = None
+def get_post_cache():
+    """The cache for this process (worker processes each open their own).
+
+    Workers are spawned, not forked (see __main__), so they never
+    start out with the main process's connection.
+    """
+    global post_cache
+    if post_cache is None or post_cache.pid != os.getpid():
+        post_cache = postcache.PostCache(cache_fname if CACHE else None, STAGE_VERSIONS)
+    return post_cache
+
+
+def iter_html_files(archive_fnames):
+    """Yield (is_delta, html bytes) for every raw html page, one at a time.
+
+    Pages are read lazily from the zipfiles so only the one
+    currently being parsed is held in memory (the decompressed
+    archive is much bigger than any machine we want to run this on).
+    Any "delta" zipfiles from incremental crawls come after the main one.
+    """
+    for archive_fname in archive_fnames:
+        is_delta = archive_fname != import_fname
+        with zipfile.ZipFile(archive_fname, mode="r") as zf:
+            for fn in zf.namelist():
+                with profiler.stage("read_page"):
+                    html_byt = zf.read(fn)
+                yield is_delta, html_byt
 
 
 
@@ -167,60 +332,382 @@ with zipfile.ZipFile(import_fname, mode="r") as zf:
 entities_to_redact = ["PERSON"] #, "LOC", "GPE", "ORG", "DATE", "TIME"]
 
 
-surrogate_re = r"[\ud83d\ud83c\udf37\udf38\udf39\udf3a\udc2c]+"
-# control_chars_re = r"[^\x09\x0A\x0D\x20-\x7F]+"
-# control_chars_re = r"[^\x00-\x7F]+"
-# just need to catch \x1b and \x7f (unidecode does the rest)
-extra_ascii_chars = r"[\x1b\x7f]+"
 
+# All the -- RESTRICT -- steps, in the order they get applied.
+EXCLUSION_STEPS = ["shared_journal", "recent", "date_range", "tags_categories",
+    "originally_posted", "no_alpha", "wordcount_estimate", "language", "wordcount", "postcount"]
+
+# Rough word count, for the -- RESTRICT -- prefilter.
+# Counts runs of letters with word boundaries on both sides, so things like
+# "1st" and "abc123" don't count (spaCy doesn't call those alpha either).
+# It's close to spaCy's count of alpha tokens, but not exact. It's over for
+# things like "U.S." (3 vs 1) and under for things like "cannot" ("can" "not").
+wordcount_estimate_re = re.compile(r"\b[a-zA-Z]+\b")
+
+def wordcount_estimate_ok(txt):
+    """Is the rough word count close enough to the limits that spaCy needs to check?"""
+    n_words = len(wordcount_estimate_re.findall(txt))
+    return c.MIN_WORDCOUNT * (1 - PREFILTER_MARGIN) <= n_words <= c.MAX_WORDCOUNT * (1 + PREFILTER_MARGIN)
+
+
+def clean_entry(post_txt, date_txt, title_txt, record):
+    """Clean up and parse a single dream journal entry (all but the username).
 
-## Initialize empty dictionaries to store content that survives restrictions.
-# Gets turned into dataframe for export at the end.
-data = {} # ( post_id, post_data ) key, value pairs
-user_raw2id_mapping = {} # ( raw_username, unique_username ) key, value pairs
-# user_counts = Counter()  # to keep track of n posts per user
+    Returns a dictionary of the entry's data and None, or None and
+    the name of the -- RESTRICT -- criterion it didn't survive.
+    Nothing in here touches the random state, so entries
+    can be cleaned in any order and in any process.
 
-# Initialize a random state value.
-# This will get incremented every post that gets *looked* at,
-# including the posts that don't survive restrictions. The
-# purpose of this approach is that even if restriction criteria
-# get readjusted and this gets re-run, *as long as the raw html
-# zip file stays the same* then the random IDs should be reproducible.
-random_state = 0
+    Everything that needs spaCy is left for finish_entry,
+    so that spaCy can run over many posts at once.
 
-for html_byt in tqdm.tqdm(html_files, desc="parsing html and processing text"):
+    The cleaned text and language come from the post's cache record if
+    they're there, otherwise they get added to it.
+    """
+
+    ########################################################
+    #################   CLEAN/PARSE DATE   #################
+    ########################################################
+
+    # user info is (redundantly) in date_txt so drop it
+    date_txt = date_txt.strip().split(", ", 1)[1]
+
+    # There is sometimes an extra date "modifier" we don't need.
+    # It's always in parentheses so check for it and remove if it's there.
+    if "(" in date_txt and ")" in date_txt:
+        date_txt, date_descriptor = date_txt.rstrip(")").split(" (", 1)
+
+        # -- RESTRICT --
+        # There is a kind of "community" dream journal focused on shared dreaming.
+        # https://www.dreamviews.com/blogs/iosdp/
+        # Remove anything from here, since sometimes the usernames are innacurate
+        # with respect to the dream content, and also they are for shared dreaming
+        # attempts specifically.
+        # They are sometimes identifiable with a username of "IOSDP" but not always.
+        # but other times not. Most effective to look at the parenthetical
+        # next to the date.
+        # Take out posts from the shared shared dream journal.
+        if date_descriptor == "International Oneironaut Shared Dreaming Journal":
+            return None, "shared_journal"
+        
+        
+    # Recent posts are marked as "today" or "yesterday"
+    # just skip them not worth the clunky conversion and
+    # restricting before then anyways.
+    if "Today" in date_txt or "Yesterday" in date_txt:
+        return None, "recent"
+
+    # Convert string for iso-format for standardization.
+    blogdatetime = datetime.datetime.strptime(date_txt, c.BLOG_TIMESTAMP_FORMAT)
+    date_txt_iso = blogdatetime.strftime("%Y-%m-%dT%H:%M")
+
+    # restrict to the time window for cleanliness (and pre-2010 is weird)
+    if blogdatetime < start_datetime or blogdatetime > end_datetime:
+        return None, "date_range"
+
+    #############################################################################
+    #################   Extract/parse the Tags and Categories   #################
+    #############################################################################
+    # The post text has more than just the dream report.
+    # At the end it will ALWAYS have a "Categories" section,
+    # even if with just an "Uncategorized" label.
+    # There is also an optional "Tags" section that will immediately
+    # precede the Categories section if the user includes and Tags.
+    # The options for Category labels are limited (and thus of primary
+    # interest to us), while Tags are custom and the user can input anything.
+
+    #### Do this prior to text cleaning, otherwise it messes with parsing.
+
+    ## Break the post text into post, tags, and categories.
+
+    # -- RESTRICT --
+    # There are some (10-20) posts that have multiple instances of "Tags" and/or "Categories".
+    # Sometimes they are garbage anyways to-be skipped, like when
+    # the post is actually a copy/paste of multiple prior entries.
+    # Other times they are salvageable but it's annoying and not worth
+    # it to save the handful. They are generally places where the user
+    # inserted tags or categories manually at the end as well, or
+    # when categories is in the "Updated" section that is later removed.
+    # Skip them all.
+    if post_txt.count("Categories") > 1 or post_txt.count("Tags") > 1:
+        return None, "tags_categories"
+
+    # break blog into dream report, tags, and categories
+    ## see check a few lines down that makes sure there are limited appearances of these things
+    tags_are_present = "Tags:" in post_txt
+    if tags_are_present:
+        # split_rule_re = r"Tags:|(?<!Added )Categories")
+        split_rule_re = r"Tags:|Categories"
+        post_txt, tag_txt, cat_txt = re.split(split_rule_re, post_txt)
+    else:
+        split_rule_re = r"Categories"
+        post_txt, cat_txt = re.split(split_rule_re, post_txt)
+        tag_txt = None
+
+    # get rid of sometimes where there is an "Attached Thumbnails" section at the end
+    cat_txt = cat_txt.split("Attached Thumbnails")[0]
+    
+    # Strip excess whitespace off everything.
+    post_txt = post_txt.strip()
+    cat_txt = cat_txt.strip()
+    if tags_are_present:
+        tag_txt = tag_txt.strip()
+
+    # Extract lists for each of tags and categories.
+    # cat_txt = "::".join(re.split(r",\s+", cat_txt))
+    # tag_txt = "::".join(re.split(r",\s+", tag_txt))
+    tags = [] if tag_txt is None else \
+           [ t.strip().lower().replace(" ", "_") for t in tag_txt.split(", ") ]
+    cats = [ c.strip().lower().replace(" ", "_") for c in cat_txt.split(", ") ]
+    # tags = [] if tag_txt is None else re.split(r",\s+", tag_txt.strip())
+    # cats = re.split(r",\s+", cat_txt.strip())
+
+    ## Use the category list to come up with useful (specific) labels.
+
+    # Identify if the post was lucid.
+    if "lucid" in cats and "non-lucid" in cats:
+        post_lucidity = "ambiguous"
+    elif "lucid" in cats:
+        post_lucidity = "lucid"
+    elif "non-lucid" in cats:
+        post_lucidity = "nonlucid" # remove hyphen for future convenience
+    else:
+        post_lucidity = "unspecified"
+
+    # Identify if the post was a nightmare.
+    post_was_nightmare = "nightmare" in cats
+
+    # # Convert to printable ASCII.
+    # title_txt = re.sub(surrogate_re, " ", title_txt)
+    # title_txt = unidecode.unidecode(title_txt, errors="ignore", replace_str="")
+    # title_txt = re.sub(extra_ascii_chars, " ", title_txt)
+    # title_txt = re.sub(r"\s+", " ", title_txt)
+    # title_txt = title_txt.strip()
+    # assert title_txt.isascii() and title_txt.isprintable()
+
+    # Merge the tags and categories into strings for saving in dataframe.
+    cats = "::".join(cats)
+    if tags is not None:
+        tags = "::".join(tags)
+
+    # Convert to printable ASCII.
+    tags = textclean.convert2ascii_cached(tags)
+    cats = textclean.convert2ascii_cached(cats)
+
+    # # skip some weird entries
+    # # eg, one entry that is copy/pasted multiple entries
+    # # which breaks this and shouldnt be counted anyways.
+    # # this is a good way to ensure single entries
+    # if (("Tags:" in post_txt and len(components) != 3)
+    #     or ("Tags:" not in post_txt and len(components) != 2)):
+    #     continue
+    # # this is late to check, but want it after this continue section which will catch some of these assertion errors
+    # assert post_txt.count("Categories") == 1
+    # assert post_txt.count("Tags:") in [0, 1]
+    
+    # if "Tags:" in post_txt: # same as len(components) == 3
+    #     post_txt, tags, cats = components
+    # else:        
+    #     post_txt, cats = components
+    #     tags = None
+
+
+    #################################################################
+    #################   CLEAN POST (dream report)   #################
+    #################################################################
+
+    ## Convert to printable ASCII.
+    with profiler.stage("convert2ascii"):
+        post_txt = textclean.convert2ascii(post_txt)
+
+    # -- RESTRICT --
+    # A lot of posts start with Originally posted by ...
+    # These should be pulled based on our stats
+    # accounting for repeated measures within subjects
+    # but these mess that up.
+    if post_txt.startswith("Originally posted"):
+        return None, "originally_posted"
+
+    ## Minor text corrections and redactions (emails/URLs), see textclean.
+    if record.get("text") is None:
+        with profiler.stage("clean_post_text"):
+            record.set("text", textclean.clean_post_text(post_txt))
+    post_txt = record.get("text")
+
+
+    # -- RESTRICT -- based on written language (must be English)
+    # -- RESTRICT -- based on absence of any alpha characters
+    # Run at same time since language detection will error out without any alpha characteres anyways.
+    # Make sure there is at least a few characters.
+    # This is NOT a step restricting on word count per se.
+    # Sometimes posts are just images or something, and so
+    # the following processing steps won't even work because
+    # there is literally no text. This is mostly just to prevent errors.
+    if re.search(r"[a-zA-Z]", post_txt) is None:
+        return None, "no_alpha"
+
+    # -- RESTRICT -- based on a rough number of words, before the slow stuff.
+    # The real word count restriction needs spaCy (see finish_entry), but
+    # a lot of posts are so obviously too short (or long) that they don't
+    # need language detection or spaCy to tell. Only cut posts way outside
+    # the limits so the rough estimate never drops a post spaCy would keep.
+    if PREFILTER and not wordcount_estimate_ok(post_txt):
+        return None, "wordcount_estimate"
+
+    if record.get("language") is None:
+        record.set("language", langdetect.detect(post_txt))
+    language = record.get("language")
+    # try:
+    #     language = langdetect.detect(post_txt)
+    # except langdetect.LangDetectException as err:
+    #     if err.code == 5: # err.__str__()=="No features in text."
+    #         continue
+    if language != "en":
+        return None, "language"
+
+    ###################################################
+    #################   CLEAN TITLE   #################
+    ###################################################
+
+    # Convert to printable ASCII.
+    with profiler.stage("convert2ascii"):
+        title_txt = textclean.convert2ascii(title_txt)
+
+
+
+
+
+    ##################################################################
+    #################   Save to running dictionary   #################
+    ##################################################################
+
+    # # -- RESTRICT -- based on the number of posts per user.
+    # user_counts.update([unique_user_id])
+    # nposts_this_user = user_counts[unique_user_id]
+    # if nposts_this_user > c.MAX_POSTCOUNT:
+    #     continue
+
+    single_post_data = {
+        "user_id"     : None, # filled in later, when IDs get assigned in order
+        # "user_postn"  : nposts_this_user,
+        "timestamp"   : date_txt_iso,
+        "title"       : title_txt,
+        "tags"        : tags,
+        "categories"  : cats,
+        "lucidity"    : post_lucidity,
+        "nightmare"   : post_was_nightmare,
+        "wordcount"   : None, # filled in by finish_entry, after spaCy
+        "post_clean"  : post_txt, # (not redacted yet, also in finish_entry)
+        "post_lemmas" : None,
+    }
+
+    return single_post_data, None
+
+
+def analyze_doc(doc):
+    """Everything finish_entry needs from the spaCy doc of a post (to go in the cache)."""
+    lemmas = None
+    if LEMMAS:
+        with profiler.stage("lemmatize"):
+            lemmas = lemmatize(doc)
+    return {
+        "n_words" : sum( t.is_alpha for t in doc ),
+        "ents"    : [ (ent.start_char, ent.end_char, ent.label_) for ent in doc.ents ],
+        "lemmas"  : lemmas,
+    }
+
+
+def finish_entry(analysis, single_post_data):
+    """Finish cleaning an entry from clean_entry, given the analyze_doc results
+    of its text. Counts words, redacts named entities, and lemmatizes (unless --no-lemmas).
+    Returns the completed data and None, or None and "wordcount" if excluded.
+    """
+    post_txt = single_post_data["post_clean"]
+
+    # -- RESTRICT -- based on number of words.
+    # Note the wordcount is placed prior to entity replacement for convenience.
+    # This way don't have to re-"doc" the redacted text.
+    # n_tokens = len(doc) # no distinction between punctuation and words
+    n_words = analysis["n_words"]
+    if not c.MIN_WORDCOUNT <= n_words <= c.MAX_WORDCOUNT:
+        return None, "wordcount"
+
+    # Replace the entities with the entity label in double square brackets.
+    # Loop over the entities in reverse and modify the text with replacements
+    # (loop in reverse so that indices still work after string modifications).
+    # redacted_text = doc.text
+    for start_char, end_char, label in reversed(analysis["ents"]):
+        if label in entities_to_redact:
+            post_txt = (post_txt[:start_char]
+                + "[["+label+"]]" + post_txt[end_char:])
+
+
+    # lemmatize while we're here and spaCy is running
+    lemmatized_text = join_lemmas(analysis["lemmas"], shuffle=True) if LEMMAS else None
+
+    single_post_data["wordcount"] = n_words
+    single_post_data["post_clean"] = post_txt
+    single_post_data["post_lemmas"] = lemmatized_text
+    return single_post_data, None
+
+
+def analyze_entries(entries, nlp, batch_size, n_process):
+    """Run the spaCy part of cleaning over a stream of entries.
+
+    Takes (... , cache record, exclusion, single_post_data) tuples in order
+    and yields them back in the same order, with each single_post_data passed
+    through finish_entry. Entries that were already excluded (None) skip spaCy,
+    and so do entries with spaCy results in their cache record. The rest go through
+    nlp.pipe in batches of batch_size (on n_process processes), which is
+    several times faster than handing spaCy one post at a time.
+    """
+    entries, entries_to_parse = itertools.tee(entries)
+    texts = ( (entry[-1]["post_clean"], i) for i, entry in enumerate(entries_to_parse)
+        if entry[-1] is not None and entry[-3].get("spacy") is None )
+    docs = nlp.pipe(texts, as_tuples=True, batch_size=batch_size, n_process=n_process)
+    for i, entry in enumerate(entries):
+        record, exclusion, single_post_data = entry[-3:]
+        if single_post_data is not None:
+            if record.get("spacy") is None:
+                with profiler.stage("spacy"):
+                    doc, doc_i = next(docs)
+                assert doc_i == i # make sure the doc is for this post
+                with profiler.stage("analyze_doc"):
+                    record.set("spacy", analyze_doc(doc))
+            with profiler.stage("finish_entry"):
+                single_post_data, exclusion = finish_entry(record.get("spacy"), single_post_data)
+        yield (*entry[:-2], exclusion, single_post_data)
+
+
+def extract_entries(html_byt):
+    """Pull the raw pieces of every dream journal entry out of one html page.
+
+    Returns a list of (entry url, entry is dated, username, post text,
+    date text, title text) tuples in page order, none of it cleaned yet.
+    """
 
     # # convert from bytes to string
     # html_str = html_byt.decode(encoding="windows-1252", errors="strict") # windows-1252 == cp1252
 
     # get all the blog posts from the current html
-    # convert html to soup object thing
-    soup = BeautifulSoup(html_byt, "html.parser", from_encoding="windows-1252")
-    page_posts  = soup.find_all("div", class_="blogbody")
-    page_users  = soup.find_all("div", class_="popupmenu memberaction")
-    page_dates  = soup.find_all("div", class_="blog_date")
-    page_titles = soup.find_all("a", class_="blogtitle")
-    # Make sure each dream journal entry has a
-    # corresponding username, date, and title
-    assert len(page_posts) == len(page_users) == len(page_dates) == len(page_titles)
+    # (the post, username, date, and title of each, see htmlextract)
+    page_entries = htmlextract.posts_page(html_byt, backend=HTML_BACKEND)
+
 
 
     #### Loop over each entry (and components) of the current html page
     #### and perform *minimal* cleaning and further parsing of the html.
     #### Clean up the dates a bit and strip strip away excess edge whitespace
     #### in some instances. The Tags and Categories need to be parsed out of the report.
-    
-    #### Note that there are some "continue" statements
-    #### that will push into the next loop and prevent
-    #### saving that data. It's exclusion criteria.
-    for post, user, date, title in zip(page_posts,
-                                       page_users,
-                                       page_dates,
-                                       page_titles):
-        
-        random_state += 1
-        rd.seed(random_state)
-        
+    #### (That all happens later, in clean_entry, this just gets the raw text.)
+    raw_entries = []
+    for fields in page_entries:
+
+        # (see main loop for what these are used for)
+        entry_url = fields.url
+        entry_date_txt = fields.date.strip().split(", ", 1)[-1]
+        entry_dated = "Today" not in entry_date_txt and "Yesterday" not in entry_date_txt
+
         # extract text from soup/html object
         # (NOT using str.strip at this stage because
         #  in some cases the username is space-like and that collapses it.)
@@ -237,10 +724,10 @@ for html_byt in tqdm.tqdm(html_files, desc="parsing html and processing text"):
         # date_txt   = " ".join([ x for x in date.stripped_strings ])
         # title_txt  = " ".join([ x for x in title.stripped_strings ])
         # post_txt  = post.get_text(separator=" ", strip=True)
-        post_txt  = post.text
-        user_txt  = user.text # def dont use strip=True on user bc of username with just spaces
-        date_txt  = date.text
-        title_txt = title.text
+        post_txt  = fields.post
+        user_txt  = fields.user # def dont use strip=True on user bc of username with just spaces
+        date_txt  = fields.date
+        title_txt = fields.title
 
 
 
@@ -265,359 +752,237 @@ for html_byt in tqdm.tqdm(html_files, desc="parsing html and processing text"):
         # These are NOT emails! Need to get the real username, or drop
         # them because it will mess with repeated measures stats (they aren't same user).
         # if user_txt == "[email protected]":
-        if re.search(r"\[email\s+protected\]", user.text) is not None:
+        if re.search(r"\[email\s+protected\]", fields.user) is not None:
             # the real username is still in the user item somewhere
-            user_txt = user.find("a").attrs["title"].split(" is offline")[0]
-        user_txt = convert2ascii(user_txt, retain_whitespace_count=True)
-
-        # Generate random user ID.
-        try:
-            # First look for an existing ID that was already made.
-            unique_user_id = user_raw2id_mapping[user_txt]
-        except KeyError:
-            # If not found, generate a new one.
-            unique_user_id = generate_id(n_chars=4)
-            # Keep generating until it's one that hasn't been generated before.
-            while unique_user_id in user_raw2id_mapping.values():
-                unique_user_id = generate_id(n_chars=4)
-            user_raw2id_mapping[user_txt] = unique_user_id
-
-
-
-        ########################################################
-        #################   CLEAN/PARSE DATE   #################
-        ########################################################
-
-        # user info is (redundantly) in date_txt so drop it
-        date_txt = date_txt.strip().split(", ", 1)[1]
-
-        # There is sometimes an extra date "modifier" we don't need.
-        # It's always in parentheses so check for it and remove if it's there.
-        if "(" in date_txt and ")" in date_txt:
-            date_txt, date_descriptor = date_txt.rstrip(")").split(" (", 1)
-
-            # -- RESTRICT --
-            # There is a kind of "community" dream journal focused on shared dreaming.
-            # https://www.dreamviews.com/blogs/iosdp/
-            # Remove anything from here, since sometimes the usernames are innacurate
-            # with respect to the dream content, and also they are for shared dreaming
-            # attempts specifically.
-            # They are sometimes identifiable with a username of "IOSDP" but not always.
-            # but other times not. Most effective to look at the parenthetical
-            # next to the date.
-            # Take out posts from the shared shared dream journal.
-            if date_descriptor == "International Oneironaut Shared Dreaming Journal":
-                continue
-            
-            
-        # Recent posts are marked as "today" or "yesterday"
-        # just skip them not worth the clunky conversion and
-        # restricting before then anyways.
-        if "Today" in date_txt or "Yesterday" in date_txt:
-            continue
-
-        # Convert string for iso-format for standardization.
-        blogdatetime = datetime.datetime.strptime(date_txt, c.BLOG_TIMESTAMP_FORMAT)
-        date_txt_iso = blogdatetime.strftime("%Y-%m-%dT%H:%M")
-
-        # restrict to the time window for cleanliness (and pre-2010 is weird)
-        if blogdatetime < start_datetime or blogdatetime > end_datetime:
-            continue
-
-        #############################################################################
-        #################   Extract/parse the Tags and Categories   #################
-        #############################################################################
-        # The post text has more than just the dream report.
-        # At the end it will ALWAYS have a "Categories" section,
-        # even if with just an "Uncategorized" label.
-        # There is also an optional "Tags" section that will immediately
-        # precede the Categories section if the user includes and Tags.
-        # The options for Category labels are limited (and thus of primary
-        # interest to us), while Tags are custom and the user can input anything.
-
-        #### Do this prior to text cleaning, otherwise it messes with parsing.
-
-        ## Break the post text into post, tags, and categories.
+            user_txt = fields.user_link_title.split(" is offline")[0]
 
-        # -- RESTRICT --
-        # There are some (10-20) posts that have multiple instances of "Tags" and/or "Categories".
-        # Sometimes they are garbage anyways to-be skipped, like when
-        # the post is actually a copy/paste of multiple prior entries.
-        # Other times they are salvageable but it's annoying and not worth
-        # it to save the handful. They are generally places where the user
-        # inserted tags or categories manually at the end as well, or
-        # when categories is in the "Updated" section that is later removed.
-        # Skip them all.
-        if post_txt.count("Categories") > 1 or post_txt.count("Tags") > 1:
-            continue
-
-        # break blog into dream report, tags, and categories
-        ## see check a few lines down that makes sure there are limited appearances of these things
-        tags_are_present = "Tags:" in post_txt
-        if tags_are_present:
-            # split_rule_re = r"Tags:|(?<!Added )Categories")
-            split_rule_re = r"Tags:|Categories"
-            post_txt, tag_txt, cat_txt = re.split(split_rule_re, post_txt)
-        else:
-            split_rule_re = r"Categories"
-            post_txt, cat_txt = re.split(split_rule_re, post_txt)
-            tag_txt = None
-
-        # get rid of sometimes where there is an "Attached Thumbnails" section at the end
-        cat_txt = cat_txt.split("Attached Thumbnails")[0]
-        
-        # Strip excess whitespace off everything.
-        post_txt = post_txt.strip()
-        cat_txt = cat_txt.strip()
-        if tags_are_present:
-            tag_txt = tag_txt.strip()
-
-        # Extract lists for each of tags and categories.
-        # cat_txt = "::".join(re.split(r",\s+", cat_txt))
-        # tag_txt = "::".join(re.split(r",\s+", tag_txt))
-        tags = [] if tag_txt is None else \
-               [ t.strip().lower().replace(" ", "_") for t in tag_txt.split(", ") ]
-        cats = [ c.strip().lower().replace(" ", "_") for c in cat_txt.split(", ") ]
-        # tags = [] if tag_txt is None else re.split(r",\s+", tag_txt.strip())
-        # cats = re.split(r",\s+", cat_txt.strip())
-
-        ## Use the category list to come up with useful (specific) labels.
-
-        # Identify if the post was lucid.
-        if "lucid" in cats and "non-lucid" in cats:
-            post_lucidity = "ambiguous"
-        elif "lucid" in cats:
-            post_lucidity = "lucid"
-        elif "non-lucid" in cats:
-            post_lucidity = "nonlucid" # remove hyphen for future convenience
-        else:
-            post_lucidity = "unspecified"
-
-        # Identify if the post was a nightmare.
-        post_was_nightmare = "nightmare" in cats
-
-        # # Convert to printable ASCII.
-        # title_txt = re.sub(surrogate_re, " ", title_txt)
-        # title_txt = unidecode.unidecode(title_txt, errors="ignore", replace_str="")
-        # title_txt = re.sub(extra_ascii_chars, " ", title_txt)
-        # title_txt = re.sub(r"\s+", " ", title_txt)
-        # title_txt = title_txt.strip()
-        # assert title_txt.isascii() and title_txt.isprintable()
-
-        # Merge the tags and categories into strings for saving in dataframe.
-        cats = "::".join(cats)
-        if tags is not None:
-            tags = "::".join(tags)
-
-        # Convert to printable ASCII.
-        tags = convert2ascii(tags)
-        cats = convert2ascii(cats)
-
-        # # skip some weird entries
-        # # eg, one entry that is copy/pasted multiple entries
-        # # which breaks this and shouldnt be counted anyways.
-        # # this is a good way to ensure single entries
-        # if (("Tags:" in post_txt and len(components) != 3)
-        #     or ("Tags:" not in post_txt and len(components) != 2)):
-        #     continue
-        # # this is late to check, but want it after this continue section which will catch some of these assertion errors
-        # assert post_txt.count("Categories") == 1
-        # assert post_txt.count("Tags:") in [0, 1]
-        
-        # if "Tags:" in post_txt: # same as len(components) == 3
-        #     post_txt, tags, cats = components
-        # else:        
-        #     post_txt, cats = components
-        #     tags = None
+        raw_entries.append(
+            (entry_url, entry_dated, user_txt, post_txt, date_txt, title_txt)
+        )
 
+    return raw_entries
 
-        #################################################################
-        #################   CLEAN POST (dream report)   #################
-        #################################################################
 
-        ## Convert to printable ASCII.
-        post_txt = convert2ascii(post_txt)
+def parse_html_page(page):
+    """Parse and clean all the dream journal entries out of one raw html page.
 
-        # -- RESTRICT --
-        # A lot of posts start with Originally posted by ...
-        # These should be pulled based on our stats
-        # accounting for repeated measures within subjects
-        # but these mess that up.
-        if post_txt.startswith("Originally posted"):
+    Takes an (is_delta, html bytes) tuple from iter_html_files and returns
+    is_delta, the page's cache record, a list of (entry url, entry is dated,
+    ASCII username, post cache record, exclusion, cleaned entry data) tuples,
+    one per entry and in page order, and the --profile stage stats for the
+    page (None without --profile). The entry data is None for excluded
+    entries, and exclusion says why (otherwise None). IDs are handed out
+    afterwards, in page order, so pages can be parsed in parallel without
+    changing them. Anything that wasn't in the cache yet is added to the
+    records, for the main process to save.
+    """
+    is_delta, html_byt = page
+    cache = get_post_cache()
+
+    with profiler.stage("cache_read"):
+        page_record = cache.record(postcache.content_key(html_byt))
+    if page_record.get("page") is None:
+        with profiler.stage("extract_entries"):
+            page_record.set("page", extract_entries(html_byt))
+
+    #### Note that clean_entry has some "return None" statements
+    #### that prevent saving that data. It's exclusion criteria.
+    page_entries = []
+    for entry_url, entry_dated, user_txt, post_txt, date_txt, title_txt in page_record.get("page"):
+        # Convert to printable ASCII (see comments in extract_entries).
+        user_txt = textclean.convert2ascii_cached(user_txt, retain_whitespace_count=True)
+        with profiler.stage("cache_read"):
+            record = cache.record(postcache.content_key(post_txt))
+        with profiler.stage("clean_entry"):
+            single_post_data, exclusion = clean_entry(post_txt, date_txt, title_txt, record)
+        page_entries.append(
+            (entry_url, entry_dated, user_txt, record, exclusion, single_post_data)
+        )
+
+    # (and the stage times, since this might be in a worker process)
+    return is_delta, page_record, page_entries, profiler.take()
+
+
+def cached_pages(parsed_pages, cache):
+    """Save the page records (and stage stats) from parse_html_page, passing on the rest."""
+    for is_delta, page_record, page_entries, stage_stats in parsed_pages:
+        profiler.merge(stage_stats)
+        with profiler.stage("cache_write"):
+            cache.put(page_record)
+        yield is_delta, page_entries
+
+
+if __name__ == "__main__":
+
+    # Worker processes (--jobs and --spacy-processes) get started fresh instead
+    # of forked, like they always are on windows and mac. This process has the
+    # sqlite cache open the whole time, and sqlite connections mustn't be
+    # carried over a fork (not even closed in the child), so none get inherited.
+    multiprocessing.set_start_method("spawn", force=True)
+
+    # count the pages up front (cheap, from the zip directories) for the progress bar
+    archive_fnames = c.dreamviews_posts_archives()
+    n_html_files = 0
+    for archive_fname in archive_fnames:
+        with zipfile.ZipFile(archive_fname, mode="r") as zf:
+            n_html_files += len(zf.namelist())
+
+
+
+    ## Initialize empty dictionaries to store content that survives restrictions.
+    # Gets turned into dataframe for export at the end.
+    data = {} # ( post_id, post_data ) key, value pairs
+    user_raw2id_mapping = {} # ( raw_username, unique_username ) key, value pairs
+    user_ids = IDAllocator(n_chars=4) # all the user IDs handed out so far
+    post_ids = IDAllocator(n_chars=8) # all the post IDs handed out so far
+    seen_entries = set() # urls of (dated) blog entries, to skip repeats in delta zipfiles
+    exclusion_counts = Counter() # n posts dropped by each -- RESTRICT -- step
+    # user_counts = Counter()  # to keep track of n posts per user
+
+    # Initialize a random state value.
+    # This will get incremented every post that gets *looked* at,
+    # including the posts that don't survive restrictions. The
+    # purpose of this approach is that even if restriction criteria
+    # get readjusted and this gets re-run, *as long as the raw html
+    # zip file stays the same* then the random IDs should be reproducible.
+    # The expensive parsing/cleaning of pages can happen in parallel (see --jobs),
+    # but IDs are only handed out here, one entry at a time in page order,
+    # so each entry's random state is just its position and IDs match a serial run.
+    random_state = 0
+
+    nlp = load_spacy(SPACY_PIPELINE, lemmas=LEMMAS)
+    cache = get_post_cache() # results that weren't cached get saved from here
+
+    # Pages get parsed/cleaned (maybe in parallel), then all their
+    # entries are streamed through spaCy in batches, then IDs get assigned.
+    parsed_pages = c.imap_ordered(parse_html_page, iter_html_files(archive_fnames), N_JOBS)
+    parsed_pages = tqdm.tqdm(parsed_pages, total=n_html_files, desc="parsing html and processing text")
+    entries = ( (is_delta, *entry) for is_delta, page_entries in cached_pages(parsed_pages, cache)
+        for entry in page_entries )
+    entries = analyze_entries(entries, nlp, SPACY_BATCH_SIZE, SPACY_N_PROCESS)
+
+    for is_delta, entry_url, entry_dated, user_txt, record, exclusion, single_post_data in entries:
+
+        with profiler.stage("cache_write"):
+            cache.put(record)
+
+        # Incremental crawls overlap a bit with what came before,
+        # so skip entries that were already seen in an earlier zipfile.
+        # This happens *before* the random state is incremented and only
+        # for delta zipfiles, so IDs from the main zipfile never change.
+        # Entries that were still "Today" or "Yesterday" weren't kept
+        # the first time, so they don't count as seen.
+        if is_delta and entry_url in seen_entries:
             continue
+        if entry_dated:
+            seen_entries.add(entry_url)
 
-        # Replace the few stupid apostrophe representations.
-        post_txt = post_txt.replace("&#39;", "'")
-
-        ## Minor text corrections to make later life easier.
-        # replace ampersands
-        post_txt = post_txt.replace("&", "and")
-        # replace contractions with full words
-        post_txt = contractions.fix(post_txt, slang=True)
-        # replace any sequence of 4+ characters with 1 of that character
-        # gets rid of stuff like whoaaaaaaaaaaaa and --------------------
-        # will lead to some errors because it replaces with 1 letter but sometimes will need 2
-        post_txt = re.sub(r"(.)\1{3,}", r"\1", post_txt, flags=re.IGNORECASE)
-
-
-        ## DreamViews posts have some commons text patterns that can be removed.
-        ## These are all regexes that are specific to the needs of cleaning DreamViews text.
-
-        # There are some leftover block formatting tags.
-        post_txt = re.sub(r"\[(/?INDENT|/?RIGHT|/?CENTER|/?B)\]", "", post_txt, flags=re.IGNORECASE)
-        # These ones never have a = preceding them.
-        post_txt = re.sub(r"\[/?(INDENT|RIGHT|CENTER|B|I|U|HR|IMG|LINK_TO_ANCHOR|SARCASM|DREAM LOGIC)\]", "", post_txt, flags=re.IGNORECASE)
-        # These need some leway as to what comes after because sometimes there's stuff there.
-        post_txt = re.sub(r"\[/?COLOR.*?\]", "", post_txt, flags=re.IGNORECASE)
-        post_txt = re.sub(r"\[/?SIZE.*?\]", "", post_txt, flags=re.IGNORECASE)
-        post_txt = re.sub(r"\[/?FONT.*?\]", "", post_txt, flags=re.IGNORECASE)
-        post_txt = re.sub(r"\[/?QUOTE.*?\]", "", post_txt, flags=re.IGNORECASE)
-        post_txt = re.sub(r"\[/?SPOILER.*?\]", "", post_txt, flags=re.IGNORECASE)
-        post_txt = re.sub(r"\[/?URL.*?\]", "", post_txt, flags=re.IGNORECASE)
-        post_txt = re.sub(r"\[ATTACH=CONFIG\][0-9]*\[/ATTACH\]", "", post_txt, flags=re.IGNORECASE)
-
-        # Posts can be updated and have this stereotyped amendment
-        # at the end if they were (about 20% of posts have this).
-        # Example: Updated 12-08-2021 at 10:28 PM by 34880
-        # Example: Updated 08-05-2017 at 01:09 PM by 93119 (Added Categories)
-        # Example: Updated 04-20-2014 at 12:36 PM by 68865 (remembered another fragment)
-        updated_re = r" Updated [0-9]{2}-[0-9]{2}-[0-9]{4} at [0-9]{2}:[0-9]{2} [AP]M by [0-9]{1,5}( \(.*?\))?"
-        post_txt = re.sub(updated_re, "", post_txt)
-
-
-        ## Redactions.
-        # redact emails
-        # The text already has some "@[email\xa0protected]" parts, basically anything after an @. Kinda dumb.
-        # They aren't always emails so just replace with nothing.
-        post_txt = re.sub(r"@\[email protected\]", "", post_txt) # first
-        post_txt = re.sub(r"\S*@\S*\s?", "[[URL]]", post_txt) # just in case there are still any
-
-        # redact URLs
-        post_txt = re.sub(r"https?://\S+", "[[URL]]", post_txt, flags=re.IGNORECASE)
-        post_txt = re.sub(r"www\.\S+", "[[URL]]", post_txt, flags=re.IGNORECASE)
-
-
-        # -- RESTRICT -- based on written language (must be English)
-        # -- RESTRICT -- based on absence of any alpha characters
-        # Run at same time since language detection will error out without any alpha characteres anyways.
-        # Make sure there is at least a few characters.
-        # This is NOT a step restricting on word count per se.
-        # Sometimes posts are just images or something, and so
-        # the following processing steps won't even work because
-        # there is literally no text. This is mostly just to prevent errors.
-        if re.search(r"[a-zA-Z]", post_txt) is None:
-            continue
-        language = langdetect.detect(post_txt)
-        # try:
-        #     language = langdetect.detect(post_txt)
-        # except langdetect.LangDetectException as err:
-        #     if err.code == 5: # err.__str__()=="No features in text."
-        #         continue
-        if language != "en":
-            continue
+        random_state += 1
+        rd.seed(random_state)
 
-        # Use spaCy to recognize/identify named entities.
-        doc = nlp(post_txt)
+        # Generate random user ID.
+        try:
+            # First look for an existing ID that was already made.
+            unique_user_id = user_raw2id_mapping[user_txt]
+        except KeyError:
+            # If not found, generate a new one.
+            # (Keeps generating until it's one that hasn't been generated before.)
+            unique_user_id = user_ids.new_id()
+            user_raw2id_mapping[user_txt] = unique_user_id
 
-        # -- RESTRICT -- based on number of words.
-        # Note the wordcount is placed prior to entity replacement for convenience.
-        # This way don't have to re-"doc" the redacted text.
-        # n_tokens = len(doc) # no distinction between punctuation and words
-        n_words = sum( t.is_alpha for t in doc )
-        if not c.MIN_WORDCOUNT <= n_words <= c.MAX_WORDCOUNT:
+        # -- RESTRICT -- (the entry was excluded in clean_entry or finish_entry)
+        if single_post_data is None:
+            exclusion_counts[exclusion] += 1
             continue
 
-        # Replace the entities with the entity label in double square brackets.
-        # Loop over the entities in reverse and modify the text with replacements
-        # (loop in reverse so that indices still work after string modifications).
-        # redacted_text = doc.text
-        for ent in reversed(doc.ents):
-            if ent.label_ in entities_to_redact:
-                post_txt = (post_txt[:ent.start_char]
-                    + "[["+ent.label_+"]]" + post_txt[ent.end_char:])
-
-
-        # lemmatize while we're here and spaCy is running
-        lemmatized_text = lemmatize(doc, shuffle=True)
-
-        ###################################################
-        #################   CLEAN TITLE   #################
-        ###################################################
-
-        # Convert to printable ASCII.
-        title_txt = convert2ascii(title_txt)
-
-
-
-
-
-        ##################################################################
-        #################   Save to running dictionary   #################
-        ##################################################################
-
-        # # -- RESTRICT -- based on the number of posts per user.
-        # user_counts.update([unique_user_id])
-        # nposts_this_user = user_counts[unique_user_id]
-        # if nposts_this_user > c.MAX_POSTCOUNT:
-        #     continue
-
-        single_post_data = {
-            "user_id"     : unique_user_id,
-            # "user_postn"  : nposts_this_user,
-            "timestamp"   : date_txt_iso,
-            "title"       : title_txt,
-            "tags"        : tags,
-            "categories"  : cats,
-            "lucidity"    : post_lucidity,
-            "nightmare"   : post_was_nightmare,
-            "wordcount"   : n_words,
-            "post_clean"  : post_txt,
-            "post_lemmas" : lemmatized_text,
-        }
+        single_post_data["user_id"] = unique_user_id
 
         # Generate random ID for this specific post and
         # use it as an identifier in the data dictionary.
-        unique_post_id = generate_id(n_chars=8)
-        while unique_post_id in data:
-            unique_post_id = generate_id(n_chars=8)
+        unique_post_id = post_ids.new_id()
         data[unique_post_id] = single_post_data
 
-
-
-
-############################################################
-#################   Aggregate and Export   #################
-############################################################
-
-# Generate a dataframe from all the posts.
-df = pd.DataFrame.from_dict(data, orient="index"
-    ).sort_values(["user_id", "timestamp"])
-
-# # a few strange duplicated reports (<1%)
-# df = df.drop_duplicates(subset="post_txt", keep="first")
-
-# Add a column that identifies the post # in sequence for a given user.
-# df = df.sort_values(["user_id", "timestamp"]) # should be redundant but it's critical
-df.insert(1, "nth_post",
-    df.groupby("user_id")["timestamp"].transform(lambda s: range(1, 1+len(s)))
-)
-
-# -- RESTRICT -- based on the number of posts per user.
-df = df[ df["nth_post"].le(c.MAX_POSTCOUNT) ]
-
-
-# Drop the raw2id mapping dictionary to ONLY those users that survived restrictions
-#### so that only "used" users go into the raw2id mapping key.
-out_mapping_key = { username: userid for username, userid in user_raw2id_mapping.items()
-    if userid in df["user_id"].unique() }
-
-
-## Write two files.
-
-# tsv with data
-df.to_csv(export_fname_posts, encoding="ascii",
-    index=True, index_label="post_id", sep="\t")
-
-# json with usernames
-with open(export_fname_userkey, "wt", encoding="ascii") as outfile:
-    json.dump(out_mapping_key, outfile, indent=4, sort_keys=True, ensure_ascii=False)
+    cache.close()
+
+
+
+    ############################################################
+    #################   Aggregate and Export   #################
+    ############################################################
+
+    # Generate a dataframe from all the posts.
+    df = pd.DataFrame.from_dict(data, orient="index"
+        ).sort_values(["user_id", "timestamp"])
+
+    # # a few strange duplicated reports (<1%)
+    # df = df.drop_duplicates(subset="post_txt", keep="first")
+
+    # Add a column that identifies the post # in sequence for a given user.
+    # df = df.sort_values(["user_id", "timestamp"]) # should be redundant but it's critical
+    df.insert(1, "nth_post",
+        df.groupby("user_id")["timestamp"].transform(lambda s: range(1, 1+len(s)))
+    )
+
+    # -- RESTRICT -- based on the number of posts per user.
+    exclusion_counts["postcount"] = df["nth_post"].gt(c.MAX_POSTCOUNT).sum()
+    df = df[ df["nth_post"].le(c.MAX_POSTCOUNT) ]
+
+    # Report how many posts each -- RESTRICT -- step took out, in the order they happen.
+    # Everything before "language" is cheap, "language" is langdetect
+    # and "wordcount" is after spaCy, so those should be small.
+    exclusion_report = pd.Series(
+        [ exclusion_counts[x] for x in EXCLUSION_STEPS ] + [len(df)],
+        index=EXCLUSION_STEPS + ["kept"], name="n_posts")
+    print(exclusion_report.to_string())
+
+    # And how crowded the random IDs got (collisions mean an ID had to be redrawn).
+    id_report = pd.DataFrame([user_ids.stats(), post_ids.stats()], index=["user_id", "post_id"])
+    print(id_report.to_string())
+
+
+    # Drop the raw2id mapping dictionary to ONLY those users that survived restrictions
+    #### so that only "used" users go into the raw2id mapping key.
+    kept_user_ids = set(df["user_id"])
+    out_mapping_key = { username: userid for username, userid in user_raw2id_mapping.items()
+        if userid in kept_user_ids }
+
+
+    ## Write three files (and the --profile report).
+    with profiler.stage("export"):
+        # tsv with data
+        df.to_csv(export_fname_posts, encoding="ascii",
+            index=True, index_label="post_id", sep="\t")
+
+        # parquet with the same data, but typed and compressed (much faster to load).
+        # Empty strings become missing, same as they end up when reading the tsv.
+        df_typed = df.rename_axis("post_id").reset_index()
+        for col in ["title", "tags", "categories", "post_clean", "post_lemmas"]:
+            df_typed[col] = df_typed[col].mask(df_typed[col].eq(""))
+        df_typed = df_typed.astype(c.POSTS_DTYPES)
+        df_typed["timestamp"] = pd.to_datetime(df_typed["timestamp"])
+        df_typed.to_parquet(export_fname_posts_parquet, index=False, compression="zstd")
+
+        # same again, split into year=YYYY/lucidity=X/ directories (with --partition).
+        # Written next to the old one and then swapped in, so a
+        # reader never sees half of it, and old partitions don't hang around.
+        if PARTITION:
+            tmp_dirname = export_dirname_posts_partitioned + ".tmp"
+            shutil.rmtree(tmp_dirname, ignore_errors=True)
+            df_typed.assign(year=df_typed["timestamp"].dt.year).to_parquet(tmp_dirname,
+                index=False, compression="zstd", partition_cols=c.POSTS_PARTITION_COLS)
+            shutil.rmtree(export_dirname_posts_partitioned, ignore_errors=True)
+            os.rename(tmp_dirname, export_dirname_posts_partitioned)
+
+        # json with usernames
+        with open(export_fname_userkey, "wt", encoding="ascii") as outfile:
+            json.dump(out_mapping_key, outfile, indent=4, sort_keys=True, ensure_ascii=False)
+
+    if PROFILE:
+        # Stage times from worker processes (--jobs) are summed over workers.
+        # Stages can be inside others (eg, langdetect is inside clean_entry).
+        profiler.write(profile_fname_json, profile_fname_tsv,
+            n_jobs=N_JOBS, spacy_processes=SPACY_N_PROCESS, cache=CACHE, prefilter=PREFILTER,
+            exclusions={ x: int(exclusion_counts[x]) for x in EXCLUSION_STEPS }, kept=len(df))
+        stage_report = pd.DataFrame.from_dict(profiler.summary()["stages"], orient="index"
+            ).sort_values("seconds", ascending=False)
+        print(stage_report.round(4).to_string())
@@ -0,0 +1,49 @@
+"""Tokenize the cleaned posts once for all the validate scripts.
+
+validate-classifier.py, validate-wordshift.py, and validate-liwc.py
+all used to split up the text columns themselves every time they ran.
+Now they load the tokens from here instead (see tokencorpus for the files,
+and config.load_dreamviews_tokens). Each text column gets tokenized
+the same way the scripts did it before, so their results don't change.
+
+Give tokenization names to only redo those (default is all of them).
+
+IMPORTS
+=======
+    - posts, derivatives/dreamviews-posts.tsv
+EXPORTS
+=======
+    - lemma tokens vocab,          derivatives/dreamviews-tokens_lemmas-vocab.json
+    - lemma tokens post IDs,       derivatives/dreamviews-tokens_lemmas-post_ids.txt
+    - lemma tokens of all posts,   derivatives/dreamviews-tokens_lemmas-ids.npy
+    - lemma tokens start of posts, derivatives/dreamviews-tokens_lemmas-indptr.npy
+    - LIWC tokens vocab,           derivatives/dreamviews-tokens_liwc-vocab.json
+    - LIWC tokens post IDs,        derivatives/dreamviews-tokens_liwc-post_ids.txt
+    - LIWC tokens of all posts,    derivatives/dreamviews-tokens_liwc-ids.npy
+    - LIWC tokens start of posts,  derivatives/dreamviews-tokens_liwc-indptr.npy
+"""
+import tqdm
+import argparse
+
+import config as c
+import tokencorpus
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("names", nargs="*", help=f"Which tokenizations to make, any of {list(tokencorpus.TOKENIZATIONS)}.")
+args = parser.parse_args()
+
+NAMES = args.names or list(tokencorpus.TOKENIZATIONS)
+for name in NAMES:
+    if name not in tokencorpus.TOKENIZATIONS:
+        parser.error(f"no tokenization named {name}")
+
+
+df = c.load_dreamviews_posts(columns=["post_id"] + [ tokencorpus.TOKENIZATIONS[name] for name in NAMES ])
+
+for name in NAMES:
+    txt_col = tokencorpus.TOKENIZATIONS[name]
+    texts = tqdm.tqdm(df[txt_col].tolist(), desc=f"tokenizing {txt_col} ({name})")
+    corpus = tokencorpus.build(texts, df["post_id"].tolist(), tokencorpus.TOKENIZERS[name])
+    tokencorpus.save(corpus, c.DATA_DIR, name)
+    print(f"{name}: {len(corpus)} posts, {len(corpus.ids)} tokens, {len(corpus.vocab)} different")
@@ -4,23 +4,53 @@ Cleaning/reducing the raw user file.
 There is a lot of likely useless user info
 that won't be in the final output file.
 
-Main time consumption is getting standardized country codes.
+Parsing the html profiles can be spread over
+several processes with --jobs. Standardized country
+codes get looked up once per distinct country flag
+(there's only a couple hundred), and those lookups are
+saved in derivatives/clean-users_countries.json so
+reruns don't redo them (--no-cache to redo them anyways).
+
+IMPORTS
+=======
+    - raw html profiles,  source/dreamviews-users.zip
+    - username to userid, derivatives/dreamviews-users_key.json
+EXPORTS
+=======
+    - cleaned user info, derivatives/dreamviews-users.tsv
+    - country code lookups, derivatives/clean-users_countries.json
 """
 import os
 import re
 import tqdm
 import json
 import zipfile
+import argparse
 import pycountry
+import contextlib
+from importlib.metadata import version
 import pandas as pd
-from bs4 import BeautifulSoup
 import config as c
+import htmlextract
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--html-backend", choices=htmlextract.BACKENDS, default="bs4",
+    help="How to parse the html pages (lxml is faster, see benchmark-htmlextract.py).")
+parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes for parsing profiles.")
+parser.add_argument("--no-cache", action="store_true", help="Don't read the saved country code lookups.")
+args = parser.parse_args()
+
+HTML_BACKEND = args.html_backend
+N_JOBS = args.jobs
+CACHE = not args.no_cache
 
 
 export_fname = os.path.join(c.DATA_DIR, "derivatives", "dreamviews-users.tsv")
 
 import_fname_html = os.path.join(c.DATA_DIR, "source", "dreamviews-users.zip")
 import_fname_user_key = os.path.join(c.DATA_DIR, "derivatives", "dreamviews-users_key.json")
+countries_fname = os.path.join(c.DATA_DIR, "derivatives", "clean-users_countries.json")
 
 
 # select which columns survive to final output file
@@ -49,65 +79,43 @@ USER_ATTRIBUTES = [ # these all get lowercased and cleaned when turned into colu
     "Dream Journal", "Custom", "Points spend in Shop"
 ]
 
-
-
-
-
-# Load in key to get unique anonymous user IDs from the raw IDs.
-with open(import_fname_user_key, "rt", encoding="utf-8") as f:
-    user_raw2id_key = json.load(f)
-
-
-# Loop over all the raw html files and get user info from each.
-
-with zipfile.ZipFile(import_fname_html, mode="r") as zf:
-    fnames = zf.namelist()
-    all_user_data = {}
-    for fn in tqdm.tqdm(fnames, desc="parsing html user pages"):
-        # get the anonymized username
-        username = fn[:-5] # remove ".html" off the end
-        user_id = user_raw2id_key[username]
-        html = zf.read(fn) # read in the html file
-        soup = BeautifulSoup(html, "html.parser", from_encoding="windows-1252")
-        ### All good info is within <dt> tags.
-        ### But not all users have all <dt> tags,
-        ### and there are some unwanted <dt> tags.
-        ### So grab all the <dt> tags and search
-        ### for those desired. If a user doesn't
-        ### have them, it just won't get added.
-        ###
-        ### All <dt> tags are immediately followed
-        ### by a <dd> tag that has the response info.
-        all_dt_tags = soup.find_all("dt")
-        single_user_data = {}
-        for dt_tag in all_dt_tags:
-            header = dt_tag.get_text()
-            if header in USER_ATTRIBUTES:
-                response = dt_tag.find_next("dd").get_text(separator=" ", strip=True)
-                # replace commas if it's in a number
-                if len(response.replace(",", "")) == sum([ char.isdigit() for char in response ]):
-                    response = response.replace(",", "")
-                # minor cleanup for the attribute name before using it as a dict key
-                attr_key = header.rstrip(":").replace(" ", "_").lower()
-                single_user_data[attr_key] = response
-
-        if single_user_data:
-            all_user_data[user_id] = single_user_data
-
-
-
-# Aggregate user data into a dataframe.
-df = pd.DataFrame.from_dict(all_user_data, orient="index")
-
-# convert join date to year-month-day
-# other date columns (last_activity and most_recent_message)
-# could also be converted but they aren't that useful and
-# sometimes have they "Today/Yesterday" in them.
-# Not keeping any of them anyways so don't worry about converting.
-df["join_date"] = pd.to_datetime(df["join_date"],
-    format="%m-%d-%Y").dt.strftime("%Y-%m-%d")
-
-df.sort_values(["join_date", "last_activity"], inplace=True)
+# header: column name, worked out once (also drops the repeats above)
+ATTRIBUTE_COLUMNS = { header: header.rstrip(":").replace(" ", "_").lower()
+    for header in USER_ATTRIBUTES }
+
+
+def parse_profile(fname_and_html):
+    """Username and {attribute: response} of one raw html profile (can run in a worker process)."""
+    fn, html = fname_and_html
+    username = fn[:-5] # remove ".html" off the end
+    ### All good info is within <dt> tags.
+    ### But not all users have all <dt> tags,
+    ### and there are some unwanted <dt> tags.
+    ### So go over all the <dt> tags and keep
+    ### those desired. If a user doesn't
+    ### have them, it just won't get added.
+    ###
+    ### All <dt> tags are immediately followed
+    ### by a <dd> tag that has the response info.
+    ### (htmlextract gets the text of each pair
+    ###  in one pass, only for the wanted headers)
+    ### If a <dt> has no <dd> after it (eg, at the
+    ### end of a broken page) it gets skipped too.
+    single_user_data = {}
+    for header, response in htmlextract.profile_page(html, backend=HTML_BACKEND, headers=ATTRIBUTE_COLUMNS):
+        if response is None:
+            continue
+        # replace commas if it's in a number
+        stripped = response.replace(",", "")
+        if not stripped or stripped.isdigit():
+            response = stripped
+        single_user_data[ATTRIBUTE_COLUMNS[header]] = response
+    return username, single_user_data
+
+
+def iter_html_files(zf):
+    for fn in zf.namelist():
+        yield fn, zf.read(fn)
 
 
 ###################################################
@@ -139,9 +147,7 @@ COUNTRY_REPLACEMENTS = {
 def get_country_code(x):
 
     # minor string adjustments before lookup in pycountry
-    if pd.isna(x):
-        return pd.NA
-    elif x in COUNTRY_REPLACEMENTS:
+    if x in COUNTRY_REPLACEMENTS:
         x = COUNTRY_REPLACEMENTS[x]
     else:
         # add spaces to multiword countries (for pycountry lookup)
@@ -159,14 +165,86 @@ def get_country_code(x):
     return country.alpha_3
 
 
-tqdm.tqdm.pandas(desc="country code lookups")
-df["country"] = df["country_flag"].progress_apply(get_country_code)
-df["gender"] = df["gender"].str.lower()
+def load_country_codes(fname):
+    """Saved {country flag: code} lookups, unless they were made
+    with different replacements or a different pycountry."""
+    if not CACHE or not os.path.isfile(fname):
+        return {}
+    with open(fname, "rt", encoding="utf-8") as f:
+        saved = json.load(f)
+    if (saved.get("pycountry_version") != version("pycountry")
+            or saved.get("replacements") != COUNTRY_REPLACEMENTS):
+        return {}
+    return saved["codes"]
+
+
+def save_country_codes(fname, codes):
+    saved = {
+        "pycountry_version" : version("pycountry"),
+        "replacements" : COUNTRY_REPLACEMENTS,
+        "codes" : dict(sorted(codes.items())),
+    }
+    with open(fname, "wt", encoding="utf-8") as f:
+        json.dump(saved, f, indent=4, ensure_ascii=False)
+
+
+def country_codes(country_flags, saved_codes):
+    """Country code of each flag, looking up each distinct one only once."""
+    codes = dict(saved_codes)
+    new_flags = set(country_flags.dropna().unique()) - set(codes)
+    for x in tqdm.tqdm(sorted(new_flags), desc="country code lookups"):
+        codes[x] = get_country_code(x)
+    return country_flags.map(codes), codes
+
+
+if __name__ == "__main__":
+
+    # Load in key to get unique anonymous user IDs from the raw IDs.
+    with open(import_fname_user_key, "rt", encoding="utf-8") as f:
+        user_raw2id_key = json.load(f)
+
+
+    # Loop over all the raw html files and get user info from each.
+    # (Parsing can happen in parallel, see --jobs, results come back in the same order.)
+
+    # Files are read as they're needed, a few chunks ahead of the workers,
+    # and closing makes sure the workers get shut down even after an error.
+    with zipfile.ZipFile(import_fname_html, mode="r") as zf:
+        n_files = len(zf.namelist())
+        parsed_profiles = c.imap_ordered(parse_profile, iter_html_files(zf), N_JOBS, chunksize=64)
+        all_user_data = {}
+        with contextlib.closing(parsed_profiles):
+            for username, single_user_data in tqdm.tqdm(parsed_profiles, total=n_files, desc="parsing html user pages"):
+                # get the anonymized username
+                user_id = user_raw2id_key[username]
+                if single_user_data:
+                    all_user_data[user_id] = single_user_data
+
+
+
+    # Aggregate user data into a dataframe.
+    df = pd.DataFrame.from_dict(all_user_data, orient="index")
+
+    # convert join date to year-month-day
+    # other date columns (last_activity and most_recent_message)
+    # could also be converted but they aren't that useful and
+    # sometimes have they "Today/Yesterday" in them.
+    # Not keeping any of them anyways so don't worry about converting.
+    df["join_date"] = pd.to_datetime(df["join_date"],
+        format="%m-%d-%Y").dt.strftime("%Y-%m-%d")
+
+    df.sort_values(["join_date", "last_activity"], inplace=True)
+
+
+    # Standardized country codes (saved lookups are reused, see --no-cache).
+    df["country"], codes = country_codes(df["country_flag"], load_country_codes(countries_fname))
+    save_country_codes(countries_fname, codes)
+    df["gender"] = df["gender"].str.lower()
 
 
 
 
-# Export.
+    # Export.
 
-df[KEEP_COLUMNS].to_csv(export_fname, encoding="ascii",
-    sep="\t", na_rep="NA", index=True, index_label="user_id")
+    df[KEEP_COLUMNS].to_csv(export_fname, encoding="ascii",
+        sep="\t", na_rep="NA", index=True, index_label="user_id")
@@ -29,11 +29,213 @@ def load_dreamviews_users():
     users = pd.read_csv(users_fname, sep="\t", encoding="ascii")
     return users
 
-def load_dreamviews_posts():
-    import os; import pandas as pd
+# Column types of the posts file (timestamp is a datetime too),
+# picked to keep the whole corpus small in memory.
+# Columns with only a few different values are categoricals,
+# counts are small ints (they can't go over MAX_POSTCOUNT/MAX_WORDCOUNT),
+# and everything else is strings stored by arrow instead of as python objects.
+# describe-memory.py shows how much each one saves.
+POSTS_DTYPES = {
+    "post_id"     : "string[pyarrow]",
+    "user_id"     : "category",
+    "nth_post"    : "int16",
+    "title"       : "string[pyarrow]",
+    "tags"        : "string[pyarrow]",
+    "categories"  : "category",
+    "lucidity"    : "category",
+    "nightmare"   : "bool",
+    "wordcount"   : "int16",
+    "post_clean"  : "string[pyarrow]",
+    "post_lemmas" : "string[pyarrow]",
+}
+
+def posts_schema(posts):
+    """Convert any posts columns that aren't already to their POSTS_DTYPES type."""
+    dtypes = { col: dtype for col, dtype in POSTS_DTYPES.items()
+        if col in posts and posts[col].dtype != dtype }
+    return posts.astype(dtypes) if dtypes else posts
+
+def dreamviews_posts_parquet():
+    """Filename of a parquet version of the current cleaned posts.
+
+    That's the one clean-posts.py writes, if it's at least as new as the tsv.
+    Otherwise the tsv gets converted once and saved to derivatives/cache,
+    under a name with the size and modification time of the tsv so it's
+    redone whenever the tsv changes.
+    """
+    import os; import glob; import pandas as pd
     posts_fname = os.path.join(DATA_DIR, "derivatives", "dreamviews-posts.tsv")
-    posts = pd.read_csv(posts_fname, sep="\t", encoding="ascii", parse_dates=["timestamp"])
-    return posts
+    parquet_fname = posts_fname.replace(".tsv", ".parquet")
+    if os.path.isfile(parquet_fname) and (not os.path.isfile(posts_fname)
+            or os.path.getmtime(parquet_fname) >= os.path.getmtime(posts_fname)):
+        return parquet_fname
+    stat = os.stat(posts_fname)
+    cache_dir = os.path.join(DATA_DIR, "derivatives", "cache")
+    cache_fname = os.path.join(cache_dir, f"dreamviews-posts_{stat.st_size}-{stat.st_mtime_ns}.parquet")
+    if not os.path.isfile(cache_fname):
+        os.makedirs(cache_dir, exist_ok=True)
+        for old_fname in glob.glob(os.path.join(cache_dir, "dreamviews-posts_*.parquet")):
+            os.remove(old_fname)
+        posts = pd.read_csv(posts_fname, sep="\t", encoding="ascii",
+            dtype=POSTS_DTYPES, parse_dates=["timestamp"])
+        posts.to_parquet(cache_fname, index=False)
+    return cache_fname
+
+# clean-posts.py --partition also writes the posts split up by these
+# (year of the timestamp, which isn't a posts column, and lucidity)
+POSTS_PARTITION_COLS = ["year", "lucidity"]
+
+def dreamviews_posts_partitioned():
+    """Directory of the posts split up by year and lucidity (from clean-posts.py --partition),
+    or None if there isn't one that's at least as new as the tsv."""
+    import os
+    posts_fname = os.path.join(DATA_DIR, "derivatives", "dreamviews-posts.tsv")
+    dirname = os.path.join(DATA_DIR, "derivatives", "dreamviews-posts_partitioned")
+    if os.path.isdir(dirname) and (not os.path.isfile(posts_fname)
+            or os.path.getmtime(dirname) >= os.path.getmtime(posts_fname)):
+        return dirname
+    return None
+
+def _tidy_posts(posts, order=False):
+    """Make a subset of the posts look the same no matter where it was read from.
+    Categories are only the ones left (sorted), and with order
+    the rows go back to the order of the posts file (by user, then nth post).
+    """
+    import pandas as pd
+    for col in posts.columns[posts.dtypes.eq("category")]:
+        used = posts[col].cat.remove_unused_categories().cat.categories
+        posts[col] = posts[col].cat.set_categories(sorted(used))
+    if order:
+        by_user = posts["user_id"].astype(str).to_numpy()
+        rows = pd.DataFrame({"user": by_user, "nth": posts["nth_post"].to_numpy()}
+            ).sort_values(["user", "nth"], kind="stable").index
+        posts = posts.take(rows)
+    return posts.reset_index(drop=True)
+
+_loaded_posts = {} # already loaded in this process, see load_dreamviews_posts
+
+def load_dreamviews_posts(columns=None, filters=None, start_date=None, end_date=None):
+    """Load the cleaned posts (from parquet, see dreamviews_posts_parquet).
+
+    columns is a list of the columns to load (all of them by default),
+    so big text columns don't get read when they aren't needed.
+    filters is a dict of {column: values} to only load rows where the column
+    is one of the values, eg {"lucidity": ["lucid", "nonlucid"]}.
+    start_date and end_date (eg, START_DATE and END_DATE) only load posts
+    from those days (both included). Filter columns don't have to be in columns.
+
+    If there's a partitioned copy (clean-posts.py --partition), lucidity and date
+    filters only read the files of the matching years/lucidity labels.
+    Either way filtered posts come out the same, in the same order as
+    the posts file and with only the categories that are left.
+
+    Each file/columns/filters combination is only read once per process,
+    after that a copy of the first one is returned. And once all the posts
+    are loaded (no columns or filters), everything else comes from those
+    without reading the file again. runall.py --in-process uses that to
+    share one posts frame across all the scripts it runs.
+    """
+    import os; import pandas as pd
+    parquet_fname = dreamviews_posts_parquet()
+    stat = os.stat(parquet_fname)
+    if columns is not None:
+        columns = list(columns)
+    if filters is not None:
+        filters = { col: sorted(values) if isinstance(values, (list, tuple, set)) else [values]
+            for col, values in filters.items() }
+    # whole days, so the end date is up to (not including) the day after
+    start = None if start_date is None else pd.Timestamp(start_date)
+    stop = None if end_date is None else pd.Timestamp(end_date) + pd.Timedelta(days=1)
+    filtered = filters is not None or start is not None or stop is not None
+    key = (parquet_fname, stat.st_size, stat.st_mtime_ns,
+        None if columns is None else tuple(columns),
+        None if filters is None else tuple( (col, tuple(v)) for col, v in sorted(filters.items()) ),
+        start, stop)
+    full_key = key[:3] + (None, None, None, None)
+    if key not in _loaded_posts and full_key in _loaded_posts:
+        posts = _loaded_posts[full_key]
+        if filtered:
+            keep = pd.Series(True, index=posts.index)
+            for col, v in (filters or {}).items():
+                keep &= posts[col].isin(v)
+            if start is not None:
+                keep &= posts["timestamp"].ge(start)
+            if stop is not None:
+                keep &= posts["timestamp"].lt(stop)
+            posts = _tidy_posts(posts[keep].copy())
+        return posts[columns] if columns is not None else posts.copy()
+    if key not in _loaded_posts:
+        pa_filters = [ (col, "in", v) for col, v in (filters or {}).items() ]
+        if start is not None:
+            pa_filters.append(("timestamp", ">=", start))
+        if stop is not None:
+            pa_filters.append(("timestamp", "<", stop))
+        partitioned_dirname = dreamviews_posts_partitioned()
+        use_partitions = partitioned_dirname is not None and (start is not None
+            or stop is not None or (filters is not None and "lucidity" in filters))
+        if use_partitions:
+            # the year filters are only there to skip whole year directories
+            if start is not None:
+                pa_filters.append(("year", ">=", start.year))
+            if stop is not None:
+                pa_filters.append(("year", "<=", (stop - pd.Timedelta(days=1)).year))
+            # user and nth post to put the rows back in order, then dropped
+            read_columns = None if columns is None else list(dict.fromkeys(columns + ["user_id", "nth_post"]))
+            posts = pd.read_parquet(partitioned_dirname, columns=read_columns, filters=pa_filters)
+            posts = _tidy_posts(posts.drop(columns="year", errors="ignore"), order=True)
+            if columns is None: # same column order as the posts file
+                import pyarrow.parquet as pq
+                columns = pq.read_schema(parquet_fname).names
+            posts = posts[columns]
+        else:
+            posts = pd.read_parquet(parquet_fname, columns=columns, filters=pa_filters or None)
+            if filtered:
+                posts = _tidy_posts(posts)
+        _loaded_posts[key] = posts_schema(posts)
+    return _loaded_posts[key].copy()
+
+def load_dreamviews_tokens(name):
+    """One tokenization of the posts from clean-tokens.py ("lemmas" or "liwc"),
+    as a tokencorpus.TokenCorpus (the big arrays are memory-mapped).
+    Raises an error if the tokens are older than the posts tsv (rerun clean-tokens.py)."""
+    import tokencorpus
+    return tokencorpus.load(DATA_DIR, name)
+
+def _map_chunk(func, items):
+    return [ func(item) for item in items ]
+
+def imap_ordered(func, iterable, n_jobs, n_ahead=4, chunksize=1):
+    """Like map(func, iterable), but spread over n_jobs processes.
+
+    Results still come back in the same order as the input. Only a few
+    chunks per process get submitted ahead of the one being waited on,
+    so the input keeps being streamed instead of read all at once.
+    Items go to the processes chunksize at a time (for lots of quick ones).
+    """
+    import itertools; import concurrent.futures; from collections import deque
+    if n_jobs == 1:
+        yield from map(func, iterable)
+        return
+    iterator = iter(iterable)
+    chunks = iter(lambda: list(itertools.islice(iterator, chunksize)), [])
+    with concurrent.futures.ProcessPoolExecutor(n_jobs) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_map_chunk, func, chunk))
+            if len(pending) >= n_jobs * n_ahead:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def dreamviews_posts_archives():
+    """Raw posts zipfiles, main one first and then any "delta"
+    zipfiles from incremental crawls (oldest to newest).
+    """
+    import os; import glob
+    source_dir = os.path.join(DATA_DIR, "source")
+    main_fname = os.path.join(source_dir, "dreamviews-posts.zip")
+    delta_fnames = sorted(glob.glob(os.path.join(source_dir, "dreamviews-posts_delta-*.zip")))
+    return [ fn for fn in [main_fname] + delta_fnames if os.path.isfile(fn) ]
 
 def strip_doublebracket_content(txt):
     """match anything in double square brackets (including the brackets)
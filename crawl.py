@@ -0,0 +1,396 @@
+"""Helpers shared by the scrape-*.py scripts.
+
+Fetching pages goes through a "fetcher", which is anything with a
+fetch(url) method returning a FetchResult (for the async one fetch
+is a coroutine). RequestsFetcher does one request at a time and
+AiohttpFetcher keeps many in flight. Neither knows anything about
+DreamViews, so pointing the scrapers at a different base url (eg,
+the local fixtureserver.py) is enough to crawl something else.
+
+Both fetchers follow the same FetchPolicy, which retries transient
+failures with exponential backoff and adapts how fast requests go
+out (slower after a 429, faster again while responses come back quick).
+Everything they send and receive is tallied in the policy's CrawlMetrics,
+which gets written to a json file at the end of a crawl.
+
+The raw html pages all go into a zipfile, one member per page.
+The archive functions handle opening that zipfile so that an interrupted
+crawl can pick up where it left off instead of starting over.
+"""
+import os
+import json
+import time
+import zlib
+import random
+import struct
+import asyncio
+import zipfile
+
+from collections import Counter, namedtuple
+
+
+DREAMVIEWS_BASE_URL = "https://www.dreamviews.com"
+
+# status is the http status code (0 if the request never got a response),
+# content is the raw bytes, and elapsed is seconds from sending the
+# request to having the whole body (of the last attempt, if retried)
+FetchResult = namedtuple("FetchResult", ["url", "status", "content", "elapsed"])
+
+# responses worth trying again, anything else is taken as final
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# upper edges (in seconds) of the latency histogram bins
+LATENCY_BINS = [.05, .1, .25, .5, 1, 2.5, 5, 10, 30]
+
+
+class CrawlError(RuntimeError):
+    pass
+
+
+def result_ok(result):
+    return 200 <= result.status < 400
+
+
+def parse_retry_after(value):
+    # only the delay-seconds form, http dates are rare enough to ignore
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CrawlMetrics:
+    """Running tallies of everything a crawl sends and receives."""
+    def __init__(self):
+        self.t_start = time.time()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.bytes = 0
+        self.status_counts = Counter()
+        self.latencies = []
+
+    def record(self, result):
+        self.requests += 1
+        self.bytes += len(result.content)
+        self.status_counts[result.status] += 1
+        self.latencies.append(result.elapsed)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        percentile = lambda q: latencies[round(q*(len(latencies)-1))] if latencies else None
+        histogram = Counter()
+        for x in latencies:
+            label = next(( f"<={b}" for b in LATENCY_BINS if x <= b ), f">{LATENCY_BINS[-1]}")
+            histogram[label] += 1
+        return {
+            "wall_seconds"   : time.time() - self.t_start,
+            "requests"       : self.requests,
+            "retries"        : self.retries,
+            "failures"       : self.failures,
+            "bytes"          : self.bytes,
+            "status_counts"  : { str(k): v for k, v in sorted(self.status_counts.items()) },
+            "latency_seconds": {
+                "mean" : sum(latencies) / len(latencies) if latencies else None,
+                "p50"  : percentile(.5),
+                "p90"  : percentile(.9),
+                "p99"  : percentile(.99),
+                "max"  : latencies[-1] if latencies else None,
+                "histogram" : { label: histogram[label] for label in
+                    [ f"<={b}" for b in LATENCY_BINS ] + [f">{LATENCY_BINS[-1]}"] },
+            },
+        }
+
+    def write(self, fname, **extra):
+        with open(fname, "wt", encoding="utf-8") as f:
+            json.dump({**self.summary(), **extra}, f, indent=4)
+
+
+class FetchPolicy:
+    """How to retry failed requests and how fast to send them.
+
+    Retries: a request that gets no response or one of RETRY_STATUSES
+    is tried again up to max_retries times, after waiting backoff_base*2**attempt
+    seconds (randomly jittered and capped at backoff_max), or however long
+    the server's Retry-After asked for. The whole crawl gets at most retry_budget
+    retries, after which failures are returned as they are.
+
+    Rate: request starts are spaced at least `interval` seconds apart.
+    It begins at min_interval, doubles (up to max_interval) on every 429,
+    and shrinks back down toward min_interval by interval_step after every
+    successful response that took less than fast_latency seconds.
+    """
+    def __init__(self, max_retries=5, retry_budget=1000,
+            backoff_base=1, backoff_max=60, min_interval=0, max_interval=30,
+            interval_step=.05, fast_latency=.5, metrics=None):
+        self.max_retries = max_retries
+        self.retries_left = retry_budget
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval_step = interval_step
+        self.fast_latency = fast_latency
+        self.interval = min_interval
+        self.peak_interval = min_interval
+        self.metrics = CrawlMetrics() if metrics is None else metrics
+        self.rng = random.Random()
+
+    def observe(self, result):
+        """Record a response (or failure) and adjust the request rate."""
+        self.metrics.record(result)
+        if result.status == 429:
+            self.interval = min(self.max_interval, max(2*self.interval, self.interval_step))
+            self.peak_interval = max(self.peak_interval, self.interval)
+        elif result_ok(result) and result.elapsed < self.fast_latency:
+            self.interval = max(self.min_interval, self.interval - self.interval_step)
+
+    def retry_delay(self, attempt, result, retry_after=None):
+        """Seconds to wait before trying again, or None to give up."""
+        if result.status != 0 and result.status not in RETRY_STATUSES:
+            return None
+        if attempt >= self.max_retries or self.retries_left <= 0:
+            self.metrics.failures += 1
+            return None
+        self.retries_left -= 1
+        self.metrics.retries += 1
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+        return self.rng.uniform(delay/2, delay)
+
+    def write_metrics(self, fname):
+        self.metrics.write(fname, rate={
+            "min_interval"   : self.min_interval,
+            "peak_interval"  : self.peak_interval,
+            "final_interval" : self.interval,
+            "retry_budget_left" : self.retries_left,
+        })
+
+
+class RequestsFetcher:
+    """Fetch pages one at a time with a requests.Session."""
+    def __init__(self, policy=None, timeout=60):
+        import requests
+        self.session = requests.Session()
+        self.policy = FetchPolicy() if policy is None else policy
+        self.timeout = timeout
+        self.next_start = 0
+
+    def fetch(self, url):
+        import requests
+        attempt = 0
+        while True:
+            delay = self.next_start - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_start = time.monotonic() + self.policy.interval
+            t0 = time.perf_counter()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                status, content = response.status_code, response.content
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            except requests.RequestException:
+                status, content, retry_after = 0, b"", None
+            result = FetchResult(url, status, content, time.perf_counter()-t0)
+            self.policy.observe(result)
+            delay = self.policy.retry_delay(attempt, result, retry_after)
+            if delay is None:
+                return result
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class HostPoliteness:
+    """Space out request starts to a single host
+    so that no two start within the policy's current interval.
+    """
+    def __init__(self, policy):
+        self.policy = policy
+        self.lock = asyncio.Lock()
+        self.next_start = 0
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            delay = self.next_start - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_start = loop.time() + self.policy.interval
+
+
+class AiohttpFetcher:
+    """Fetch pages concurrently with aiohttp.
+
+    At most max_connections requests are in flight at once, and request
+    starts are spaced by the policy's interval (from min_interval up).
+    Must be used as an async context manager from within a running loop.
+    """
+    def __init__(self, max_connections=8, min_interval=.25, policy=None, timeout=60):
+        self.max_connections = max_connections
+        self.policy = FetchPolicy(min_interval=min_interval) if policy is None else policy
+        self.timeout = timeout
+
+    async def __aenter__(self):
+        import aiohttp
+        self.semaphore = asyncio.Semaphore(self.max_connections)
+        self.politeness = HostPoliteness(self.policy)
+        connector = aiohttp.TCPConnector(limit_per_host=self.max_connections)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def fetch(self, url):
+        import aiohttp
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                await self.politeness.wait()
+                t0 = time.perf_counter()
+                try:
+                    async with self.session.get(url) as response:
+                        status, content = response.status, await response.read()
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    status, content, retry_after = 0, b"", None
+                result = FetchResult(url, status, content, time.perf_counter()-t0)
+                self.policy.observe(result)
+            # back off *outside* the semaphore so other requests keep going
+            delay = self.policy.retry_delay(attempt, result, retry_after)
+            if delay is None:
+                return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+LOCAL_HEADER_STRUCT = struct.Struct("<4s5H3L2H")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+def open_archive(fname, resume=False):
+    """Open the zipfile that a crawl writes pages into.
+
+    Without resume the file must not exist yet (same as always).
+    With resume an existing archive is opened for appending, and
+    the member names already in it are returned so they can be skipped.
+
+    Returns the open zipfile and a set of names already in it.
+    """
+    if resume and os.path.isfile(fname):
+        # (Check first, because append mode on a non-zip file
+        #  silently starts a new archive at the end of it.)
+        if not zipfile.is_zipfile(fname):
+            # The crawl was killed before the zipfile could be closed,
+            # so it has pages but no central directory. Rebuild it.
+            n_salvaged = salvage_archive(fname)
+            print(f"Rebuilt unfinished archive {fname} with {n_salvaged} complete pages.")
+        zf = zipfile.ZipFile(fname, mode="a", compression=zipfile.ZIP_DEFLATED)
+        return zf, set(zf.namelist())
+    zf = zipfile.ZipFile(fname, mode="x", compression=zipfile.ZIP_DEFLATED)
+    return zf, set()
+
+
+def salvage_archive(fname):
+    """Rewrite a zipfile that is missing its central directory.
+
+    Walks the local file headers from the start of the file and
+    keeps every member whose data is complete and passes its CRC check.
+    Stops at the first truncated or broken member (ie, whatever was
+    being written when the crawl died). Returns the number of members kept.
+    """
+    with open(fname, "rb") as f:
+        raw = f.read()
+
+    members = []
+    offset = 0
+    while offset + LOCAL_HEADER_STRUCT.size <= len(raw):
+        (signature, _, flags, method, dostime, dosdate, crc,
+            compressed_size, _, name_length, extra_length
+            ) = LOCAL_HEADER_STRUCT.unpack_from(raw, offset)
+        if signature != LOCAL_HEADER_SIGNATURE or flags & 0x08:
+            # end of local headers, or sizes were not written in the header
+            break
+        name_start = offset + LOCAL_HEADER_STRUCT.size
+        data_start = name_start + name_length + extra_length
+        data_end = data_start + compressed_size
+        if data_end > len(raw):
+            break
+        data = raw[data_start:data_end]
+        try:
+            if method == zipfile.ZIP_DEFLATED:
+                data = zlib.decompress(data, -15)
+            elif method != zipfile.ZIP_STORED:
+                break
+        except zlib.error:
+            break
+        if zlib.crc32(data) != crc:
+            break
+        name = raw[name_start:name_start+name_length].decode("utf-8" if flags & 0x800 else "cp437")
+        date_time = ((dosdate>>9)+1980, (dosdate>>5)&0xF, dosdate&0x1F,
+                     dostime>>11, (dostime>>5)&0x3F, (dostime&0x1F)*2)
+        members.append((zipfile.ZipInfo(name, date_time), data))
+        offset = data_end
+
+    tmp_fname = fname + ".salvage"
+    with zipfile.ZipFile(tmp_fname, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for zinfo, data in members:
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(zinfo, data)
+    os.replace(tmp_fname, fname)
+    return len(members)
+
+
+def page_entries(html):
+    """Get the blog entries listed on one recent-entries page.
+
+    Entries are identified by the url of their title link.
+    Returns a list of (url, dated) tuples, where dated is False
+    for entries still marked "Today" or "Yesterday" (these
+    get skipped during cleaning, so they aren't "seen" yet).
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser", from_encoding="windows-1252")
+    page_dates  = soup.find_all("div", class_="blog_date")
+    page_titles = soup.find_all("a", class_="blogtitle")
+    entries = []
+    for date, title in zip(page_dates, page_titles):
+        date_txt = date.text.strip().split(", ", 1)[-1]
+        dated = not ("Today" in date_txt or "Yesterday" in date_txt)
+        entries.append((title.get("href"), dated))
+    return entries
+
+
+def load_seen_entries(seen_fname, archive_fnames):
+    """Load the urls of all blog entries already crawled.
+
+    They are kept in a plain text file (one url per line) that gets
+    extended after every incremental crawl. If that file isn't there
+    yet, build it once from the existing archives (takes a few minutes).
+    """
+    if os.path.isfile(seen_fname):
+        with open(seen_fname, "rt", encoding="utf-8") as f:
+            return set(f.read().split())
+    seen = set()
+    for fname in archive_fnames:
+        with zipfile.ZipFile(fname, mode="r") as zf:
+            for fn in zf.namelist():
+                seen.update( url for url, dated in page_entries(zf.read(fn)) if dated )
+    save_seen_entries(seen_fname, seen)
+    return seen
+
+
+def save_seen_entries(seen_fname, seen):
+    with open(seen_fname, "wt", encoding="utf-8") as f:
+        f.write("\n".join(sorted(seen)))
@@ -25,7 +25,7 @@ c.load_matplotlib_settings()
 
 export_fname = os.path.join(c.DATA_DIR, "results", "describe-categorycounts.png")
 
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["post_id", "user_id", "lucidity", "nightmare"])
 df = df.set_index("post_id")
 
 # make new columns that denote lucid/non-lucid, independent of overlap
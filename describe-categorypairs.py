@@ -27,13 +27,13 @@ c.load_matplotlib_settings()
 export_fname_table = os.path.join(c.DATA_DIR, "results", "describe-categorypairs.tsv")
 export_fname_plot  = os.path.join(c.DATA_DIR, "results", "describe-categorypairs.png")
 
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["user_id", "lucidity"])
 
 # generate dataframe that has the count of lucid and
 # nonlucid dreams for each user that had at least 1
 SORT_ORDER = ["nonlucid", "lucid"]
 df_user = df[df["lucidity"].str.contains("lucid")
-    ].groupby(["user_id", "lucidity"]
+    ].groupby(["user_id", "lucidity"], observed=True
     ).size().rename("count"
     ).unstack(fill_value=0
     ).sort_values(SORT_ORDER, ascending=False
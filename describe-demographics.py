@@ -2,7 +2,7 @@
 
 IMPORTS
 =======
-    - user info, derivatives/dreamviews-posts.tsv
+    - user info, derivatives/dreamviews-users.tsv
 EXPORTS
 =======
     - table of how many people provided info, results/describe-demographics_provided.tsv
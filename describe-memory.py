@@ -0,0 +1,38 @@
+"""How much memory each column of the posts takes,
+loaded plainly from the tsv (python objects and 64-bit numbers)
+vs loaded with the config.POSTS_DTYPES types.
+
+IMPORTS
+=======
+    - posts, derivatives/dreamviews-posts.tsv
+EXPORTS
+=======
+    - table of per-column memory, results/describe-memory.tsv
+"""
+import os
+import pandas as pd
+import config as c
+
+
+################################ I/O
+import_fname = os.path.join(c.DATA_DIR, "derivatives", "dreamviews-posts.tsv")
+export_fname = os.path.join(c.DATA_DIR, "results", "describe-memory.tsv")
+
+before = pd.read_csv(import_fname, sep="\t", encoding="ascii", parse_dates=["timestamp"])
+after = c.load_dreamviews_posts()[before.columns]
+
+
+################################ compare
+
+# deep to count the strings themselves and not just pointers to them
+table = pd.DataFrame({
+        "dtype_before" : before.dtypes.astype(str),
+        "dtype_after"  : after.dtypes.astype(str),
+        "MB_before"    : before.memory_usage(index=False, deep=True) / 1e6,
+        "MB_after"     : after.memory_usage(index=False, deep=True) / 1e6,
+    }).rename_axis("column")
+table.loc["total"] = ["", "", table["MB_before"].sum(), table["MB_after"].sum()]
+table["ratio"] = table["MB_before"] / table["MB_after"]
+
+print(table.round(3).to_string())
+table.to_csv(export_fname, float_format="%.3f", index=True, sep="\t", encoding="utf-8")
@@ -40,11 +40,9 @@ if WHITE:
 if RESTRICT:
     export_fname = export_fname.replace(".png", "_RESTRICT.png")
 
-df = c.load_dreamviews_posts()
-
 # drop data if desired
-if RESTRICT:
-    df = df[ df["lucidity"].str.contains("lucid") ]
+filters = {"lucidity": ["lucid", "nonlucid"]} if RESTRICT else None
+df = c.load_dreamviews_posts(columns=["user_id", "lucidity", "timestamp"], filters=filters)
 
 ### generate a dataframe of user counts by month
 ### that accounts for novel/repeat users
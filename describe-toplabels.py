@@ -17,7 +17,7 @@ import config as c
 N_MIN_LABELS = 10 # only keep labels that show up >= 10 times
 N_MIN_USERS = 10  # across >= 10 unique users
 
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["user_id", "tags", "categories"])
 
 for col in ["tags", "categories"]:
 
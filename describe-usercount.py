@@ -19,7 +19,7 @@ c.load_matplotlib_settings()
 
 ################################ I/O
 export_fname = os.path.join(c.DATA_DIR, "results", "describe-usercount.png")
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["user_id"])
 
 # get counts
 counts = df["user_id"].value_counts(
@@ -23,7 +23,7 @@ c.load_matplotlib_settings()
 
 ################################ I/O
 export_fname_table = os.path.join(c.DATA_DIR, "results", "describe-wordcount.tsv")
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["post_id", "user_id", "lucidity", "wordcount", "post_lemmas"])
 
 # token counts column already exists, but need to add lemma one
 df["lemmacount"] = df["post_lemmas"].str.split().str.len()
@@ -40,15 +40,15 @@ token_melt["token_type"] = token_melt["token_type"].str.rstrip("count")
 
 # get a table of descriptives across the whole corpus
 # that averages within users to account for that bias
-total_descr = token_melt.groupby(["user_id", "token_type"]).mean(
+total_descr = token_melt.groupby(["user_id", "token_type"], observed=True).mean(
     ).groupby("token_type").describe(
     ).droplevel(level=0, axis=1).rename_axis("metric", axis=1)
 # # without averaging across users
 # total_descr = token_melt.groupby("token_type").n.describe()
 
 # same thing but get for lucid and non-lucid labeled posts
-lucid_descr = token_melt.groupby(["user_id", "lucidity", "token_type"]).mean(
-    ).groupby(["lucidity", "token_type"]).describe(
+lucid_descr = token_melt.groupby(["user_id", "lucidity", "token_type"], observed=True).mean(
+    ).groupby(["lucidity", "token_type"], observed=True).describe(
     ).droplevel(level=0, axis=1).rename_axis("metric", axis=1)
 
 ## merge them
@@ -137,9 +137,9 @@ for i, fname in enumerate(export_fnames):
     if i == 2:
         ymax = .003
         ylabel = "density"
-        for lucidity, series in df.groupby(["user_id", "lucidity"]
+        for lucidity, series in df.groupby(["user_id", "lucidity"], observed=True
                                  ).wordcount.mean(
-                                 ).groupby("lucidity"):
+                                 ).groupby("lucidity", observed=True):
             distvals = series.values
             if "lucid" in lucidity:
                 linecolor = c.COLORS[lucidity]
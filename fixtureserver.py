@@ -0,0 +1,129 @@
+"""Local stand-in for dreamviews.com that serves pages out of the scraped zipfiles.
+
+For measuring and regression-testing crawl throughput without
+touching the real site. Point a scraper at it with --base-url, eg
+
+    python fixtureserver.py --port 8765 --latency .05 --error-rate .01
+    python scrape-posts.py --base-url http://127.0.0.1:8765 --concurrent
+
+Routes mirror the real site:
+    /blogs/recent-entries                -> index0001.html from source/dreamviews-posts.zip
+    /blogs/recent-entries/index{i}.html  -> index{i:04d}.html from source/dreamviews-posts.zip
+    /members/{username}                  -> {username}.html from source/dreamviews-users.zip
+
+Every response is held back by --latency seconds (plus a random
+extra of up to --jitter seconds), and a random --error-rate proportion
+of requests get an --error-status response instead of the page.
+"""
+import os
+import re
+import time
+import random
+import zipfile
+import argparse
+import threading
+import http.server
+
+from urllib.parse import unquote
+
+import config as c
+
+
+POSTS_PAGE_RE = re.compile(r"^/blogs/recent-entries(?:/index(\d+)\.html)?/?$")
+MEMBER_PAGE_RE = re.compile(r"^/members/(.+?)/?$")
+
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency + server.rng.uniform(0, server.jitter))
+        if server.rng.random() < server.error_rate:
+            self.send_error(server.error_status)
+            return
+        content = server.lookup(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=windows-1252")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass # don't print a line for every request
+
+
+class FixtureServer(http.server.ThreadingHTTPServer):
+    """Serve raw DreamViews pages from the posts/users zipfiles.
+
+    Each request is handled on its own thread, so the
+    latency delays overlap like they would on a real server.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, posts_fname, users_fname=None,
+            latency=0, jitter=0, error_rate=0, error_status=503, seed=None):
+        super().__init__(address, FixtureHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.posts_zf = zipfile.ZipFile(posts_fname, mode="r")
+        self.users_zf = None
+        if users_fname is not None and os.path.isfile(users_fname):
+            self.users_zf = zipfile.ZipFile(users_fname, mode="r")
+        self.lock = threading.Lock()
+
+    def lookup(self, path):
+        path = unquote(path.split("?")[0])
+        posts_match = POSTS_PAGE_RE.match(path)
+        member_match = MEMBER_PAGE_RE.match(path)
+        if posts_match is not None:
+            page_number = int(posts_match.group(1) or 1)
+            return self.read_member(self.posts_zf, f"index{page_number:04d}.html")
+        elif member_match is not None and self.users_zf is not None:
+            return self.read_member(self.users_zf, f"{member_match.group(1)}.html")
+
+    def read_member(self, zf, name):
+        with self.lock:
+            try:
+                return zf.read(name)
+            except KeyError:
+                return None
+
+    def server_close(self):
+        super().server_close()
+        self.posts_zf.close()
+        if self.users_zf is not None:
+            self.users_zf.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds to hold back every response.")
+    parser.add_argument("--jitter", type=float, default=0, help="Up to this many extra seconds, random per response.")
+    parser.add_argument("--error-rate", type=float, default=0, help="Proportion of requests that get an error response.")
+    parser.add_argument("--error-status", type=int, default=503, help="Status code of the injected errors (eg, 429 or 503).")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the latency jitter and error injection.")
+    args = parser.parse_args()
+
+    posts_fname = os.path.join(c.DATA_DIR, "source", "dreamviews-posts.zip")
+    users_fname = os.path.join(c.DATA_DIR, "source", "dreamviews-users.zip")
+
+    server = FixtureServer((args.host, args.port), posts_fname, users_fname,
+        latency=args.latency, jitter=args.jitter, seed=args.seed,
+        error_rate=args.error_rate, error_status=args.error_status)
+
+    print(f"Serving DreamViews fixtures on http://{args.host}:{args.port} (ctrl+c to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
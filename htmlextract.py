@@ -0,0 +1,193 @@
+"""Pulling the raw fields out of DreamViews html pages.
+
+Shared by clean-posts.py (the recent-entries listing pages)
+and clean-users.py (the user profile pages), so both can switch
+between the same two backends:
+    - "bs4" is BeautifulSoup with python's html.parser,
+      which is what always got used (and still the default).
+    - "lxml" parses with libxml2 (in C) and finds things with
+      precompiled CSS selectors, which is several times faster.
+      Needs the lxml and cssselect packages.
+
+Both give back the text the way BeautifulSoup's get_text does it
+(script and style text and comments left out), and both decode the
+raw bytes as windows-1252 the same way. The two html parsers don't
+fix broken html the same way though, so benchmark-htmlextract.py
+checks that they agree on the actual raw archives (and times them)
+before switching to lxml for good.
+"""
+from collections import namedtuple
+
+
+BACKENDS = ["bs4", "lxml"]
+
+ENCODING = "windows-1252"
+
+# Raw text of one entry on a listing page, nothing cleaned yet.
+# user_link_title is the title attribute of the first link in the
+# user's box (None if there isn't one), which has the real username
+# when the displayed one got mangled into "[email protected]".
+PostFields = namedtuple("PostFields", ["url", "title", "date", "user", "user_link_title", "post"])
+
+
+def decode(html_byt):
+    """Bytes to text the way BeautifulSoup does it with from_encoding=ENCODING."""
+    from bs4.dammit import UnicodeDammit
+    return UnicodeDammit(html_byt, known_definite_encodings=[ENCODING], is_html=True).unicode_markup
+
+
+def dt_dd_pairs(tags, tag_name, get_text, headers=None):
+    """(header, response) text of each <dt> and the first <dd> after it,
+    in one pass over all the dt/dd tags in document order.
+
+    Pending <dt>s wait for the next <dd>, so it's the same <dd> as a
+    find_next("dd") from each <dt> would give, without searching ahead
+    from every one of them. With headers (anything that supports "in"),
+    only <dt>s with one of those headers are kept, and <dd>s that nobody
+    is waiting on don't get their text pulled out at all.
+    """
+    pairs = []
+    waiting = [] # indices into pairs of <dt>s without their <dd> yet
+    for tag in tags:
+        if tag_name(tag) == "dt":
+            header = get_text(tag)
+            if headers is None or header in headers:
+                waiting.append(len(pairs))
+                pairs.append((header, None))
+        elif waiting:
+            response = get_text(tag, separator=" ", strip=True)
+            for i in waiting:
+                pairs[i] = (pairs[i][0], response)
+            waiting = []
+    return pairs
+
+
+########## BeautifulSoup backend
+
+def posts_page_bs4(html_byt):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_byt, "html.parser", from_encoding=ENCODING)
+    page_posts  = soup.find_all("div", class_="blogbody")
+    page_users  = soup.find_all("div", class_="popupmenu memberaction")
+    page_dates  = soup.find_all("div", class_="blog_date")
+    page_titles = soup.find_all("a", class_="blogtitle")
+    # Make sure each dream journal entry has a
+    # corresponding username, date, and title
+    assert len(page_posts) == len(page_users) == len(page_dates) == len(page_titles)
+    entries = []
+    for post, user, date, title in zip(page_posts, page_users, page_dates, page_titles):
+        user_link = user.find("a")
+        entries.append(PostFields(
+            url=title.get("href"),
+            title=title.text,
+            date=date.text,
+            user=user.text,
+            user_link_title=None if user_link is None else user_link.get("title"),
+            post=post.text,
+        ))
+    return entries
+
+def profile_page_bs4(html_byt, headers=None):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_byt, "html.parser", from_encoding=ENCODING)
+    return dt_dd_pairs(soup.find_all(["dt", "dd"]), lambda tag: tag.name,
+        lambda tag, **kw: tag.get_text(**kw), headers)
+
+
+########## lxml backend
+
+lxml_selectors = None # compiled the first time they're needed
+
+def get_lxml_selectors():
+    global lxml_selectors
+    if lxml_selectors is None:
+        from lxml import etree
+        from lxml.cssselect import CSSSelector
+        lxml_selectors = {
+            # class_="popupmenu memberaction" in bs4 is the whole class attribute
+            "posts"  : CSSSelector("div.blogbody"),
+            "users"  : CSSSelector('div[class="popupmenu memberaction"]'),
+            "dates"  : CSSSelector("div.blog_date"),
+            "titles" : CSSSelector("a.blogtitle"),
+            "link"   : CSSSelector("a"),
+            # what get_text counts: all text except comments and script/style contents
+            "text"   : etree.XPath(".//text()[not(parent::script or parent::style)]"),
+        }
+    return lxml_selectors
+
+# libxml2 turns \r\n into \n but html.parser doesn't,
+# so carriage returns get swapped out for this while parsing.
+CR_STANDIN = "\ue000"
+
+# BeautifulSoup replaces text that's all ASCII whitespace with
+# a single newline (if it has one) or a single space, except in these.
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+
+def parse_lxml(html_byt):
+    import lxml.html
+    return lxml.html.document_fromstring(decode(html_byt).replace("\r", CR_STANDIN))
+
+def lxml_attr(element, attr):
+    value = element.get(attr)
+    return None if value is None else value.replace(CR_STANDIN, "\r")
+
+def bs4_string(s):
+    """One text node from lxml, the way BeautifulSoup would have it."""
+    text = str(s).replace(CR_STANDIN, "\r")
+    if not text.strip(ASCII_SPACES):
+        # the element it's in (the parent of the one it's the tail of, for tails)
+        container = s.getparent() if s.is_text else s.getparent().getparent()
+        if container is None or not any( e.tag in PRESERVE_WHITESPACE_TAGS
+                for e in (container, *container.iterancestors()) ):
+            text = "\n" if "\n" in text else " "
+    return text
+
+def lxml_text(element, separator="", strip=False):
+    strings = [ bs4_string(s) for s in get_lxml_selectors()["text"](element) ]
+    if strip:
+        strings = [ s for s in (s.strip() for s in strings) if s ]
+    return separator.join(strings)
+
+def posts_page_lxml(html_byt):
+    sel = get_lxml_selectors()
+    root = parse_lxml(html_byt)
+    page_posts  = sel["posts"](root)
+    page_users  = sel["users"](root)
+    page_dates  = sel["dates"](root)
+    page_titles = sel["titles"](root)
+    assert len(page_posts) == len(page_users) == len(page_dates) == len(page_titles)
+    entries = []
+    for post, user, date, title in zip(page_posts, page_users, page_dates, page_titles):
+        user_links = sel["link"](user)
+        entries.append(PostFields(
+            url=lxml_attr(title, "href"),
+            title=lxml_text(title),
+            date=lxml_text(date),
+            user=lxml_text(user),
+            user_link_title=lxml_attr(user_links[0], "title") if user_links else None,
+            post=lxml_text(post),
+        ))
+    return entries
+
+def profile_page_lxml(html_byt, headers=None):
+    root = parse_lxml(html_byt)
+    return dt_dd_pairs(root.iter("dt", "dd"), lambda element: element.tag, lxml_text, headers)
+
+
+########## Either one
+
+def posts_page(html_byt, backend="bs4"):
+    """A PostFields for every entry on a recent-entries page, in page order."""
+    return posts_page_lxml(html_byt) if backend == "lxml" else posts_page_bs4(html_byt)
+
+def profile_page(html_byt, backend="bs4", headers=None):
+    """(header, response) text of every <dt> on a profile page and the <dd> after it.
+
+    The header is the raw <dt> text. The response has each piece of text
+    stripped and joined by spaces (None if there's no <dd> after it).
+    Pass headers to only get the <dt>s with those headers (see dt_dd_pairs).
+    """
+    if backend == "lxml":
+        return profile_page_lxml(html_byt, headers)
+    return profile_page_bs4(html_byt, headers)
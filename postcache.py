@@ -0,0 +1,100 @@
+"""On-disk cache of the slow parts of clean-posts.py.
+
+Things like the cleaned text, the detected language, and spaCy's
+entities and lemmas of a post only depend on the post's raw text, so
+they get saved in an sqlite file keyed by a hash of that text. Rerunning
+clean-posts.py (eg, after changing a restriction) then only has to
+redo the posts or stages that actually changed.
+
+Every stage has a version string. Change the version (eg, bump
+textclean.VERSION after changing the cleaning) and everything saved
+under the old version gets ignored and redone. Stages that build on
+another one should include its version in their own.
+
+Any number of processes can read from the cache at once, but only
+one (the main clean-posts.py process) should write to it. Each process
+needs its own PostCache, and they shouldn't be forked with one open.
+"""
+import os
+import json
+import hashlib
+import sqlite3
+
+
+def content_key(content):
+    """Hash of raw text or bytes, to use as a cache key."""
+    if isinstance(content, str):
+        content = content.encode("utf-8", errors="surrogatepass")
+    return hashlib.sha1(content).hexdigest()
+
+
+class CacheRecord:
+    """Everything cached for one key, plus what got added since loading it."""
+    def __init__(self, key, values=None):
+        self.key = key
+        self.values = {} if values is None else values
+        self.new = {}
+
+    def get(self, stage):
+        return self.values.get(stage)
+
+    def set(self, stage, value):
+        self.values[stage] = value
+        self.new[stage] = value
+
+
+class PostCache:
+    """sqlite cache of per-stage results (anything json can take), by key and version.
+
+    With fname=None nothing is read or written, every record comes back empty.
+    """
+    def __init__(self, fname, versions, commit_every=1000):
+        self.fname = fname
+        self.versions = versions
+        self.commit_every = commit_every
+        # Connections can't be used (or closed) in a forked process. Start
+        # worker processes with spawn, or at least open a new PostCache in them.
+        self.pid = os.getpid()
+        self.n_uncommitted = 0
+        self.conn = None
+        if fname is not None:
+            self.conn = sqlite3.connect(fname)
+            # lets other processes keep reading while this one writes
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS products (
+                key TEXT, stage TEXT, version TEXT, value TEXT,
+                PRIMARY KEY (key, stage))""")
+            self.conn.commit()
+
+    def record(self, key):
+        """Load a CacheRecord with all the results for key that match the current versions."""
+        values = {}
+        if self.conn is not None:
+            rows = self.conn.execute("SELECT stage, version, value FROM products WHERE key = ?", (key,))
+            for stage, version, value in rows:
+                if self.versions.get(stage) == version:
+                    values[stage] = json.loads(value)
+        return CacheRecord(key, values)
+
+    def put(self, record):
+        """Save whatever got added to a record (set) since it was loaded."""
+        if self.conn is None or not record.new:
+            return
+        self.conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?)",
+            [ (record.key, stage, self.versions[stage], json.dumps(value))
+                for stage, value in record.new.items() ])
+        record.new = {}
+        self.n_uncommitted += 1
+        if self.n_uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.n_uncommitted = 0
+
+    def close(self):
+        if self.conn is not None:
+            self.commit()
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,353 @@
+"""Run the whole pipeline, or any part of it, in dependency order.
+
+Every step is a script plus its arguments. What each script reads and
+writes comes from the IMPORTS/EXPORTS section of its docstring, so a step
+runs after whatever steps write the files it reads. A step gets skipped
+when all its exports already exist and are newer than all its imports
+(use --force to run it anyway). Scraping takes hours and hits DreamViews,
+so the scrape steps only ever run when they're named on the command line
+(or with --phase scrape), never just because a later step needs them.
+If something needs a scraped file that isn't there, it stops and says
+which scrape step to run. Steps that don't depend on each other
+(eg, all the describe-* scripts) run at the same time with --jobs.
+
+Every step normally runs in its own python process. With --in-process,
+the describe/validate steps instead run one after another inside this
+process, so pandas/matplotlib only get imported once and the cleaned
+posts only get loaded once (see config.load_dreamviews_posts).
+The scraping and cleaning steps always get their own process.
+
+Give step names (script names without .py, and the plot ones get
+their argument added, eg validate-wordshift_plot-jsd) or --phase
+to only run those. Steps they need get checked too, and run if they're
+out of date. So `runall.py --phase describe -j 8` runs all the describe
+scripts at once, and takes about as long as the slowest one.
+
+With more than one job, each step's output gets saved to
+derivatives/runall_logs/<step>.stdout and .stderr instead of
+all of them printing over each other, and its stdout is printed
+in one piece when it finishes (and the end of stderr if it failed).
+How long each step took gets printed at the end and saved to
+derivatives/runall_times.tsv.
+
+    python runall.py                  # everything, one step at a time
+    python runall.py -j 4 --noliwc    # 4 at a time, without the LIWC steps
+    python runall.py --dry-run        # just show what would run
+    python runall.py --phase describe -j 8
+"""
+import os
+import re
+import ast
+import sys
+import time
+import runpy
+import traceback
+import argparse
+import subprocess
+import concurrent.futures
+
+import config as c
+
+
+########## Reading IMPORTS/EXPORTS
+
+section_res = {
+    "imports" : re.compile(r"^IMPORTS\n=+\n((?:[ \t]+-.*\n?)+)", flags=re.MULTILINE),
+    "exports" : re.compile(r"^EXPORTS\n=+\n((?:[ \t]+-.*\n?)+)", flags=re.MULTILINE),
+}
+
+def script_io(script, fill={}):
+    """The import and export filenames listed in a script's docstring.
+
+    Each line looks like "- description, path/from/DATA_DIR",
+    so the path is the last thing on the line.
+    """
+    with open(script, "rt", encoding="utf-8") as infile:
+        docstring = ast.get_docstring(ast.parse(infile.read())) or ""
+    io = {}
+    for section, section_re in section_res.items():
+        match = section_re.search(docstring + "\n")
+        lines = match.group(1).splitlines() if match else []
+        paths = [ line.split()[-1] for line in lines ]
+        io[section] = [ re.sub(r"<(\w+)>", lambda m: fill[m.group(1)], p) for p in paths ]
+    return io["imports"], io["exports"]
+
+
+########## The steps
+
+class Step:
+    """One script to run, and the files it reads and writes (relative to DATA_DIR).
+
+    Placeholders like <shift> in the docstring paths get filled from fill.
+    """
+    def __init__(self, script, args=(), name=None, own_process=False, scrape=False, liwc=False, **fill):
+        self.script = script
+        self.args = list(args)
+        self.name = name or script[:-3]
+        self.phase = script.split("-")[0] # setup, scrape, clean, describe, or validate
+        self.own_process = own_process or scrape
+        self.scrape = scrape
+        self.liwc = liwc
+        self.imports, self.exports = script_io(script, fill)
+
+    def __repr__(self):
+        return self.name
+
+
+# Same order as they'd run one at a time.
+STEPS = [
+    Step("setup-data_dirs.py", own_process=True),
+    # scrape and clean (takes hours)
+    Step("scrape-posts.py", scrape=True),
+    Step("clean-posts.py", own_process=True),
+    Step("clean-tokens.py", own_process=True),
+    Step("scrape-users.py", scrape=True),
+    Step("clean-users.py", own_process=True),
+    # describe (takes a minute altogether)
+    Step("describe-timecourse.py"),
+    Step("describe-usercount.py"),
+    Step("describe-toplabels.py"),
+    Step("describe-categorycounts.py"),
+    Step("describe-categorypairs.py"),
+    Step("describe-demographics.py"),
+    Step("describe-wordcount.py"),
+    Step("describe-memory.py"),
+    # validate (quick unless LIWCing)
+    Step("validate-classifier.py"),
+    Step("validate-classifier_stats.py"),
+    Step("validate-wordshift.py"),
+    Step("validate-wordshift_plot.py", ["--shift", "jsd"], name="validate-wordshift_plot-jsd", shift="jsd"),
+    Step("validate-wordshift_plot.py", ["--shift", "fear"], name="validate-wordshift_plot-fear", shift="fear"),
+    Step("validate-liwc.py", ["--words"], liwc=True),
+    Step("validate-liwc_stats.py", liwc=True),
+    Step("validate-liwc_word_stats.py", liwc=True),
+    Step("validate-liwc_word_plot.py", ["--category", "insight"], name="validate-liwc_word_plot-insight", liwc=True, category="insight"),
+    Step("validate-liwc_word_plot.py", ["--category", "agency"], name="validate-liwc_word_plot-agency", liwc=True, category="agency"),
+]
+
+POSTS_FNAME = "derivatives/dreamviews-posts.tsv"
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("steps", nargs="*", help="Only run these steps (and whatever they need).")
+parser.add_argument("--phase", action="append", choices=["setup", "scrape", "clean", "describe", "validate"],
+    help="Only run steps of this phase (and whatever they need). Can be given more than once.")
+parser.add_argument("-j", "--jobs", type=int, default=1, help="Max number of steps running at once.")
+parser.add_argument("--noliwc", action="store_true", help="Leave out the LIWC steps (if you don't have the LIWC dictionary).")
+parser.add_argument("--force", action="store_true", help="Run the selected steps even if they're up to date.")
+parser.add_argument("--in-process", action="store_true", help="Run describe/validate steps in this process, sharing the loaded posts.")
+parser.add_argument("--dry-run", action="store_true", help="Print the steps that would run, but don't run them.")
+
+
+########## Deciding what runs
+
+def build_graph(steps):
+    """For each step, the earlier steps that write something it reads."""
+    writers = {}
+    needs = {}
+    for step in steps:
+        needs[step] = { writers[f] for f in step.imports if f in writers }
+        for f in step.exports:
+            writers[f] = step
+    return needs
+
+def with_needs(selected, needs):
+    """The selected steps plus everything they need (recursively)."""
+    todo = list(selected)
+    keep = set()
+    while todo:
+        step = todo.pop()
+        if step not in keep:
+            keep.add(step)
+            todo.extend(needs[step])
+    return keep
+
+def data_fname(f):
+    return os.path.join(c.DATA_DIR, f)
+
+def out_of_date(step):
+    """True if a step's exports are missing or older than any of its imports."""
+    if step.scrape:
+        return not any( os.path.exists(data_fname(f)) for f in step.exports )
+    if not step.exports:
+        return True
+    export_mtimes = []
+    for f in step.exports:
+        if not os.path.exists(data_fname(f)):
+            return True
+        export_mtimes.append(os.path.getmtime(data_fname(f)))
+    import_mtimes = [ os.path.getmtime(data_fname(f))
+        for f in step.imports if os.path.exists(data_fname(f)) ]
+    return bool(import_mtimes) and max(import_mtimes) > min(export_mtimes)
+
+
+########## Running
+
+def run_subprocess(step, log_dir=None):
+    """Run a step in its own python process. With log_dir,
+    its stdout and stderr get saved to files in there."""
+    cmd = [sys.executable, step.script] + step.args
+    if log_dir is None:
+        return subprocess.run(cmd).returncode
+    with open(os.path.join(log_dir, f"{step}.stdout"), "wt", encoding="utf-8") as stdout, \
+            open(os.path.join(log_dir, f"{step}.stderr"), "wt", encoding="utf-8") as stderr:
+        return subprocess.run(cmd, stdout=stdout, stderr=stderr).returncode
+
+def run_in_process(step):
+    """Run a step's script as __main__ in this process, like python would."""
+    sys.argv = [step.script] + step.args
+    try:
+        runpy.run_path(step.script, run_name="__main__")
+    except SystemExit as e:
+        return 0 if e.code is None else e.code if isinstance(e.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        if "matplotlib.pyplot" in sys.modules:
+            sys.modules["matplotlib.pyplot"].close("all")
+    return 0
+
+def timed(run, *args):
+    """Return code of run(*args), and when it started and finished."""
+    start = time.perf_counter()
+    returncode = run(*args)
+    return returncode, start, time.perf_counter()
+
+def print_captured(step, log_dir, ok, n_stderr_lines=20):
+    """Print a finished step's saved stdout (and the end of its stderr if it failed)."""
+    with open(os.path.join(log_dir, f"{step}.stdout"), "rt", encoding="utf-8") as f:
+        sys.stdout.write(f.read())
+    if not ok:
+        with open(os.path.join(log_dir, f"{step}.stderr"), "rt", encoding="utf-8") as f:
+            sys.stdout.write("".join(f.readlines()[-n_stderr_lines:]))
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    steps = [ s for s in STEPS if not (args.noliwc and s.liwc) ]
+    needs = build_graph(steps)
+
+    if args.steps or args.phase:
+        by_name = { s.name: s for s in steps }
+        unknown = [ name for name in args.steps if name not in by_name ]
+        if unknown:
+            parser.error(f"unknown steps {unknown}, choose from {list(by_name)}")
+        selected = { by_name[name] for name in args.steps }
+        selected |= { s for s in steps if args.phase and s.phase in args.phase }
+        steps = [ s for s in steps if s in with_needs(selected, needs) ]
+    else:
+        selected = set(steps)
+
+    # In order, so a step runs if anything it needs runs.
+    to_run = []
+    for step in steps:
+        if step.scrape:
+            # only when asked for by name (or phase), never as something another step needs
+            rerun = step.name in args.steps or step.phase in (args.phase or [])
+        else:
+            rerun = (args.force and step in selected) or out_of_date(step) \
+                or any( n in to_run for n in needs[step] )
+        if rerun:
+            to_run.append(step)
+
+    # Files nothing here writes have to be there already.
+    # The LIWC dictionary is proprietary, so without it the LIWC steps
+    # (and anything after them) get left out with a warning, like --noliwc.
+    def missing_imports(step):
+        return [ f for f in step.imports if not os.path.exists(data_fname(f))
+            and not any( f in s.exports for s in to_run ) ]
+    for step in list(to_run):
+        if step not in to_run: # already left out
+            continue
+        missing = missing_imports(step)
+        if missing and step.liwc:
+            dropped = [ s for s in to_run if s is step or step in with_needs({s}, needs) ]
+            print(f"!! {step} needs {missing}, leaving out {', '.join(map(str, dropped))} "
+                "(use --noliwc to not see this) !!")
+            to_run = [ s for s in to_run if s not in dropped ]
+    for step in to_run:
+        missing = missing_imports(step)
+        scrapers = [ s.name for s in STEPS if s.scrape and any( f in s.exports for f in missing ) ]
+        if scrapers:
+            sys.exit(f"!! {step} needs {missing}, run {' and '.join(scrapers)} explicitly first "
+                f"(python runall.py {' '.join(scrapers)}) !!")
+        if missing:
+            sys.exit(f"!! {step} needs {missing}, which nothing here makes "
+                "(--noliwc leaves out the LIWC steps) !!")
+
+    print(f"{len(to_run)} of {len(steps)} steps to run: {', '.join(map(str, to_run))}")
+    if args.dry_run:
+        sys.exit()
+
+    log_dir = None
+    if args.jobs > 1:
+        log_dir = os.path.join(c.DATA_DIR, "derivatives", "runall_logs")
+        os.makedirs(log_dir, exist_ok=True)
+    times_fname = os.path.join(c.DATA_DIR, "derivatives", "runall_times.tsv")
+
+    # Launch every step whose needs are done, up to --jobs at once.
+    pending = list(to_run)
+    done = set( s for s in steps if s not in to_run )
+    running = {}
+    failed = []
+    times = {} # step: (start, finish)
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max(1, args.jobs)) as executor:
+        while running or (pending and not failed):
+            ready = [ s for s in pending if needs[s] <= done ] if not failed else []
+            for step in ready:
+                if args.in_process and not step.own_process:
+                    continue # these all run below, one at a time
+                pending.remove(step)
+                print(f"== {step}" + (" (started)" if log_dir else ""))
+                running[executor.submit(timed, run_subprocess, step, log_dir)] = step
+            # in-process steps go whenever nothing else is going
+            ready = [ s for s in ready if s in pending ]
+            if ready and not running:
+                step = ready[0]
+                pending.remove(step)
+                if POSTS_FNAME in step.imports:
+                    c.load_dreamviews_posts() # every step after gets its posts from this one
+                print(f"== {step} (in-process)")
+                returncode, *times[step] = timed(run_in_process, step)
+                if returncode == 0:
+                    done.add(step)
+                else:
+                    failed.append(step)
+                continue
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                returncode, *times[step] = future.result()
+                if returncode == 0:
+                    done.add(step)
+                else:
+                    failed.append(step)
+                if log_dir:
+                    print(f"== {step} ({'done' if returncode == 0 else 'FAILED'} "
+                        f"in {times[step][1]-times[step][0]:.1f} seconds)")
+                    print_captured(step, log_dir, returncode == 0)
+            if failed:
+                # let the ones already going finish, but don't start any more
+                for future in list(running):
+                    if future.cancel():
+                        pending.append(running.pop(future))
+
+    # How long each step took, and how long altogether.
+    if times:
+        with open(times_fname, "wt", encoding="utf-8") as outfile:
+            outfile.write("step\tstatus\tstart\tseconds\n")
+            for step, (start, finish) in sorted(times.items(), key=lambda x: x[1]):
+                status = "failed" if step in failed else "done"
+                outfile.write(f"{step}\t{status}\t{start-t0:.2f}\t{finish-start:.2f}\n")
+                print(f"{step.name:<35} {status:<7} {finish-start:8.1f} seconds")
+        print(f"Steps added up to {sum( f-s for s, f in times.values() ):.1f} seconds.")
+    print(f"Done in {time.perf_counter()-t0:.1f} seconds.")
+    if failed:
+        sys.exit(f"!! {', '.join(map(str, failed))} failed !!"
+            + (f" (so didn't run {', '.join(map(str, pending))})" if pending else ""))
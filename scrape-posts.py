@@ -1,42 +1,224 @@
 """Scrape all DreamViews dream journal entries,
 saving the raw html files into a zipfile for later processing.
+
+By default pages are requested one at a time. The --concurrent
+flag switches to an asyncio crawl that keeps several requests
+in flight at once (up to --max-connections), while still spacing
+out request starts to the host by at least --min-interval seconds
+so we don't hammer DreamViews. Pages are always written to the zipfile
+in page order, so the archive is identical either way.
+
+If a crawl dies partway through, rerun with --resume to keep the
+pages already in the zipfile and only fetch the missing ones.
+(Pages shift as new posts come in, so resume soon after the interruption.)
+
+To pick up only new posts since the last crawl, use --incremental.
+It starts at page 1 and stops at the first page where every entry
+has already been crawled, writing the new pages to a separate
+"delta" zipfile next to the main one (no zipfile if nothing is new).
+clean-posts.py reads the delta zipfiles after the main one and skips
+entries it already saw.
+The urls of all crawled entries are kept in a text file (the
+"high-water mark") so the old archives don't need to be re-read.
+A page with no entries on it at all (error page, soft block, layout
+change) doesn't get written, and after --max-empty-pages of those in a
+row the incremental crawl stops with an error instead of carrying on.
+
+Failed requests (no response, 429, or 5xx) are retried with exponential
+backoff, and requests slow down after a 429 (see crawl.FetchPolicy).
+A page that still fails stops the crawl with everything before it saved,
+so it can be continued with --resume. Request counts, retries, bytes,
+and latencies get written to a metrics file at the end either way.
+
+EXPORTS
+=======
+    - raw html pages,  source/dreamviews-posts.zip
+    - crawl metrics,   derivatives/scrape-posts_metrics.json
 """
 import os
+import sys
 import tqdm
+import asyncio
+import argparse
+import datetime
 import zipfile
-import requests
+
+from collections import deque
 
 from bs4 import BeautifulSoup
 
 import config as c
+import crawl
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--concurrent", action="store_true", help="Crawl with many simultaneous requests (asyncio).")
+parser.add_argument("--max-connections", type=int, default=8, help="Max requests in flight at once, only with --concurrent.")
+parser.add_argument("--resume", action="store_true", help="Keep pages already in an existing zipfile and only fetch the missing ones.")
+parser.add_argument("--min-interval", type=float, default=.25, help="Min seconds between request starts to the host, only with --concurrent.")
+parser.add_argument("--base-url", default=crawl.DREAMVIEWS_BASE_URL, help="Crawl a different host, eg a local fixtureserver.py.")
+parser.add_argument("--incremental", action="store_true", help="Only get new pages since the last crawl, into a new delta zipfile.")
+parser.add_argument("--max-empty-pages", type=int, default=3, help="Stop an incremental crawl after this many pages in a row without entries.")
+parser.add_argument("--max-retries", type=int, default=5, help="Max retries of a single failed request.")
+parser.add_argument("--retry-budget", type=int, default=1000, help="Max retries over the whole crawl.")
+args = parser.parse_args()
 
+if args.incremental and (args.concurrent or args.resume):
+    parser.error("--incremental can't be combined with --concurrent or --resume")
 
-DREAMVIEWS_URL = "https://www.dreamviews.com/blogs/recent-entries"
+CONCURRENT = args.concurrent
+MAX_CONNECTIONS = args.max_connections
+MIN_INTERVAL = args.min_interval
+RESUME = args.resume
+INCREMENTAL = args.incremental
+MAX_EMPTY_PAGES = args.max_empty_pages
+MAX_RETRIES = args.max_retries
+RETRY_BUDGET = args.retry_budget
+
+
+DREAMVIEWS_URL = f"{args.base_url}/blogs/recent-entries"
 
 export_fname = os.path.join(c.DATA_DIR, "source", "dreamviews-posts.zip")
+seen_fname = os.path.join(c.DATA_DIR, "source", "dreamviews-posts_seen.txt")
+metrics_fname = os.path.join(c.DATA_DIR, "derivatives", "scrape-posts_metrics.json")
+
+
+# one policy for the whole run so the retry budget and rate are shared
+policy = crawl.FetchPolicy(max_retries=MAX_RETRIES, retry_budget=RETRY_BUDGET,
+    min_interval=MIN_INTERVAL if CONCURRENT else 0)
+
+
+def page_content(result):
+    # A page that still failed after retries stops the crawl rather than
+    # leaving a hole in the zipfile. Everything before it is already saved,
+    # so rerunning with --resume picks up right here.
+    if not crawl.result_ok(result):
+        raise crawl.CrawlError(f"Gave up on {result.url} (status {result.status}), "
+            "rerun with --resume to continue.")
+    return result.content
+
+
+async def crawl_concurrently(zf, page_numbers):
+
+    async with crawl.AiohttpFetcher(MAX_CONNECTIONS, policy=policy) as fetcher:
+
+        # Keep a fixed window of scheduled pages (the fetcher keeps the number
+        # in flight bounded), and await them *in page order* so the zipfile
+        # ends up with the same member order as a serial crawl. A new page only
+        # gets scheduled after one is written, so a slow page holds back at most
+        # WINDOW finished ones in memory, not the whole rest of the crawl.
+        window = 2 * MAX_CONNECTIONS
+        page_numbers_left = iter(page_numbers)
+        pending = deque()
+        def schedule_next():
+            for i in page_numbers_left:
+                url = f"{DREAMVIEWS_URL}/index{i}.html"
+                pending.append((i, asyncio.create_task(fetcher.fetch(url))))
+                return
+
+        try:
+            for _ in range(window):
+                schedule_next()
+            with tqdm.tqdm(total=len(page_numbers), desc="DreamViews posts crawl (concurrent)") as pbar:
+                while pending:
+                    i, task = pending[0]
+                    content = page_content(await task)
+                    pending.popleft()
+                    export_singlefile_fname = f"index{i:04d}.html"
+                    zf.writestr(export_singlefile_fname, content)
+                    pbar.update(1)
+                    schedule_next()
+        finally:
+            # after a failed page, don't leave the rest running
+            # (or their errors unretrieved) when the fetcher closes
+            for _, task in pending:
+                task.cancel()
+            await asyncio.gather(*( task for _, task in pending ), return_exceptions=True)
+
+
+try:
+
+    with crawl.RequestsFetcher(policy) as fetcher:
+
+        # Get the total number of pages by loading the
+        # first (i.e., most recent) dream journal page,
+        # then finding the "Last" page link and extracting
+        # the number of pages.
+        page = page_content(fetcher.fetch(DREAMVIEWS_URL))
+        soup = BeautifulSoup(page, "html.parser")
+        lasturl = soup.find("span", class_="first_last").find("a")["href"]
+        lastnum = lasturl.rstrip(".html").split("/index")[1]
+        assert lastnum.isdigit()
+        n_pages = int(lastnum)
+
+        if INCREMENTAL:
+
+            # Crawl from the newest page until hitting a page with nothing new.
+            seen_entries = crawl.load_seen_entries(seen_fname, c.dreamviews_posts_archives())
+            timestamp = datetime.datetime.now().strftime("%Y%m%dT%H%M")
+            delta_fname = export_fname.replace(".zip", f"_delta-{timestamp}.zip")
+
+            new_entries = set()
+            n_new_pages = 0
+            n_empty = 0 # pages in a row without any entries
+            empty_pages_error = None
+            zf = None # only made once there's a new page, so no empty delta zipfiles
+            try:
+                for i in tqdm.trange(1, n_pages+1, desc="DreamViews posts crawl (incremental)"):
+                    url = f"{DREAMVIEWS_URL}/index{i}.html"
+                    content = page_content(fetcher.fetch(url))
+                    entries = crawl.page_entries(content)
+                    if not entries:
+                        # something's wrong with the page, don't let it turn into a full crawl
+                        n_empty += 1
+                        if n_empty >= MAX_EMPTY_PAGES:
+                            empty_pages_error = (f"Stopped at {url}, the last {n_empty} pages "
+                                "had no entries (error page or layout change?)")
+                            break
+                        continue
+                    n_empty = 0
+                    if all( entry_url in seen_entries for entry_url, _ in entries ):
+                        break
+                    if zf is None:
+                        zf = zipfile.ZipFile(delta_fname, mode="x", compression=zipfile.ZIP_DEFLATED)
+                    zf.writestr(f"index{i:04d}.html", content)
+                    new_entries.update( entry_url for entry_url, dated in entries if dated )
+                    n_new_pages += 1
+            finally:
+                if zf is not None:
+                    zf.close()
+
+            crawl.save_seen_entries(seen_fname, seen_entries | new_entries)
+            if n_new_pages:
+                print(f"Wrote {n_new_pages} new pages to {delta_fname}")
+            else:
+                print("No new pages since the last crawl")
+            if empty_pages_error is not None:
+                sys.exit(empty_pages_error)
+
+        else:
+
+            # open the zipfile and see what's already there (if resuming)
+            zf, already_scraped = crawl.open_archive(export_fname, resume=RESUME)
 
+            # only need to get pages not already in the zipfile
+            page_numbers = [ i for i in range(1, n_pages+1)
+                if f"index{i:04d}.html" not in already_scraped ]
 
-with requests.Session() as session:
+            # loop over all dream journal pages
+            with zf:
 
-    # Get the total number of pages by loading the 
-    # first (i.e., most recent) dream journal page,
-    # then finding the "Last" page link and extracting
-    # the number of pages.
-    page = session.get(DREAMVIEWS_URL).text
-    soup = BeautifulSoup(page, "html.parser")
-    lasturl = soup.find("span", class_="first_last").find("a")["href"]
-    lastnum = lasturl.rstrip(".html").split("/index")[1]
-    assert lastnum.isdigit()
-    n_pages = int(lastnum)
+                if CONCURRENT:
+                    asyncio.run(crawl_concurrently(zf, page_numbers))
 
-    # loop over all dream journal pages
-    with zipfile.ZipFile(export_fname, mode="x", compression=zipfile.ZIP_DEFLATED) as zf:
+                else:
+                    for i in tqdm.tqdm(page_numbers, desc="DreamViews posts crawl"):
 
-        for i in tqdm.trange(1, n_pages+1, desc="DreamViews posts crawl"):
+                        url = f"{DREAMVIEWS_URL}/index{i}.html"
+                        export_singlefile_fname = f"index{i:04d}.html"
 
-            url = f"{DREAMVIEWS_URL}/index{i}.html"
-            export_singlefile_fname = f"index{i:04d}.html"
+                        # get page info and export as part of zipfile
+                        zf.writestr(export_singlefile_fname, page_content(fetcher.fetch(url)))
 
-            # get page info and export as part of zipfile
-            r = session.get(url)
-            zf.writestr(export_singlefile_fname, r.content)
\ No newline at end of file
+finally:
+    policy.write_metrics(metrics_fname)
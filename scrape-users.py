@@ -6,26 +6,55 @@ scraped dream reports, so that has to be done first.
 A few users whose special characters were converted
 to ASCII won't make the list, but that's okay.
 Many users don't report an info anyways.
+
+If a crawl dies partway through, rerun with --resume to keep the
+profiles already in the zipfile and only fetch the missing users.
+
+Failed requests (no response, 429, or 5xx) are retried with exponential
+backoff and requests slow down after a 429 (see crawl.FetchPolicy).
+Users that still fail are left out of the zipfile (and counted at the end),
+so another --resume run will try them again.
+
+IMPORTS
+=======
+    - usernames, derivatives/dreamviews-users_key.json
+EXPORTS
+=======
+    - raw html profiles, source/dreamviews-users.zip
+    - crawl metrics,     derivatives/scrape-users_metrics.json
 """
 import os
 import json
 import tqdm
-import zipfile
-import requests
+import argparse
 
 import pandas as pd
 
 from bs4 import BeautifulSoup
 
 import config as c
+import crawl
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--resume", action="store_true", help="Keep profiles already in an existing zipfile and only fetch the missing ones.")
+parser.add_argument("--base-url", default=crawl.DREAMVIEWS_BASE_URL, help="Crawl a different host, eg a local fixtureserver.py.")
+parser.add_argument("--max-retries", type=int, default=5, help="Max retries of a single failed request.")
+parser.add_argument("--retry-budget", type=int, default=1000, help="Max retries over the whole crawl.")
+args = parser.parse_args()
+
+RESUME = args.resume
+MAX_RETRIES = args.max_retries
+RETRY_BUDGET = args.retry_budget
 
 
-BASE_USER_URL = "https://www.dreamviews.com/members"
+BASE_USER_URL = f"{args.base_url}/members"
 
 
 import_fname = os.path.join(c.DATA_DIR, "derivatives", "dreamviews-users_key.json")
 
 export_fname = os.path.join(c.DATA_DIR, "source", "dreamviews-users.zip")
+metrics_fname = os.path.join(c.DATA_DIR, "derivatives", "scrape-users_metrics.json")
 
 
 # get all unique usernames from dataset
@@ -33,9 +62,17 @@ with open(import_fname, "rt", encoding="ascii") as f:
     user_mappings = json.load(f)
 user_list = list(user_mappings)
 
-with requests.Session() as session:
+# open the zipfile and drop users that are already in it (if resuming)
+# (users that were skipped last time because they had no profile get retried)
+zf, already_scraped = crawl.open_archive(export_fname, resume=RESUME)
+user_list = [ u for u in user_list if f"{u}.html" not in already_scraped ]
 
-    with zipfile.ZipFile(export_fname, mode="x", compression=zipfile.ZIP_DEFLATED) as zf:
+policy = crawl.FetchPolicy(max_retries=MAX_RETRIES, retry_budget=RETRY_BUDGET)
+n_failed = 0
+
+with crawl.RequestsFetcher(policy) as fetcher:
+
+    with zf:
 
         for user in tqdm.tqdm(user_list, desc="DreamViews users crawl"):
 
@@ -43,6 +80,12 @@ with requests.Session() as session:
             export_singlefile_fname = f"{user}.html"
 
             # get page info and export as part of zipfile
-            response = session.get(url)
-            if response.ok and "This user has not registered" not in response.text:
+            response = fetcher.fetch(url)
+            if not crawl.result_ok(response):
+                n_failed += 1
+            elif b"This user has not registered" not in response.content:
                 zf.writestr(export_singlefile_fname, response.content)
+
+policy.write_metrics(metrics_fname)
+if n_failed:
+    print(f"{n_failed} users failed even after retries, rerun with --resume to try them again.")
@@ -0,0 +1,133 @@
+"""Lightweight timing of the named stages of a script (see clean-posts.py --profile).
+
+Wrap the code of a stage in `with profiler.stage("name"):` and the profiler
+adds up how many times it ran, how long it took altogether, and the peak
+memory (max RSS) of the process as of the end of it. A function somewhere
+else (eg, contractions.fix) can be timed without touching its module with
+profiler.patch. When the profiler isn't enabled, stage() hands back the same
+do-nothing context every time and patch() does nothing, so it can stay in
+the hot path.
+
+Stages can be inside other stages, and then the inner time counts
+toward both. Worker processes have their own profiler, so they send
+their stats back with take() and the main process adds them in with
+merge(). Times from workers are summed over all of them, so with
+several workers they can add up to more than the wall time.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import functools
+import contextlib
+
+try:
+    import resource
+except ImportError: # not on windows
+    resource = None
+
+
+def peak_rss_mb():
+    """Max resident memory of this process so far, in MB (None if unknown)."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux but bytes on mac
+    return maxrss / 1e6 if sys.platform == "darwin" else maxrss / 1e3
+
+
+class Stage:
+    """Context that adds its time to one stage's stats."""
+    __slots__ = ("stats", "t0")
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        stats = self.stats
+        stats[0] += 1
+        stats[1] += time.perf_counter() - self.t0
+        rss = peak_rss_mb()
+        if rss is not None and rss > stats[2]:
+            stats[2] = rss
+
+
+class StageProfiler:
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stats = {} # name: [calls, seconds, peak rss MB]
+        self.pid = os.getpid() # forked worker processes start over
+        self.t_start = time.perf_counter()
+        self.null_stage = contextlib.nullcontext()
+
+    def check_fork(self):
+        # don't send back what the parent process had before forking
+        if self.pid != os.getpid():
+            self.stats = {}
+            self.pid = os.getpid()
+
+    def stage(self, name):
+        if not self.enabled:
+            return self.null_stage
+        self.check_fork()
+        if name not in self.stats:
+            self.stats[name] = [0, 0., 0.]
+        return Stage(self.stats[name])
+
+    def patch(self, owner, attr, name=None):
+        """Time every call of owner.attr (eg, a module's function) as a stage."""
+        if not self.enabled:
+            return
+        func = getattr(owner, attr)
+        name = attr if name is None else name
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        setattr(owner, attr, timed)
+
+    def take(self):
+        """Stats since the last take (to send back from a worker process)."""
+        if not self.enabled:
+            return None
+        self.check_fork()
+        stats, self.stats = self.stats, {}
+        return stats
+
+    def merge(self, stats):
+        """Add in stats from take() (eg, from a worker process)."""
+        if not stats:
+            return
+        for name, (calls, seconds, rss) in stats.items():
+            mine = self.stats.setdefault(name, [0, 0., 0.])
+            mine[0] += calls
+            mine[1] += seconds
+            mine[2] = max(mine[2], rss)
+
+    def summary(self):
+        return {
+            "wall_seconds" : time.perf_counter() - self.t_start,
+            "peak_rss_mb"  : peak_rss_mb(),
+            "stages"       : { name: {
+                    "calls"       : calls,
+                    "seconds"     : seconds,
+                    "ms_per_call" : 1000 * seconds / calls if calls else None,
+                    "peak_rss_mb" : rss,
+                } for name, (calls, seconds, rss) in self.stats.items() },
+        }
+
+    def write(self, json_fname, tsv_fname, **extra):
+        """Write the summary (plus anything in extra) to json, and the stages to tsv."""
+        summary = self.summary()
+        with open(json_fname, "wt", encoding="utf-8") as f:
+            json.dump({**summary, **extra}, f, indent=4)
+        with open(tsv_fname, "wt", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["stage", "calls", "seconds", "ms_per_call", "peak_rss_mb"])
+            for name, row in sorted(summary["stages"].items(), key=lambda x: -x[1]["seconds"]):
+                writer.writerow([name] + [ "" if v is None else round(v, 4) for v in row.values() ])
@@ -0,0 +1,149 @@
+"""Text cleaning shared by clean-posts.py (and benchmark-textclean.py).
+
+clean_post_text does all the minor corrections and redactions of the
+dream report text that don't need spaCy. It used to be a long run
+of separate re.sub calls, each with its own inline pattern and each
+rescanning the whole post. Now the patterns are compiled once here, and
+most posts only need a few passes because the patterns only get run when
+the text has something they could match (most posts don't have any
+bbcode at all). The result is exactly the same as running them all
+in order, which benchmark-textclean.py checks on the raw archive.
+"""
+import re
+import functools
+
+import contractions
+import unidecode
+
+
+# Bump this whenever a change here would clean any text differently,
+# so clean-posts.py doesn't reuse cached text from before the change.
+VERSION = "1"
+
+
+########## Converting to ASCII
+
+# Replace annoying unicode surrogates (??) that cause warnings in unidecode.
+surrogate_re = re.compile(r"[\ud83d\ud83c\udf37\udf38\udf39\udf3a\udc2c]+")
+# control_chars_re = r"[^\x09\x0A\x0D\x20-\x7F]+"
+# control_chars_re = r"[^\x00-\x7F]+"
+# just need to catch \x1b and \x7f (unidecode does the rest)
+extra_ascii_chars_re = re.compile(r"[\x1b\x7f]+")
+whitespace_re = re.compile(r"\s")
+whitespace_run_re = re.compile(r"\s+")
+
+def convert2ascii(txt, retain_whitespace_count=False):
+    # Most text is already ASCII, and then unidecode wouldn't change anything.
+    if txt.isascii():
+        ascii_txt = txt
+    else:
+        # Replace annoying unicode surrogates (??) that cause warnings in unidecode.
+        ascii_txt = surrogate_re.sub(" ", txt)
+        # Unidecode does the heavy-lifting on conversion to ASCII.
+        ascii_txt = unidecode.unidecode(ascii_txt, errors="ignore", replace_str="")
+    # Replace some non-printable whitespace characters that are technically ASCII but not printable.
+    ascii_txt = extra_ascii_chars_re.sub(" ", ascii_txt)
+    # Reduce to single whitespaces. (*after* ASCII conversion)
+    if retain_whitespace_count:
+        ascii_txt = whitespace_re.sub(" ", ascii_txt)
+    else:
+        ascii_txt = whitespace_run_re.sub(" ", ascii_txt)
+    # Final strip to be sure there aren't leading/trailing whitespaces after all the processing.
+    if not retain_whitespace_count:
+        ascii_txt = ascii_txt.strip()
+    assert ascii_txt.isascii() and ascii_txt.isprintable()
+    return ascii_txt
+
+# Usernames, tags, and categories are short and the same ones come up
+# over and over, so remember the most recent conversions.
+# (Don't use this for post text, those are long and (almost) never repeat.)
+@functools.lru_cache(maxsize=2**16)
+def convert2ascii_cached(txt, retain_whitespace_count=False):
+    return convert2ascii(txt, retain_whitespace_count=retain_whitespace_count)
+
+
+########## Cleaning post text
+
+# any sequence of 4+ characters, to be replaced with 1 of that character
+repeats_re = re.compile(r"(.)\1{3,}", flags=re.IGNORECASE)
+
+# Leftover bbcode formatting tags, in the order they get removed.
+# Each comes with a (lowercase) word that has to be in the text for
+# the pattern to possibly match, so it can be skipped cheaply when not.
+# (None means there's no single word, just run it whenever there's a "[".)
+bbcode_res = [
+    # There are some leftover block formatting tags.
+    (None, re.compile(r"\[(/?INDENT|/?RIGHT|/?CENTER|/?B)\]", flags=re.IGNORECASE)),
+    # These ones never have a = preceding them.
+    (None, re.compile(r"\[/?(INDENT|RIGHT|CENTER|B|I|U|HR|IMG|LINK_TO_ANCHOR|SARCASM|DREAM LOGIC)\]", flags=re.IGNORECASE)),
+    # These need some leway as to what comes after because sometimes there's stuff there.
+    ("color", re.compile(r"\[/?COLOR.*?\]", flags=re.IGNORECASE)),
+    ("size", re.compile(r"\[/?SIZE.*?\]", flags=re.IGNORECASE)),
+    ("font", re.compile(r"\[/?FONT.*?\]", flags=re.IGNORECASE)),
+    ("quote", re.compile(r"\[/?QUOTE.*?\]", flags=re.IGNORECASE)),
+    ("spoiler", re.compile(r"\[/?SPOILER.*?\]", flags=re.IGNORECASE)),
+    ("url", re.compile(r"\[/?URL.*?\]", flags=re.IGNORECASE)),
+    ("attach", re.compile(r"\[ATTACH=CONFIG\][0-9]*\[/ATTACH\]", flags=re.IGNORECASE)),
+]
+
+# Posts can be updated and have this stereotyped amendment
+# at the end if they were (about 20% of posts have this).
+# Example: Updated 12-08-2021 at 10:28 PM by 34880
+# Example: Updated 08-05-2017 at 01:09 PM by 93119 (Added Categories)
+# Example: Updated 04-20-2014 at 12:36 PM by 68865 (remembered another fragment)
+updated_re = re.compile(r" Updated [0-9]{2}-[0-9]{2}-[0-9]{4} at [0-9]{2}:[0-9]{2} [AP]M by [0-9]{1,5}( \(.*?\))?")
+
+# Emails (well, anything with an @) and URLs all get redacted in one go.
+# The email part is first so it wins when both could start at the same spot.
+redact_re = re.compile(r"\S*@\S*\s?|https?://\S+|www\.\S+", flags=re.IGNORECASE)
+
+
+def strip_bbcode(txt):
+    """Remove leftover bbcode tags, same as running all of bbcode_res in order."""
+    if "[" not in txt:
+        return txt
+    txt_lower = txt.lower()
+    for keyword, pattern in bbcode_res:
+        if keyword is not None and keyword not in txt_lower:
+            continue
+        txt, n_subs = pattern.subn("", txt)
+        if n_subs:
+            # removing tags can join up text into a new keyword, so recheck
+            if "[" not in txt:
+                break
+            txt_lower = txt.lower()
+    return txt
+
+
+def clean_post_text(post_txt):
+    """Minor corrections and redactions of (ASCII) dream report text."""
+
+    # Replace the few stupid apostrophe representations.
+    # And replace ampersands.
+    if "&" in post_txt:
+        post_txt = post_txt.replace("&#39;", "'").replace("&", "and")
+
+    ## Minor text corrections to make later life easier.
+    # replace contractions with full words
+    post_txt = contractions.fix(post_txt, slang=True)
+    # replace any sequence of 4+ characters with 1 of that character
+    # gets rid of stuff like whoaaaaaaaaaaaa and --------------------
+    # will lead to some errors because it replaces with 1 letter but sometimes will need 2
+    post_txt = repeats_re.sub(r"\1", post_txt)
+
+    ## DreamViews posts have some commons text patterns that can be removed.
+    ## These are all regexes that are specific to the needs of cleaning DreamViews text.
+    post_txt = strip_bbcode(post_txt)
+    if " Updated " in post_txt:
+        post_txt = updated_re.sub("", post_txt)
+
+    ## Redactions.
+    # The text already has some "@[email\xa0protected]" parts, basically anything after an @. Kinda dumb.
+    # They aren't always emails so just replace with nothing.
+    if "@" in post_txt:
+        post_txt = post_txt.replace("@[email protected]", "") # first
+    # Then redact emails (just in case there are still any) and URLs.
+    if "@" in post_txt or "://" in post_txt or "www." in post_txt.lower():
+        post_txt = redact_re.sub("[[URL]]", post_txt)
+
+    return post_txt
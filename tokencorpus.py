@@ -0,0 +1,187 @@
+"""Tokenized text columns of the posts, made once (by clean-tokens.py)
+so the validate scripts don't all split up the same text every time.
+
+Each tokenization is a text column split into tokens a certain way:
+    - "lemmas" is post_lemmas lowercased and split on whitespace
+      (validate-classifier.py and validate-wordshift.py).
+    - "liwc" is post_clean lowercased and split with nltk's TweetTokenizer,
+      without the lone punctuation (validate-liwc.py, see there for why).
+
+It's saved as 4 files in derivatives, eg for "lemmas":
+    - dreamviews-tokens_lemmas-vocab.json, list of every different token
+    - dreamviews-tokens_lemmas-post_ids.txt, the post ID of each row, one per line
+    - dreamviews-tokens_lemmas-ids.npy, the tokens of all posts one after
+      another, as their position in the vocab
+    - dreamviews-tokens_lemmas-indptr.npy, where each post starts and stops
+      in ids (post i is ids[indptr[i]:indptr[i+1]], like a scipy CSR matrix)
+The two .npy files get memory-mapped when loading, so only
+the parts for the posts that get used are actually read.
+Loading refuses token files older than derivatives/dreamviews-posts.tsv,
+bc those are from some earlier version of the posts.
+
+To count tokens, use counts or count_matrix instead of token_lists,
+they go straight from the IDs and only turn them into words once
+through the vocab, not every token of every post.
+"""
+import os
+import json
+
+import numpy as np
+
+
+TOKENIZATIONS = { # name: text column it comes from
+    "lemmas" : "post_lemmas",
+    "liwc"   : "post_clean",
+}
+
+
+def tokenize_lemmas(txt):
+    return txt.lower().split()
+
+tweet_tokenizer = None # loaded the first time it's needed
+def tokenize_liwc(txt):
+    global tweet_tokenizer
+    if tweet_tokenizer is None:
+        import nltk
+        tweet_tokenizer = nltk.tokenize.TweetTokenizer()
+    # lowercase and break into tokens
+    tokens = tweet_tokenizer.tokenize(txt.lower())
+    # remove isolated puncuation
+    return [ t for t in tokens if not (len(t)==1 and not t.isalpha()) ]
+
+TOKENIZERS = {
+    "lemmas" : tokenize_lemmas,
+    "liwc"   : tokenize_liwc,
+}
+
+
+def filenames(data_dir, name):
+    """{part: filename} of the 4 files of one tokenization."""
+    prefix = os.path.join(data_dir, "derivatives", f"dreamviews-tokens_{name}")
+    return {
+        "vocab"    : f"{prefix}-vocab.json",
+        "post_ids" : f"{prefix}-post_ids.txt",
+        "ids"      : f"{prefix}-ids.npy",
+        "indptr"   : f"{prefix}-indptr.npy",
+    }
+
+
+class TokenCorpus:
+    """One tokenization of all the posts (see load)."""
+
+    def __init__(self, vocab, post_ids, ids, indptr):
+        self.vocab = vocab       # object array of token strings
+        self.post_ids = post_ids # pandas Index of the post ID of each row
+        self.ids = ids           # int32 token IDs of all posts, one after another
+        self.indptr = indptr     # int64 start of each row in ids (plus the end)
+
+    def __len__(self):
+        return len(self.post_ids)
+
+    def rows(self, post_ids):
+        """Row numbers of these post IDs (eg, a posts column)."""
+        rows = self.post_ids.get_indexer(post_ids)
+        if (rows < 0).any():
+            raise KeyError("some posts aren't in the tokens, rerun clean-tokens.py")
+        return rows
+
+    def token_ids(self, row):
+        return self.ids[self.indptr[row]:self.indptr[row+1]]
+
+    def tokens(self, row):
+        return self.vocab[self.token_ids(row)].tolist()
+
+    def token_lists(self, rows=None):
+        """List of the tokens of each row (all of them in order by default)."""
+        rows = range(len(self)) if rows is None else rows
+        return [ self.tokens(row) for row in rows ]
+
+    def lengths(self, rows):
+        """How many tokens each of these rows has."""
+        rows = np.asarray(rows)
+        return self.indptr[rows+1] - self.indptr[rows]
+
+    def _gather(self, rows):
+        """Token IDs of these rows one after another, and how many each row has
+        (picked out of ids all at once instead of a slice per row)."""
+        rows = np.asarray(rows)
+        lengths = self.lengths(rows)
+        # where each token is in ids, ie its row's start plus how far in it is
+        offsets = np.repeat(self.indptr[rows] - (np.cumsum(lengths) - lengths), lengths)
+        return self.ids[offsets + np.arange(lengths.sum())], lengths
+
+    def counts(self, rows, weights=None):
+        """How many times each vocab token shows up in these rows, an array as long as the vocab.
+        With weights (one per row), each token in a row adds that row's weight instead of 1."""
+        ids, lengths = self._gather(rows)
+        token_weights = None if weights is None else np.repeat(weights, lengths)
+        return np.bincount(ids, weights=token_weights, minlength=len(self.vocab))
+
+    def count_matrix(self, rows):
+        """Sparse matrix of how many times each vocab token (columns) is in each row (rows)."""
+        from scipy import sparse
+        ids, lengths = self._gather(rows)
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        data = np.ones(len(ids), dtype=np.int32)
+        matrix = sparse.csr_matrix((data, ids, indptr), shape=(len(lengths), len(self.vocab)))
+        matrix.sum_duplicates()
+        return matrix
+
+
+def build(texts, post_ids, tokenize):
+    """Tokenize each text (missing texts get no tokens) into a TokenCorpus."""
+    import pandas as pd
+    vocab = {} # token: ID, in the order they first show up
+    ids = []
+    indptr = np.zeros(len(texts)+1, dtype=np.int64)
+    for i, txt in enumerate(texts):
+        if not pd.isna(txt):
+            ids.extend( vocab.setdefault(t, len(vocab)) for t in tokenize(txt) )
+        indptr[i+1] = len(ids)
+    return TokenCorpus(
+        vocab=np.array(list(vocab), dtype=object),
+        post_ids=pd.Index(post_ids, name="post_id"),
+        ids=np.array(ids, dtype=np.int32),
+        indptr=indptr,
+    )
+
+def save(corpus, data_dir, name):
+    fnames = filenames(data_dir, name)
+    # json bc some tweet tokens have spaces (eg, phone numbers)
+    with open(fnames["vocab"], "wt", encoding="utf-8") as f:
+        json.dump(corpus.vocab.tolist(), f, ensure_ascii=False)
+    with open(fnames["post_ids"], "wt", encoding="utf-8", newline="\n") as f:
+        f.writelines( f"{p}\n" for p in corpus.post_ids )
+    np.save(fnames["ids"], corpus.ids)
+    np.save(fnames["indptr"], corpus.indptr)
+
+def check_fresh(data_dir, name):
+    """Make sure the token files are there and at least as new as the posts
+    they were made from, so the validate scripts never count old tokens
+    (eg, after clean-posts.py was rerun but not clean-tokens.py)."""
+    fnames = filenames(data_dir, name)
+    missing = [ fname for fname in fnames.values() if not os.path.isfile(fname) ]
+    if missing:
+        raise FileNotFoundError(f"no {missing}, run clean-tokens.py {name}")
+    posts_fname = os.path.join(data_dir, "derivatives", "dreamviews-posts.tsv")
+    if os.path.isfile(posts_fname):
+        posts_mtime = os.path.getmtime(posts_fname)
+        stale = [ fname for fname in fnames.values() if os.path.getmtime(fname) < posts_mtime ]
+        if stale:
+            raise RuntimeError(f"{stale} are older than {posts_fname}, rerun clean-tokens.py {name}")
+
+def load(data_dir, name, mmap=True):
+    import pandas as pd
+    check_fresh(data_dir, name)
+    fnames = filenames(data_dir, name)
+    with open(fnames["vocab"], "rt", encoding="utf-8") as f:
+        vocab = np.array(json.load(f), dtype=object)
+    with open(fnames["post_ids"], "rt", encoding="utf-8", newline="\n") as f:
+        post_ids = pd.Index(f.read().splitlines(), name="post_id")
+    mmap_mode = "r" if mmap else None
+    return TokenCorpus(
+        vocab=vocab,
+        post_ids=post_ids,
+        ids=np.load(fnames["ids"], mmap_mode=mmap_mode),
+        indptr=np.load(fnames["indptr"], mmap_mode=mmap_mode),
+    )
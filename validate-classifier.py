@@ -11,7 +11,8 @@ resampling but I'm just not messing with all this rn.
 
 IMPORTS
 =======
-    - posts, derivatives/dreamviews-posts.tsv
+    - posts,                               derivatives/dreamviews-posts.tsv
+    - lemma tokens (from clean-tokens.py), derivatives/dreamviews-tokens_lemmas-ids.npy
 EXPORTS
 =======
     - numpy file with predictions and labels, derivatives/validate-classifier.npz
@@ -31,15 +32,27 @@ from sklearn.model_selection import cross_validate
 ############################ set up classification stuff
 
 # define important variables
-TXT_COL = "post_lemmas" # raw txt or lemmas
+TOKENS = "lemmas" # which tokenization of the text (see tokencorpus)
 N_SPLITS = 5
 TRAIN_SIZE = .7 # proportion of data
 NONLUCID_DIGIT = 0
 LUCID_DIGIT = 1
 
+# load the tokenized text, each post is just its row number in here
+tokens = c.load_dreamviews_tokens(TOKENS)
+
+# Words the way CountVectorizer would get them out of the raw text.
+# Its token pattern never crosses whitespace, so getting them out of
+# each different token once gives the same words as the raw text would
+# (for single words, ngrams would need the whole text).
+get_words = CountVectorizer().build_analyzer()
+vocab_words = [ get_words(token) for token in tokens.vocab ]
+def analyze_row(row):
+    return [ word for i in tokens.token_ids(row) for word in vocab_words[i] ]
+
 # initialize the classification pipeline components
-vectorizer = CountVectorizer(max_df=.75, min_df=100,
-    ngram_range=(1,1), max_features=5000, binary=False)
+vectorizer = CountVectorizer(analyzer=analyze_row,
+    max_df=.75, min_df=100, max_features=5000, binary=False)
 clf = SVC(kernel="linear", C=1.)
 cv = StratifiedShuffleSplit(n_splits=N_SPLITS, train_size=TRAIN_SIZE, random_state=2)
 
@@ -49,27 +62,26 @@ cv = StratifiedShuffleSplit(n_splits=N_SPLITS, train_size=TRAIN_SIZE, random_sta
 
 export_fname = os.path.join(c.DATA_DIR, "derivatives", "validate-classifier.npz")
 
-df = c.load_dreamviews_posts()
-usecols = ["post_id", "user_id", "lucidity", TXT_COL]
-df = df[usecols].set_index("post_id")
+usecols = ["post_id", "user_id", "lucidity"]
+df = c.load_dreamviews_posts(columns=usecols).set_index("post_id")
 # drop non-lucid data
 df = df[ df["lucidity"].str.contains("lucid") ]
 
 
 # Make an effort to balance training by...
 # ...downsampling to one dream per user
-df = df.groupby("user_id").sample(n=1, replace=False, random_state=0)
+df = df.groupby("user_id", observed=True).sample(n=1, replace=False, random_state=0)
 # ...getting the minimum number of either class (LD or NLD)
-n_per_class = df["lucidity"].value_counts().min()
+n_per_class = df.groupby("lucidity", observed=True).size().min()
 # ...and downsampling both classes to this minimum amount.
-df = df.groupby("lucidity").sample(n=n_per_class, replace=False, random_state=1)
+df = df.groupby("lucidity", observed=True).sample(n=n_per_class, replace=False, random_state=1)
 
 
 
 ############################ classification
 
 # convert to vectors for training/testing in sklearn
-corpus = df[TXT_COL].tolist()
+corpus = tokens.rows(df.index)
 X = vectorizer.fit_transform(corpus)
 y = df["lucidity"].map({"nonlucid":NONLUCID_DIGIT, "lucid":LUCID_DIGIT}).values
 
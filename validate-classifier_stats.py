@@ -5,8 +5,8 @@ IMPORTS
     - numpy file with clf predictions and labels, derivatives/validate-classifier.npz
 EXPORTS
 =======
-    - table of raw performance metrics at each cv fold,   derivatives/validate-classifier_cv.npz
-    - table of performance metrics averaged across folds, derivatives/validate-classifier_avg.npz
+    - table of raw performance metrics at each cv fold,   derivatives/validate-classifier_cv.tsv
+    - table of performance metrics averaged across folds, results/validate-classifier_avg.tsv
 """
 import os
 import numpy as np
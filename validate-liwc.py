@@ -2,14 +2,14 @@
 
 IMPORTS
 =======
-    - non-lemmatized posts, derivatives/dreamviews-posts.tsv
-    - LIWC dictionary,      dictionaries/custom.dic
+    - non-lemmatized posts,              derivatives/dreamviews-posts.tsv
+    - LIWC tokens (from clean-tokens.py), derivatives/dreamviews-tokens_liwc-ids.npy
+    - LIWC dictionary,                    dictionaries/custom.dic
 EXPORTS
 =======
     - traditional (ie, total) LIWC scores for each dream report, derivatives/validate-liwc_scores.tsv
-    IF WORD-LEVEL ANALYSIS
-    - numpy arrays for frequency of each LIWC word and the corresponding post ID,
-        derivatives/validate-liwc_wordscores-[data.npz] and [attr.npz]
+    - (only with --words) numpy arrays for frequency of each LIWC word, derivatives/validate-liwc_wordscores-data.npz
+    - (only with --words) and the corresponding post IDs,               derivatives/validate-liwc_wordscores-attr.npz
 
 The LIWC application/gui and its dictionaries are proprietary (https://liwc.net/).
 But if you have the dictionaries, the application is just a word search
@@ -23,9 +23,8 @@ to get frequencies of *each word* in each category. So in the end there
 is a total/traditional LIWC score (ie, frequency of all category words)
 and also the ability to count individual word contributions.
 
-You can just get traditional LIWC scores, which is faster and uses less
-memory, or you can add the --words flag to also export a sparse matrix
-holding individual word frequencies.
+You can just get traditional LIWC scores, or you can add the --words
+flag to also export a sparse matrix holding individual word frequencies.
 
 The one mystery is how the proprietary LIWC app tokenizes text when
 running the word search. Here, the nltk TweetTokenizer is used bc
@@ -34,6 +33,9 @@ is important for some LIWC categories. Then the liwc-python package
 (https://github.com/chbrown/liwc-python) is used to count words.
 This combo might be slightly different than "official" LIWC, but any
 differences overall are likely minimal, and with such great benefits!
+The tokenizing happens once in clean-tokens.py (see tokencorpus.tokenize_liwc)
+and this just loads the token counts of each post, so each different
+token only has to be looked up in the dictionary once.
 """
 import os
 import tqdm
@@ -44,8 +46,6 @@ import config as c
 
 from scipy import sparse
 
-from collections import Counter
-import nltk
 import liwc
 
 
@@ -53,16 +53,12 @@ import liwc
 
 # handle command-line arguments
 parser = argparse.ArgumentParser()
-parser.add_argument("-w", "--words", action="store_true", help="Get individual word contributions. Slower, more memory, extra files.")
+parser.add_argument("-w", "--words", action="store_true", help="Get individual word contributions too, in extra files.")
 args = parser.parse_args()
 
 GET_WORD_CONTRIBUTIONS = args.words
 
 
-# allow for progress bar using pandas
-tqdm.tqdm.pandas(desc="word-level LIWCing" if GET_WORD_CONTRIBUTIONS else "LIWCing")
-
-
 ############################ I/O
 
 # identify filenames
@@ -72,9 +68,16 @@ if GET_WORD_CONTRIBUTIONS:
     export_fname2 = os.path.join(c.DATA_DIR, "derivatives", "validate-liwc_wordscores-data.npz")
     export_fname3 = os.path.join(c.DATA_DIR, "derivatives", "validate-liwc_wordscores-attr.npz")
 
-# load data
-df = c.load_dreamviews_posts()
-ser = df.set_index("post_id")["post_clean"]
+# load data (already tokenized, see clean-tokens.py), sorted by post just bc it looks nice
+df = c.load_dreamviews_posts(columns=["post_id"]).sort_values("post_id")
+tokens = c.load_dreamviews_tokens("liwc")
+rows = tokens.rows(df["post_id"])
+post_ids = df["post_id"].to_numpy()
+
+# how many times each different token is in each post (posts x vocab),
+# counted straight from the token IDs, and how many tokens each post has
+counts = tokens.count_matrix(rows)
+n_tokens = tokens.lengths(rows)
 
 # load LIWC parser, which takes a single token and finds all LIWC categories it's a part of
 parse, category_names = liwc.load_token_parser(dict_fname)
@@ -88,111 +91,89 @@ if GET_WORD_CONTRIBUTIONS:
 
 
 
-############################ create an appropriate tokenizer for liwc
+############################ the tokenizer for liwc
 
 # LIWC vocab includes lots of apostrophed and hyphenated words, and emojis.
 # The nltk tweet tokenizer is good for this situation, but I also wanna get rid of punctuation.
-tknzr = nltk.tokenize.TweetTokenizer()
-def tokenize4liwc(doc):
-    # lowercase and break into tokens
-    tokens = tknzr.tokenize(doc.lower())
-    # remove isolated puncuation
-    tokens = [ t for t in tokens if not (len(t)==1 and not t.isalpha()) ]
-    return tokens
+# (That's all done already, in tokencorpus.tokenize_liwc, so the docs here are already tokens.)
 
 
 
 ############################ run LIWC
 
-# there's an easier way, without token/word frequencies and more concise code.
-# so for now I'll leave that as a separate code chunk in case I want it later.
-# but otherwise this could be more concise. weird.
-
-if not GET_WORD_CONTRIBUTIONS: # Not using this but leaving it to show the much simpler case.
-    
-    def liwc_single_doc(doc):
-        """Return, for a single document, total frequencies of each LIWC category
-        """
-        tokenized_doc = tokenize4liwc(doc)
-        n_tokens = len(tokenized_doc)
-        # get the counts for each category and divide them by the number of tokens/words in the document
-        counts = Counter(category for token in tokenized_doc for category in parse(token))
-        freqs = { category: n/n_tokens for category, n in counts.items() }
-        return freqs
-
-    res = ser.progress_apply(liwc_single_doc).apply(pd.Series)
-
-    df = res.apply(pd.Series).fillna(0) # replace empty cells with zero, bc it means they had none of those words
-    df = df[category_names] # reorder according to the LIWC dic file, just for cleanliness
-    df = df.sort_index()    # also just bc it looks nice
-
-    # export
-    df.to_csv(export_fname, float_format="%.2f", index=True, sep="\t", encoding="utf-8")
-
-else: # The more complex case of wanting individual word frequencies.
-
-    def liwc_single_doc(doc):
-        """Return, for a single document
-        the total frequency of each LIWC category
-        and also the total frequency for each unique word in the relevant LIWC corpus.
-
-        Each doc gets 2 counters, one for category freq and one for token freq.
-        The token freq functions like a general token counter but limits itself
-        to words that are in the LIWC corpus (combined across all categories).
-        """
-        # initialize counters
-        category_counts = Counter()
-        token_counts = Counter()
-        # tokenize document
-        tokenized_doc = tokenize4liwc(doc)
-        n_tokens = len(tokenized_doc)
-        # loop over all tokens in the doc
-        for token in tokenized_doc:
-            # For each token/word, I wanna see if it's in a category,
-            # but can't just add it if it is, because of the globbed (*) words.
-            # Eg, zombie's, zombies, and zombie need to all be zombie* (if that's in a vocab).
-            # So this does a hacky thing to see if the token contributes to a category
-            # and then compare it with other words in the vocab.
-            current_state = category_counts.copy()
-            # update the category counter (just one token at a time, dumb)
-            category_counts.update(parse(token))
-            if current_state != category_counts: # True if the token is in *any* category, bc counter changed
-                if token in vocab_fulls: # it's in normal vocab of non-globbed/stemmed words, just update
-                    token_counts.update([token])
-                # elif token in vocab_stems:
-                else:# it's in the vocab of globbed/stem words,
-                    # or it's not, like "recalled" isn't in any but still counts for "recall*".
-                    # find the appropriate stem by continuously removing
-                    # the end letter until it's found (probably stupid)
-                    while token not in vocab_stems:
-                        token = token[:-1]
-                    token += "*" # put the asterisk back
-                    token_counts.update([token])
-                # else: # it's an extension not found
-                #     raise Warning("Should never reach here.")
-        # normalize counts so they are relative to total word/token count
-        cat_freqs = { category: n/n_tokens for category, n in category_counts.items() }
-        tok_freqs = { token: n/n_tokens for token, n in token_counts.items() }
-        return cat_freqs, tok_freqs
-
-    # run it
-    res = ser.progress_apply(liwc_single_doc).apply(pd.Series)
-    (_, cats), (_, toks) = res.items()
-
-    # compile into useful objects
-    cats = cats.apply(pd.Series).fillna(0).sort_index(axis=0)[category_names]
-    toks = toks.apply(pd.Series).fillna(0).sort_index(axis=0).sort_index(axis=1)
-    ### ^^^ this step is pretty rough on the tokens (wrt memory usage)
-
-    # export the traditional LIWC results (ie, total category counts)
-    ######## I think - for the tokens - this is too much memory used at once
-    ######## and the file is big so use sparse matrix instead.
-    cats.to_csv(export_fname, sep="\t", encoding="utf-8", index=True, float_format="%.2f")
-    # toks.to_csv(export_fname_toks, sep="\t", encoding="utf-8", index=True, float_format="%.2f")
+# Every post is made of the same tokens from the vocab, so each different token
+# only gets LIWCed once here, and the posts get their totals from their token counts
+# (a posts x vocab matrix times a vocab x category matrix is each post's category counts).
+
+def liwc_single_token(token):
+    """Return, for a single token, the LIWC categories it's a part of
+    and (if it's in any) the word of the LIWC corpus it counts as.
+
+    The word is what the individual word frequencies are counted by.
+    Can't just use the token, because of the globbed (*) words.
+    Eg, zombie's, zombies, and zombie need to all be zombie* (if that's in a vocab).
+    """
+    categories = list(parse(token))
+    if not categories:
+        return categories, None
+    if token in vocab_fulls: # it's in normal vocab of non-globbed/stemmed words
+        return categories, token
+    # it's in the vocab of globbed/stem words,
+    # or it's not, like "recalled" isn't in any but still counts for "recall*".
+    # find the appropriate stem by continuously removing
+    # the end letter until it's found (probably stupid)
+    while token not in vocab_stems:
+        token = token[:-1]
+    return categories, token + "*" # put the asterisk back
+
+def relative(matrix):
+    """Divide each post's (row's) counts by its total word/token count."""
+    matrix = matrix.astype(float)
+    matrix.data /= np.repeat(n_tokens, np.diff(matrix.indptr))
+    return matrix
+
+category_index = { category: i for i, category in enumerate(category_names) }
+token_categories = [] # (vocab ID, category index) for each time a token counts for a category
+token_words = {}      # vocab ID: LIWC word
+for i, token in enumerate(tqdm.tqdm(tokens.vocab, desc="LIWCing the vocab")):
+    if GET_WORD_CONTRIBUTIONS:
+        categories, word = liwc_single_token(token)
+        if word is not None:
+            token_words[i] = word
+    else:
+        categories = parse(token)
+    token_categories.extend( (i, category_index[category]) for category in categories )
+
+def vocab_matrix(pairs, n_columns):
+    """Sparse vocab x n_columns matrix with a 1 for each (vocab ID, column) pair (repeats add up)."""
+    vocab_ids, columns = np.array(pairs, dtype=np.int64).reshape(-1, 2).T
+    data = np.ones(len(vocab_ids), dtype=np.int32)
+    return sparse.csr_matrix((data, (vocab_ids, columns)), shape=(len(tokens.vocab), n_columns))
+
+# get the counts for each category and divide them by the number of tokens/words in the document
+cat_counts = counts @ vocab_matrix(token_categories, len(category_names))
+cats = pd.DataFrame(relative(cat_counts).toarray(), columns=category_names,
+    index=pd.Index(post_ids, name="post_id"))
+
+# export the traditional LIWC results (ie, total category counts)
+cats.to_csv(export_fname, float_format="%.2f", index=True, sep="\t", encoding="utf-8")
+
+if GET_WORD_CONTRIBUTIONS: # The more complex case of wanting individual word frequencies.
+
+    # the total frequency for each unique word in the relevant LIWC corpus.
+    # This functions like a general token counter but limits itself
+    # to words that are in the LIWC corpus (combined across all categories).
+    words = sorted(set(token_words.values()))
+    word_index = { word: j for j, word in enumerate(words) }
+    tok_counts = counts @ vocab_matrix([ (i, word_index[w]) for i, w in token_words.items() ], len(words))
+    # only the words that show up in any of the posts
+    keep = np.flatnonzero(tok_counts.getnnz(axis=0))
+    toks = relative(tok_counts[:, keep])
+    toks.eliminate_zeros()
 
     # export the word-level results
-    M = sparse.csr_matrix(toks.values)
-    T = toks.columns.values
-    P = toks.index.values
+    M = toks
+    T = np.array(words, dtype=object)[keep]
+    P = post_ids
     sparse.save_npz(export_fname2, M, compressed=True)
     np.savez(export_fname3, token=T, post_id=P)
@@ -4,7 +4,8 @@
 IMPORTS
 =======
     - original post info,     derivatives/dreamviews-posts.tsv
-    - word-level LIWC scores, derivatives/validate-liwc_wordscores.tsv
+    - word-level LIWC scores, derivatives/validate-liwc_wordscores-data.npz
+    - and their post IDs,     derivatives/validate-liwc_wordscores-attr.npz
     - LIWC dictionary,        dictionaries/custom.dic
 EXPORTS
 =======
@@ -49,8 +50,8 @@ export_fname = os.path.join(c.DATA_DIR, "results", "validate-liwc_wordscores-sta
 #### load in the original posts file to get attributes lucidity and user_id
 # and drop un-labeled posts.
 # merge the clean data file and all its attributes with the liwc results
-posts = c.load_dreamviews_posts()
-posts = posts.set_index("post_id")[["user_id", "lucidity"]]
+posts = c.load_dreamviews_posts(columns=["post_id", "user_id", "lucidity"])
+posts = posts.set_index("post_id")
 posts = posts[ posts["lucidity"].str.contains("lucid") ]
 
 # #### load prior full LIWC results (i.e., category results)
@@ -89,9 +90,9 @@ assert len(df) == len(posts)
 
 # Average the LD and NLD scores of each token for each user.
 # Some users might not have both dream types and they'll be removed.
-avgs = df.groupby(["user_id", "lucidity"]
+avgs = df.groupby(["user_id", "lucidity"], observed=True
     ).mean().rename_axis(columns="token"
-    ).pivot_table(index="user_id", columns="lucidity"
+    ).pivot_table(index="user_id", columns="lucidity", observed=True
     ).dropna()
 
 # We already have only relevant tokens, so get effect
@@ -11,16 +11,17 @@ Bigrams are included in the wordshift by first transforming text with gensim.
 
 IMPORTS
 =======
-    - lemmatized posts, derivatives/dreamviews-posts.tsv
+    - lemmatized posts,                    derivatives/dreamviews-posts.tsv
+    - lemma tokens (from clean-tokens.py), derivatives/dreamviews-tokens_lemmas-ids.npy
 EXPORTS
 =======
     - raw JSD shift scores for lucidity,          results/validate-wordshift_jsd-scores.tsv
     - default JSD shift plot for lucidity,        results/validate-wordshift_jsd-plot.png
     - raw NRC-fear shift scores for nightmares,   results/validate-wordshift_fear-scores.tsv
-    - default NRC-fear shift plot for nightmares, results/validate-wordshift_fear-plot.tsv
-    - default proportion shift plot for lucidity, results/validate-wordshift_proportion-plot.tsv
-    - table of top 1-grams higher in LDs,         results/validate-wordshift_proportion-top1grams.tsv
-    - table of top 2-grams higher in LDs,         results/validate-wordshift_proportion-top2grams.tsv
+    - default NRC-fear shift plot for nightmares, results/validate-wordshift_fear-plot.png
+    - default proportion shift plot for lucidity, results/validate-wordshift_proportion-plot.png
+    - table of top 1-grams higher in LDs,         results/validate-wordshift_proportion-ld1grams.tsv
+    - table of top 2-grams higher in LDs,         results/validate-wordshift_proportion-ld2grams.tsv
 """
 import os
 import tqdm
@@ -29,6 +30,7 @@ import argparse
 import numpy as np
 import pandas as pd
 import config as c
+import tokencorpus
 
 import shifterator as sh
 from gensim.models.phrases import Phrases, Phraser
@@ -54,11 +56,13 @@ export_fname_prop_plot  = os.path.join(c.DATA_DIR, "results", f"validate-wordshi
 export_fname_top1grams  = os.path.join(c.DATA_DIR, "results", f"validate-wordshift_proportion-ld1grams.tsv")
 export_fname_top2grams  = os.path.join(c.DATA_DIR, "results", f"validate-wordshift_proportion-ld2grams.tsv")
 
-df = c.load_dreamviews_posts()
-
-TXT_COL = "post_lemmas"
+TXT_COL = "post_lemmas" # (what the ngrams are made from)
 TOP_N = 100 # just for the tables of top 1- and 2-grams raw proportion differences
 
+df = c.load_dreamviews_posts(columns=["post_id", "user_id", "lucidity", "nightmare"])
+tokens = c.load_dreamviews_tokens("lemmas")
+rows = tokens.rows(df["post_id"])
+
 
 ################################### Connect common bigrams.
 
@@ -66,20 +70,31 @@ TOP_N = 100 # just for the tables of top 1- and 2-grams raw proportion differenc
 # replace_regex = r"(?<=\b)(" + r"|".join(stops) + r")(?=\b)"
 # df[TXT_COL] = df[TXT_COL].replace(replace_regex, "", regex=True).str.strip()
 
-if not NO_BIGRAMS: # sorry for the double negative
+# Everything gets counted from token IDs (see tokencorpus), so the ngrams
+# are a TokenCorpus too, either the lemmas themselves or the lemmas with bigrams mixed in.
+if NO_BIGRAMS: # sorry for the double negative
+    ngrams = tokens
+    df["row"] = rows
+else:
+    class PostTokens:
+        """The lemmas of each post, made one post at a time
+        (gensim needs words, but not all of them at once)."""
+        def __iter__(self):
+            return ( tokens.tokens(row) for row in rows )
     # build bigram model and convert text column to bigrams
     min_count = 1 # ignore all words and bigrams with total collected count lower than this value
     threshold = 1
     delim = "_" # for joining bigrams
     scoring = "default"
-    sentences = df[TXT_COL].str.lower().str.split().tolist()
+    sentences = PostTokens()
     # connector_words=ENGLISH_CONNECTOR_WORDS
     phrase_model = Phrases(sentences, delimiter=delim, min_count=min_count, threshold=threshold, scoring="default")
     # phrase_model = Phrases(phrase_model[sentences], delimiter=delim, min_count=3, threshold=threshold, scoring=scoring)
     phrase_model = Phraser(phrase_model) # memory benefits?
-    unigram2ngram = lambda x: phrase_model[x]
-    tqdm.tqdm.pandas(desc="mixing bigrams into corpus")
-    df[TXT_COL] = df[TXT_COL].str.lower().str.split().progress_apply(unigram2ngram).str.join(" ")
+    unigram2ngram = lambda row: phrase_model[tokens.tokens(row)]
+    ngrams = tokencorpus.build(tqdm.tqdm(rows, desc="mixing bigrams into corpus"),
+        df["post_id"].tolist(), unigram2ngram)
+    df["row"] = np.arange(len(df)) # in the same order as df
 # def find_ngrams(input_list, n):
 #     return zip(*[input_list[i:] for i in range(n)])
 # def ngrams(x, n):
@@ -94,13 +109,13 @@ if not NO_BIGRAMS: # sorry for the double negative
 ################################### Extract data for analyses.
 
 
-# lucidity series for JSD and proportion shifts
+# lucidity series for JSD and proportion shifts (of each post's row in ngrams)
 ld_ser = df.query("lucidity.str.contains('lucid')", engine="python"
-    ).set_index(["lucidity", "user_id"])[TXT_COL]
+    ).set_index(["lucidity", "user_id"])["row"]
 
 # nightmare series for the NRC fear shift
 df["nightmare"] = df["nightmare"].map({True:"nightmare", False:"nonnightmare"})
-nm_ser = df.set_index(["nightmare", "user_id"])[TXT_COL]
+nm_ser = df.set_index(["nightmare", "user_id"])["row"]
 
 
 
@@ -129,17 +144,18 @@ def shift2df(shift, detail_level):
     df_ = pd.DataFrame(score_dicts).sort_index().rename_axis("ngram")
     return df_
 
+def counts2freqs(counts):
+    """Turn an array of counts for each ngram ID into {ngram: count} of the ones that show up."""
+    ids = np.flatnonzero(counts)
+    return dict(zip(ngrams.vocab[ids].tolist(), counts[ids].tolist()))
+
 def get_simple_freqs(series, group1, group2):
     """Return word frequencies without any normalization.
     Just raw counts.
     """
-    # split reports and explode to one ngram per row
-    ngram_ser = series.str.lower().str.split().explode()
-    ngrams_1 = ngram_ser.loc[group1]
-    ngrams_2 = ngram_ser.loc[group2]
     # count ngram frequencies
-    ngram2freq_1 = ngrams_1.value_counts().to_dict()
-    ngram2freq_2 = ngrams_2.value_counts().to_dict()
+    ngram2freq_1 = counts2freqs(ngrams.counts(series.loc[group1].to_numpy()))
+    ngram2freq_2 = counts2freqs(ngrams.counts(series.loc[group2].to_numpy()))
     return ngram2freq_1, ngram2freq_2
 
 
@@ -149,26 +165,15 @@ def get_normed_freqs(series, group1, group2):
     divided by the amount of posts that user contributed.
     Then *those* are added across the corpus, instead of raw counts.
     """
-    # get post frequency per user, for each corpus
-    user2freq_1 = series.loc[group1].groupby("user_id").size()
-    user2freq_2 = series.loc[group2].groupby("user_id").size()
-    # user2freq_1 = ngrams_1.index.value_counts().to_dict()
-    # user2freq_2 = ngrams_2.index.value_counts().to_dict()
-
-    # get ngram frequencies per user, for each corpus
-    ngram_ser = series.str.lower().str.split().explode()
-    ngrams_1 = ngram_ser.loc[group1]
-    ngrams_2 = ngram_ser.loc[group2]
-    userngrams2freq_1 = ngrams_1.groupby("user_id").value_counts()
-    userngrams2freq_2 = ngrams_2.groupby("user_id").value_counts()
-
-    # normalize each ngram frequency for each user, for each corpus
-    userngrams2norm_1 = userngrams2freq_1 / user2freq_1 # (user's ngram frequency over document frequency)
-    userngrams2norm_2 = userngrams2freq_2 / user2freq_2
-
-    # sum across normalized user/ngram frequencies, for each corpus
-    ngram2freq_1 = userngrams2norm_1.groupby(TXT_COL).sum().to_dict()
-    ngram2freq_2 = userngrams2norm_2.groupby(TXT_COL).sum().to_dict()
+    def normed_counts(user_rows):
+        # get post frequency per user (for each of the user's posts)
+        user2freq = user_rows.groupby("user_id", observed=True).transform("size")
+        # adding up each post's ngrams divided by its user's post frequency
+        # is the same as dividing each user's ngram frequency and adding those
+        return ngrams.counts(user_rows.to_numpy(), weights=1/user2freq.to_numpy())
+
+    ngram2freq_1 = counts2freqs(normed_counts(series.loc[group1]))
+    ngram2freq_2 = counts2freqs(normed_counts(series.loc[group2]))
 
     # # get n users that use a given ngram
     # ngram2userfreq_1 = ngrams_1.reset_index().groupby("post_lemmas")["user_id"].nunique()
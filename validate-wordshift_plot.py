@@ -2,8 +2,7 @@
 
 IMPORTS
 =======
-    - raw JSD shift scores for lucidity,           results/validate-wordshift_jsd-scores.tsv
-    - raw NRC-fear shift scores for nightmares,    results/validate-wordshift_fear-scores.tsv
+    - raw shift scores (JSD for lucidity or NRC-fear for nightmares), results/validate-wordshift_<shift>-scores.tsv
 EXPORTS
 =======
     - visualization of a shift, results/validate-wordshift_<shift>-myplot.png